@@ -1,10 +1,107 @@
-// =================== 完整通訊版本 v2 (增加查詢功能) ===================
+// =================== 完整通訊版本（協定版本見 PROTOCOL_VERSION） ===================
 
 const int ledPins[] = {9, 10, 11};
 const int NUM_LEDS = sizeof(ledPins) / sizeof(ledPins[0]); // 更彈性的寫法，自動計算 LED 數量
 
 int brightness[NUM_LEDS] = {0}; // C++ 會自動將剩餘元素初始化為 0
 
+// =================== 二進位 frame 協定 (v8) ===================
+// | 0xA5 | OPCODE | LEN | PAYLOAD (LEN bytes) | CRC8 |
+// CRC8 (poly 0x07, init 0x00) 計算範圍為 OPCODE、LEN 與 PAYLOAD
+// 0xA5 不會出現在 ASCII 文字中，所以可以和原本的文字指令共用同一條序列埠
+const byte PROTOCOL_VERSION = 8; // 1: 二進位 frame, 2: 漸變指令, 3: 主動回報亮度變化, 4: 位元遮罩群組設定, 5: 序號 frame 與確認, 6: pattern 程式, 7: 16 位元燈號的區段 / 點陣圖寫入與分段讀取, 8: 寫入後立即回覆結果
+const byte FRAME_START = 0xA5;
+const byte MAX_PAYLOAD = 32;
+const unsigned long FRAME_TIMEOUT_MS = 50; // frame 中途停頓超過這個時間就丟棄
+
+// Host -> Arduino
+const byte OP_SET = 0x01;    // payload: id, value
+const byte OP_BATCH = 0x02;  // payload: (id, value) * n
+const byte OP_STATUS = 0x03; // 無 payload
+const byte OP_INFO = 0x04;   // 無 payload
+const byte OP_FADE = 0x05;   // payload: id, value, duration_ms (uint16, little-endian)
+const byte OP_REPORT = 0x06; // payload: 1 開啟 / 0 關閉主動回報
+const byte OP_MASK = 0x07;   // payload: value, mask（bit i = 第 i 顆燈，little-endian，超出 NUM_LEDS 的位元忽略）
+const byte OP_SEQ = 0x08;    // payload: seq, opcode, 原本的 payload；依序處理後回覆 OP_ACK
+const byte OP_SYNC = 0x09;   // payload: 下一個序號
+const byte OP_PATTERN_BEGIN = 0x0A; // payload: 步驟數, 圈數 (uint16，0 為無限)；停止並清除原本的 pattern
+const byte OP_PATTERN_STEP = 0x0B;  // payload: 步驟編號, 旗標, 毫秒 (uint16), 燈的遮罩 (uint16), 遮罩中每顆燈的值
+const byte OP_PATTERN_RUN = 0x0C;   // payload: 1 從頭開始播放 / 0 停止
+const byte OP_PATTERN_QUERY = 0x0D; // 無 payload
+const byte OP_RUNS = 0x0E;          // payload: (起始燈號 (uint16), 燈數, 每顆燈的值) * n
+const byte OP_SPARSE = 0x0F;        // payload: 基準燈號 (uint16), 點陣圖長度, 點陣圖（bit i = 基準 + i），點陣圖中每顆燈的值
+const byte OP_STATUS_RANGE = 0x10;  // payload: 起始燈號 (uint16), 燈數
+const byte OP_SET_CONFIRM = 0x11;   // payload: (燈號 (uint16), 值) * n；套用後以 OP_CONFIRM_REPLY 回覆實際的亮度
+// Arduino -> Host
+const byte OP_STATUS_REPLY = 0x81; // payload: 每顆燈的亮度
+const byte OP_INFO_REPLY = 0x82;   // payload: LED 數量（超過 255 顆時為 uint16）
+const byte OP_CHANGE = 0x83;       // payload: id, value（主動回報）
+const byte OP_ACK = 0x84;          // payload: seq, 結果（0 成功，否則為錯誤碼）
+const byte OP_SYNC_REPLY = 0x85;   // payload: 下一個序號
+const byte OP_PATTERN_REPLY = 0x86; // payload: 播放中, 步驟數, 目前步驟, 圈數 (uint16), 總圈數 (uint16), 燈的遮罩 (uint16)
+const byte OP_STATUS_RANGE_REPLY = 0x87; // payload: 起始燈號 (uint16), 每顆燈的亮度
+const byte OP_CONFIRM_REPLY = 0x88;      // payload: (燈號 (uint16), 套用後的亮度) * n
+const byte OP_ERROR = 0xE0;        // payload: 錯誤碼, 出錯的 opcode
+
+const byte ERR_CRC = 0x01;
+const byte ERR_OPCODE = 0x02;
+const byte ERR_LENGTH = 0x03;
+const byte ERR_RANGE = 0x04;
+
+enum FrameState { WAIT_START, WAIT_OPCODE, WAIT_LENGTH, WAIT_PAYLOAD, WAIT_CRC };
+FrameState frameState = WAIT_START;
+byte frameOpcode = 0;
+byte frameLength = 0;
+byte frameIndex = 0;
+byte framePayload[MAX_PAYLOAD];
+unsigned long frameStartedAt = 0;
+// 下一個要處理的序號，序號不連續的 frame（前面有遺失）直接丟棄，等 Host 重送
+byte expectedSeq = 0;
+
+// ASCII 指令緩衝區，逐字元累積到換行為止，不再用會阻塞 loop 的 readStringUntil
+const byte LINE_BUFFER_SIZE = 96;
+char lineBuffer[LINE_BUFFER_SIZE];
+byte lineLength = 0;
+// ==============================================================
+
+// =================== 漸變 (fade) ===================
+// Arduino 依 millis() 自行內插 PWM 值，Host 只需要送出一個指令
+const unsigned long MAX_FADE_MS = 65535;
+bool fading[NUM_LEDS] = {false};
+int fadeFrom[NUM_LEDS];
+int fadeTo[NUM_LEDS];
+unsigned long fadeStartedAt[NUM_LEDS];
+unsigned long fadeDuration[NUM_LEDS];
+// ===================================================
+
+// =================== 主動回報 ===================
+// 開啟後，Arduino 自行造成的亮度變化（例如漸變結束）會主動送給 Host，
+// 以開啟時使用的協定回報：ASCII 為 `C,id,val`，二進位為 OP_CHANGE frame
+const byte REPORT_OFF = 0;
+const byte REPORT_ASCII = 1;
+const byte REPORT_BINARY = 2;
+byte reportMode = REPORT_OFF;
+// ================================================
+
+// =================== Pattern ===================
+// Host 上傳一次關鍵影格，Arduino 依 millis() 自行播放，播放期間不需要任何序列埠流量
+// 每個步驟中遮罩內的燈在步驟結束時到達目標值：STEP_RAMP 時以漸變過去，否則步驟一開始就切換
+const byte MAX_PATTERN_STEPS = 16;
+const byte STEP_RAMP = 0x01;
+byte patternStepCount = 0;
+unsigned int patternLoops = 0;
+byte patternFlags[MAX_PATTERN_STEPS];
+unsigned int patternDurations[MAX_PATTERN_STEPS];
+unsigned int patternMasks[MAX_PATTERN_STEPS];
+byte patternValues[MAX_PATTERN_STEPS][NUM_LEDS];
+bool patternRunning = false;
+byte patternStep = 0;
+unsigned int patternLoop = 0;
+unsigned long patternStepStartedAt = 0;
+// 目前由 pattern 控制的燈，Host 寫入某顆燈時該燈離開 pattern
+unsigned int patternLights = 0;
+// ================================================
+
 void setup() {
   Serial.begin(9600);
   for (int i = 0; i < NUM_LEDS; i++) {
@@ -15,10 +112,31 @@ void setup() {
 }
 
 void loop() {
-  if (Serial.available() > 0) {
-    String command = Serial.readStringUntil('\n');
-    command.trim();
-    processCommand(command);
+  while (Serial.available() > 0) {
+    byte c = Serial.read();
+    if (frameState != WAIT_START) {
+      feedFrame(c);
+    } else if (c == FRAME_START) {
+      frameState = WAIT_OPCODE;
+      frameStartedAt = millis();
+    } else if (c == '\n') {
+      lineBuffer[lineLength] = '\0';
+      lineLength = 0;
+      String command = String(lineBuffer);
+      command.trim();
+      processCommand(command);
+    } else if (lineLength < LINE_BUFFER_SIZE - 1) {
+      lineBuffer[lineLength++] = c;
+    }
+  }
+
+  updatePattern();
+  updateFades();
+
+  // 不完整的 frame（例如傳輸中掉了位元組）逾時後丟棄，回到等待 START 的狀態
+  if (frameState != WAIT_START && millis() - frameStartedAt > FRAME_TIMEOUT_MS) {
+    sendError(ERR_LENGTH, frameOpcode);
+    frameState = WAIT_START;
   }
 }
 
@@ -26,16 +144,34 @@ void processCommand(String command) {
   if (command.startsWith("<") && command.endsWith(">")) {
     // (這部分和之前一樣，省略註解)
     command = command.substring(1, command.length() - 1);
+    // =================== 批次設定 ===================
+    // 含有 ';' 代表一次設定多顆燈：<id,val;id,val;...>
+    if (command.indexOf(';') >= 0) {
+      applyBatch(command);
+      return;
+    }
+    // ================================================
     int commaIndex = command.indexOf(',');
     if (commaIndex > 0) {
+      // =================== 漸變設定 ===================
+      // 第三個欄位是漸變毫秒數：<id,val,ms>
+      int secondCommaIndex = command.indexOf(',', commaIndex + 1);
+      if (secondCommaIndex > 0) {
+        int ledIndex = command.substring(0, commaIndex).toInt();
+        int value = command.substring(commaIndex + 1, secondCommaIndex).toInt();
+        long duration = command.substring(secondCommaIndex + 1).toInt();
+        if (ledIndex >= 0 && ledIndex < NUM_LEDS) {
+          startFade(ledIndex, constrain(value, 0, 255), constrain(duration, 0, (long)MAX_FADE_MS));
+        }
+        return;
+      }
+      // ================================================
       String indexStr = command.substring(0, commaIndex);
       String valueStr = command.substring(commaIndex + 1);
       int ledIndex = indexStr.toInt();
       int value = valueStr.toInt();
       if (ledIndex >= 0 && ledIndex < NUM_LEDS) {
-        value = constrain(value, 0, 255);
-        analogWrite(ledPins[ledIndex], value);
-        brightness[ledIndex] = value;
+        setLed(ledIndex, constrain(value, 0, 255)); // 和二進位 SET 一樣，會把這顆燈交還給 host
       }
     }
   } 
@@ -46,9 +182,69 @@ void processCommand(String command) {
   else if (command == "i") {
     reportInfo(); // 當收到 'i' 指令時，呼叫 reportInfo 函數
   }
+  // =================== 群組設定 ===================
+  // m<遮罩(16 進位)>,<val>：把同一個值套用到遮罩中的每顆燈，例如 m7,0 關閉前三顆燈
+  else if (command.startsWith("m")) {
+    int commaIndex = command.indexOf(',');
+    if (commaIndex > 1) {
+      unsigned long mask = strtoul(command.substring(1, commaIndex).c_str(), NULL, 16);
+      int value = constrain(command.substring(commaIndex + 1).toInt(), 0, 255);
+      for (int i = 0; i < NUM_LEDS && i < 32; i++) {
+        if (mask & (1UL << i)) {
+          setLed(i, value);
+        }
+      }
+    }
+  }
+  // ================================================
+  else if (command == "r1" || command == "r0") {
+    reportMode = (command == "r1") ? REPORT_ASCII : REPORT_OFF;
+  }
+  else if (command == "v") {
+    // 協定協商：回傳支援的二進位協定版本，Host 收到後改用二進位 frame
+    Serial.print("V,");
+    Serial.println(PROTOCOL_VERSION);
+  }
   // ======================================================
 }
 
+// =================== 批次設定函數 ===================
+// 先解析完整個 frame，全部合法才一次套用，確保多顆燈同時更新；
+// 任何一組格式錯誤或 ID 超出範圍時，整個 frame 都不套用
+void applyBatch(String body) {
+  int pending[NUM_LEDS];
+  for (int i = 0; i < NUM_LEDS; i++) {
+    pending[i] = -1;
+  }
+
+  int start = 0;
+  while (start < (int)body.length()) {
+    int end = body.indexOf(';', start);
+    if (end < 0) {
+      end = body.length();
+    }
+    String pair = body.substring(start, end);
+    int commaIndex = pair.indexOf(',');
+    if (commaIndex <= 0) {
+      return;
+    }
+    int ledIndex = pair.substring(0, commaIndex).toInt();
+    int value = pair.substring(commaIndex + 1).toInt();
+    if (ledIndex < 0 || ledIndex >= NUM_LEDS) {
+      return;
+    }
+    pending[ledIndex] = constrain(value, 0, 255);
+    start = end + 1;
+  }
+
+  for (int i = 0; i < NUM_LEDS; i++) {
+    if (pending[i] >= 0) {
+      setLed(i, pending[i]);
+    }
+  }
+}
+// ====================================================
+
 void reportStatus() {
   String status = "S,";
   for (int i = 0; i < NUM_LEDS; i++) {
@@ -66,4 +262,496 @@ void reportInfo() {
   Serial.print("I,");
   Serial.println(NUM_LEDS);
 }
-// ===============================================
\ No newline at end of file
+// ===============================================
+
+// =================== 二進位 frame 函數 ===================
+byte crc8Update(byte crc, byte data) {
+  crc ^= data;
+  for (byte i = 0; i < 8; i++) {
+    crc = (crc & 0x80) ? (byte)((crc << 1) ^ 0x07) : (byte)(crc << 1);
+  }
+  return crc;
+}
+
+void feedFrame(byte c) {
+  switch (frameState) {
+    case WAIT_OPCODE:
+      frameOpcode = c;
+      frameState = WAIT_LENGTH;
+      break;
+    case WAIT_LENGTH:
+      if (c > MAX_PAYLOAD) {
+        sendError(ERR_LENGTH, frameOpcode);
+        frameState = WAIT_START;
+        break;
+      }
+      frameLength = c;
+      frameIndex = 0;
+      frameState = (frameLength == 0) ? WAIT_CRC : WAIT_PAYLOAD;
+      break;
+    case WAIT_PAYLOAD:
+      framePayload[frameIndex++] = c;
+      if (frameIndex >= frameLength) {
+        frameState = WAIT_CRC;
+      }
+      break;
+    case WAIT_CRC: {
+      frameState = WAIT_START;
+      byte crc = crc8Update(0, frameOpcode);
+      crc = crc8Update(crc, frameLength);
+      for (byte i = 0; i < frameLength; i++) {
+        crc = crc8Update(crc, framePayload[i]);
+      }
+      if (crc != c) {
+        // 明確回報 CRC 錯誤，而不是默默丟棄
+        sendError(ERR_CRC, frameOpcode);
+        break;
+      }
+      processFrame();
+      break;
+    }
+    default:
+      frameState = WAIT_START;
+  }
+}
+
+void processFrame() {
+  if (frameOpcode == OP_SEQ) {
+    processSeqFrame();
+    return;
+  }
+  if (frameOpcode == OP_SYNC) {
+    if (frameLength != 1) {
+      sendError(ERR_LENGTH, frameOpcode);
+      return;
+    }
+    expectedSeq = framePayload[0];
+    sendFrame(OP_SYNC_REPLY, &expectedSeq, 1);
+    return;
+  }
+  byte result = executeFrame(frameOpcode, framePayload, frameLength);
+  if (result != 0) {
+    sendError(result, frameOpcode);
+  }
+}
+
+void processSeqFrame() {
+  if (frameLength < 2) {
+    sendError(ERR_LENGTH, frameOpcode);
+    return;
+  }
+  byte ack[2] = {framePayload[0], 0};
+  byte ahead = framePayload[0] - expectedSeq;
+  if (ahead >= 0x80) {
+    // 確認遺失而重送的舊 frame：已經處理過，只重新確認
+    sendFrame(OP_ACK, ack, 2);
+    return;
+  }
+  if (ahead != 0) {
+    return;
+  }
+  expectedSeq++;
+  // 錯誤以 ACK 的結果欄位回報，查詢的回應照常送出
+  ack[1] = executeFrame(framePayload[1], framePayload + 2, frameLength - 2);
+  sendFrame(OP_ACK, ack, 2);
+}
+
+// 執行一個指令，回傳 0 表示成功，否則為錯誤碼
+byte executeFrame(byte opcode, const byte *payload, byte length) {
+  switch (opcode) {
+    case OP_SET:
+      if (length != 2) {
+        return ERR_LENGTH;
+      }
+      if (payload[0] >= NUM_LEDS) {
+        return ERR_RANGE;
+      }
+      setLed(payload[0], payload[1]);
+      break;
+    case OP_BATCH:
+      if (length == 0 || length % 2 != 0) {
+        return ERR_LENGTH;
+      }
+      // 先檢查整個 frame，全部合法才一次套用
+      for (byte i = 0; i < length; i += 2) {
+        if (payload[i] >= NUM_LEDS) {
+          return ERR_RANGE;
+        }
+      }
+      for (byte i = 0; i < length; i += 2) {
+        setLed(payload[i], payload[i + 1]);
+      }
+      break;
+    case OP_FADE:
+      if (length != 4) {
+        return ERR_LENGTH;
+      }
+      if (payload[0] >= NUM_LEDS) {
+        return ERR_RANGE;
+      }
+      startFade(payload[0], payload[1], (unsigned long)payload[2] | ((unsigned long)payload[3] << 8));
+      break;
+    case OP_MASK:
+      if (length < 2) {
+        return ERR_LENGTH;
+      }
+      // 一個 frame 就能設定任意多顆燈，例如全部關閉
+      for (int i = 0; i < NUM_LEDS && i / 8 < length - 1; i++) {
+        if (payload[1 + i / 8] & (1 << (i % 8))) {
+          setLed(i, payload[0]);
+        }
+      }
+      break;
+    case OP_REPORT:
+      if (length != 1) {
+        return ERR_LENGTH;
+      }
+      reportMode = payload[0] ? REPORT_BINARY : REPORT_OFF;
+      break;
+    case OP_PATTERN_BEGIN:
+      if (length != 3) {
+        return ERR_LENGTH;
+      }
+      if (payload[0] > MAX_PATTERN_STEPS) {
+        return ERR_RANGE;
+      }
+      if (patternRunning) {
+        stopPattern();
+      }
+      patternStepCount = payload[0];
+      patternLoops = payload[1] | (payload[2] << 8);
+      for (byte i = 0; i < patternStepCount; i++) {
+        patternFlags[i] = 0;
+        patternDurations[i] = 0;
+        patternMasks[i] = 0;
+      }
+      break;
+    case OP_PATTERN_STEP: {
+      if (length < 6) {
+        return ERR_LENGTH;
+      }
+      byte index = payload[0];
+      unsigned int mask = payload[4] | (payload[5] << 8);
+      byte count = 0;
+      for (byte i = 0; i < 16; i++) {
+        if (mask & (1 << i)) {
+          if (i >= NUM_LEDS) {
+            return ERR_RANGE;
+          }
+          count++;
+        }
+      }
+      if (length != 6 + count) {
+        return ERR_LENGTH;
+      }
+      if (index >= patternStepCount) {
+        return ERR_RANGE;
+      }
+      patternFlags[index] = payload[1];
+      patternDurations[index] = payload[2] | (payload[3] << 8);
+      patternMasks[index] = mask;
+      byte k = 6;
+      for (int i = 0; i < NUM_LEDS; i++) {
+        if (mask & (1 << i)) {
+          patternValues[index][i] = payload[k++];
+        }
+      }
+      break;
+    }
+    case OP_PATTERN_RUN:
+      if (length != 1) {
+        return ERR_LENGTH;
+      }
+      if (payload[0]) {
+        if (patternStepCount == 0) {
+          return ERR_RANGE;
+        }
+        startPattern();
+      } else if (patternRunning) {
+        stopPattern();
+      }
+      break;
+    case OP_PATTERN_QUERY: {
+      byte reply[9] = {
+        (byte)patternRunning, patternStepCount, patternStep,
+        lowByte(patternLoop), highByte(patternLoop),
+        lowByte(patternLoops), highByte(patternLoops),
+        lowByte(patternLights), highByte(patternLights),
+      };
+      sendFrame(OP_PATTERN_REPLY, reply, 9);
+      break;
+    }
+    case OP_RUNS: {
+      // 先檢查所有區段，全部合法才一次套用
+      byte k = 0;
+      while (k < length) {
+        if (k + 3 > length || payload[k + 2] == 0 || k + 3 + payload[k + 2] > length) {
+          return ERR_LENGTH;
+        }
+        if ((long)(payload[k] | (payload[k + 1] << 8)) + payload[k + 2] > NUM_LEDS) {
+          return ERR_RANGE;
+        }
+        k += 3 + payload[k + 2];
+      }
+      if (length == 0) {
+        return ERR_LENGTH;
+      }
+      for (k = 0; k < length; k += 3 + payload[k + 2]) {
+        unsigned int start = payload[k] | (payload[k + 1] << 8);
+        for (byte i = 0; i < payload[k + 2]; i++) {
+          setLed(start + i, payload[k + 3 + i]);
+        }
+      }
+      break;
+    }
+    case OP_SPARSE: {
+      if (length < 3 || length < 3 + payload[2]) {
+        return ERR_LENGTH;
+      }
+      unsigned int base = payload[0] | (payload[1] << 8);
+      byte bitmapLength = payload[2];
+      byte count = 0;
+      long last = -1;
+      for (int i = 0; i < bitmapLength * 8; i++) {
+        if (payload[3 + i / 8] & (1 << (i % 8))) {
+          count++;
+          last = (long)base + i;
+        }
+      }
+      if (count == 0 || length != 3 + bitmapLength + count) {
+        return ERR_LENGTH;
+      }
+      if (last >= NUM_LEDS) {
+        return ERR_RANGE;
+      }
+      byte k = 3 + bitmapLength;
+      for (int i = 0; i < bitmapLength * 8; i++) {
+        if (payload[3 + i / 8] & (1 << (i % 8))) {
+          setLed(base + i, payload[k++]);
+        }
+      }
+      break;
+    }
+    case OP_STATUS_RANGE: {
+      if (length != 3) {
+        return ERR_LENGTH;
+      }
+      unsigned int start = payload[0] | (payload[1] << 8);
+      byte count = payload[2];
+      if (count == 0 || count > MAX_PAYLOAD - 2 || (long)start + count > NUM_LEDS) {
+        return ERR_RANGE;
+      }
+      byte reply[MAX_PAYLOAD];
+      reply[0] = lowByte(start);
+      reply[1] = highByte(start);
+      for (byte i = 0; i < count; i++) {
+        reply[2 + i] = brightness[start + i];
+      }
+      sendFrame(OP_STATUS_RANGE_REPLY, reply, 2 + count);
+      break;
+    }
+    case OP_SET_CONFIRM: {
+      if (length == 0 || length % 3 != 0) {
+        return ERR_LENGTH;
+      }
+      // 先檢查整個 frame，全部合法才一次套用
+      for (byte i = 0; i < length; i += 3) {
+        if ((payload[i] | (payload[i + 1] << 8)) >= NUM_LEDS) {
+          return ERR_RANGE;
+        }
+      }
+      for (byte i = 0; i < length; i += 3) {
+        setLed(payload[i] | (payload[i + 1] << 8), payload[i + 2]);
+      }
+      // 回覆的是套用後 brightness[] 中的值，Host 不需要再查詢一次
+      byte reply[MAX_PAYLOAD];
+      for (byte i = 0; i < length; i += 3) {
+        reply[i] = payload[i];
+        reply[i + 1] = payload[i + 1];
+        reply[i + 2] = brightness[payload[i] | (payload[i + 1] << 8)];
+      }
+      sendFrame(OP_CONFIRM_REPLY, reply, length);
+      break;
+    }
+    case OP_STATUS:
+      if (NUM_LEDS > MAX_PAYLOAD) {
+        // 一個回應放不下所有燈，Host 應該改用 OP_STATUS_RANGE
+        return ERR_LENGTH;
+      }
+      sendStatusFrame();
+      break;
+    case OP_INFO: {
+      byte count[2] = {lowByte(NUM_LEDS), highByte(NUM_LEDS)};
+      sendFrame(OP_INFO_REPLY, count, NUM_LEDS > 255 ? 2 : 1);
+      break;
+    }
+    default:
+      return ERR_OPCODE;
+  }
+  return 0;
+}
+
+void setLed(int ledIndex, byte value) {
+  releasePatternLight(ledIndex);
+  writeLed(ledIndex, value);
+}
+
+void writeLed(int ledIndex, byte value) {
+  analogWrite(ledPins[ledIndex], value);
+  brightness[ledIndex] = value;
+  fading[ledIndex] = false; // 直接設定亮度會中斷進行中的漸變
+}
+
+void sendFrame(byte opcode, const byte *payload, byte length) {
+  byte crc = crc8Update(0, opcode);
+  crc = crc8Update(crc, length);
+  Serial.write(FRAME_START);
+  Serial.write(opcode);
+  Serial.write(length);
+  for (byte i = 0; i < length; i++) {
+    Serial.write(payload[i]);
+    crc = crc8Update(crc, payload[i]);
+  }
+  Serial.write(crc);
+}
+
+void sendStatusFrame() {
+  byte payload[NUM_LEDS];
+  for (int i = 0; i < NUM_LEDS; i++) {
+    payload[i] = brightness[i];
+  }
+  sendFrame(OP_STATUS_REPLY, payload, NUM_LEDS);
+}
+
+void sendError(byte code, byte opcode) {
+  byte payload[2] = {code, opcode};
+  sendFrame(OP_ERROR, payload, 2);
+}
+// =========================================================
+
+// =================== 漸變函數 ===================
+void startFade(int ledIndex, int target, unsigned long duration) {
+  releasePatternLight(ledIndex);
+  beginFade(ledIndex, target, duration);
+}
+
+void beginFade(int ledIndex, int target, unsigned long duration) {
+  if (duration == 0) {
+    writeLed(ledIndex, target);
+    return;
+  }
+  updateFades(); // 先把進行中的漸變推進到現在，新的漸變從目前亮度開始
+  fadeFrom[ledIndex] = brightness[ledIndex];
+  fadeTo[ledIndex] = target;
+  fadeStartedAt[ledIndex] = millis();
+  fadeDuration[ledIndex] = duration;
+  fading[ledIndex] = true;
+}
+
+void updateFades() {
+  unsigned long now = millis();
+  for (int i = 0; i < NUM_LEDS; i++) {
+    if (!fading[i]) {
+      continue;
+    }
+    unsigned long elapsed = now - fadeStartedAt[i];
+    int value;
+    bool finished = elapsed >= fadeDuration[i];
+    if (finished) {
+      value = fadeTo[i];
+      fading[i] = false;
+    } else {
+      value = fadeFrom[i] + (int)((long)(fadeTo[i] - fadeFrom[i]) * (long)elapsed / (long)fadeDuration[i]);
+    }
+    if (value != brightness[i]) {
+      analogWrite(ledPins[i], value);
+      brightness[i] = value;
+    }
+    // pattern 中的漸變結束不回報，播放期間不產生任何序列埠流量
+    if (finished && !(patternLights & (1 << i))) {
+      reportChange(i, value);
+    }
+  }
+}
+
+void reportChange(int ledIndex, int value) {
+  if (reportMode == REPORT_ASCII) {
+    Serial.print("C,");
+    Serial.print(ledIndex);
+    Serial.print(",");
+    Serial.println(value);
+  } else if (reportMode == REPORT_BINARY) {
+    byte payload[2] = {(byte)ledIndex, (byte)value};
+    sendFrame(OP_CHANGE, payload, 2);
+  }
+}
+// ================================================
+
+// =================== Pattern 播放 ===================
+void updatePattern() {
+  if (!patternRunning) {
+    return;
+  }
+  if (millis() - patternStepStartedAt < patternDurations[patternStep]) {
+    return;
+  }
+  // 下一個步驟從這個步驟預定的結束時間起算，不會因為 loop() 的延遲而逐圈累積誤差
+  patternStepStartedAt += patternDurations[patternStep];
+  patternStep++;
+  if (patternStep >= patternStepCount) {
+    patternStep = 0;
+    patternLoop++;
+    if (patternLoops != 0 && patternLoop >= patternLoops) {
+      stopPattern();
+      return;
+    }
+  }
+  enterPatternStep();
+}
+
+void enterPatternStep() {
+  for (int i = 0; i < NUM_LEDS; i++) {
+    if (!(patternMasks[patternStep] & (1 << i)) || !(patternLights & (1 << i))) {
+      continue;
+    }
+    if (patternFlags[patternStep] & STEP_RAMP) {
+      beginFade(i, patternValues[patternStep][i], patternDurations[patternStep]);
+    } else {
+      writeLed(i, patternValues[patternStep][i]);
+    }
+  }
+}
+
+void startPattern() {
+  patternLights = 0;
+  for (byte i = 0; i < patternStepCount; i++) {
+    patternLights |= patternMasks[i];
+  }
+  patternRunning = true;
+  patternStep = 0;
+  patternLoop = 0;
+  patternStepStartedAt = millis();
+  enterPatternStep();
+}
+
+// 停止播放：燈停在當下的亮度，並回報 pattern 中每顆燈的最後亮度
+void stopPattern() {
+  updateFades();
+  patternRunning = false;
+  unsigned int lights = patternLights;
+  patternLights = 0;
+  for (int i = 0; i < NUM_LEDS; i++) {
+    if (lights & (1 << i)) {
+      fading[i] = false;
+      reportChange(i, brightness[i]);
+    }
+  }
+}
+
+void releasePatternLight(int ledIndex) {
+  patternLights &= ~(1 << ledIndex);
+  if (patternRunning && patternLights == 0) {
+    patternRunning = false;
+  }
+}
+// ====================================================
@@ -0,0 +1,348 @@
+import argparse, asyncio, json, math, os, socket, subprocess, sys, threading, time
+from dataclasses import dataclass, asdict
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+from mcp import ClientSession
+from mcp.client.streamable_http import streamablehttp_client
+
+from src.simulator import LinkConfig, SimulatedLink, VirtualArduino, serve_tcp
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@dataclass
+class Scenario:
+    name: str
+    # 這個情境額外經過的層，用來對照各層的開銷
+    description: str
+    # (worker 編號, 第幾次呼叫, 燈數) -> (工具名稱, 參數)
+    call: Callable[[int, int, int], Tuple[str, dict]]
+
+
+# 由淺到深排列：get_write_stats 只經過 HTTP + JSON-RPC，get_lights_statuses 再加上 pydantic 序列化，
+# force_refresh 與寫入類工具才真正經過序列埠，相鄰情境的延遲差距就是該層的開銷
+SCENARIOS: Dict[str, Scenario] = {
+    scenario.name: scenario for scenario in [
+        Scenario("get_write_stats", "HTTP + JSON-RPC only", lambda w, i, n: ("get_write_stats", {})),
+        Scenario("get_lights_statuses", "+ pydantic, served from the shadow cache", lambda w, i, n: ("get_lights_statuses", {})),
+        Scenario("get_light_count", "+ cached light count", lambda w, i, n: ("get_light_count", {})),
+        Scenario(
+            "get_lights_statuses_refresh", "+ serial round trip",
+            lambda w, i, n: ("get_lights_statuses", {"force_refresh": True}),
+        ),
+        Scenario(
+            "set_light_brightness", "+ serial write",
+            # 每次都換一個值，避免被寫入合併層當成未變更而略過
+            lambda w, i, n: ("set_light_brightness", {"light_id": w % n, "brightness": (i * 7 + w) % 101}),
+        ),
+        Scenario(
+            "blink_light", "+ background effect writes",
+            lambda w, i, n: ("blink_light", {"light_id": w % n, "times": 1, "interval": 0.05}),
+        ),
+    ]
+}
+
+
+@dataclass
+class ScenarioResult:
+    scenario: str
+    description: str
+    concurrency: int
+    ops: int
+    errors: int
+    duration_s: float
+    ops_per_sec: float
+    latency_ms: Dict[str, float]
+    # 模擬器收發的總位元組數除以呼叫次數；連到外部伺服器（--url）時無法量測
+    serial_bytes_per_op: Optional[float]
+
+
+def _percentile(sorted_values: List[float], p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    # nearest-rank
+    rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class SimulatorThread(threading.Thread):
+    """在獨立的 thread 與 event loop 中執行模擬的 Arduino，避免和壓測 client 搶同一個 event loop。"""
+
+    def __init__(self, boards: int, leds: int, config: LinkConfig):
+        super().__init__(name="simulator", daemon=True)
+        self.links = [SimulatedLink(VirtualArduino(leds), config) for _ in range(boards)]
+        self.ports = [_free_port() for _ in range(boards)]
+        self.ready = threading.Event()
+
+    @property
+    def urls(self) -> List[str]:
+        return [f"socket://127.0.0.1:{port}" for port in self.ports]
+
+    @property
+    def serial_bytes(self) -> int:
+        return sum(link.bytes_in + link.bytes_out for link in self.links)
+
+    def run(self):
+        asyncio.run(self._serve())
+
+    async def _serve(self):
+        servers = [await serve_tcp(link, "127.0.0.1", port) for link, port in zip(self.links, self.ports)]
+        self.ready.set()
+        await asyncio.gather(*[server.serve_forever() for server in servers])
+
+
+def _start_server(port: int, device_urls: List[str], server_env: Dict[str, str], server_args: List[str], log_path: Optional[str]) -> subprocess.Popen:
+    env = dict(os.environ, SERIAL_PORTS=",".join(device_urls), **server_env)
+    log = open(log_path, "w") if log_path else subprocess.DEVNULL
+    return subprocess.Popen(
+        [sys.executable, "-m", "src.server", "--host", "127.0.0.1", "--port", str(port), *server_args],
+        cwd=SERVER_DIR, env=env, stdout=log, stderr=subprocess.STDOUT,
+    )
+
+
+async def _wait_until_ready(url: str, timeout: float = 20.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            async with streamablehttp_client(url) as (read, write, _):
+                async with ClientSession(read, write) as session:
+                    await session.initialize()
+                    # 第一次呼叫會建立序列埠連線並協商協定，不計入量測
+                    await session.call_tool("get_light_count", {})
+                    return
+        except Exception:
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"MCP server at {url} is not ready after {timeout}s")
+            await asyncio.sleep(0.3)
+
+
+def _is_error(result) -> bool:
+    if result.isError:
+        return True
+    return bool(result.content) and getattr(result.content[0], "text", "").startswith("❌")
+
+
+async def _run_scenario(
+    url: str, scenario: Scenario, concurrency: int, duration: float, led_count: int,
+    simulator: Optional[SimulatorThread], settle: float, session_per_call: bool = False,
+) -> ScenarioResult:
+    latencies: List[float] = []
+    errors = 0
+    start = asyncio.Event()
+    deadline = 0.0
+    initialized = 0
+    all_initialized = asyncio.Event()
+
+    async def call_once(name: str, arguments: dict) -> bool:
+        # 模擬每次對話都開新 session 的 gateway：initialize、呼叫、關閉都計入延遲
+        async with streamablehttp_client(url) as (read, write, _):
+            async with ClientSession(read, write) as session:
+                await session.initialize()
+                return _is_error(await session.call_tool(name, arguments))
+
+    async def fresh_session_worker(worker_id: int):
+        nonlocal errors, initialized
+        initialized += 1
+        if initialized == concurrency:
+            all_initialized.set()
+        await start.wait()
+        i = 0
+        while time.perf_counter() < deadline:
+            name, arguments = scenario.call(worker_id, i, led_count)
+            started = time.perf_counter()
+            try:
+                failed = await call_once(name, arguments)
+            except Exception:
+                failed = True
+            latencies.append(time.perf_counter() - started)
+            errors += failed
+            i += 1
+
+    async def worker(worker_id: int):
+        nonlocal errors, initialized
+        if session_per_call:
+            return await fresh_session_worker(worker_id)
+        async with streamablehttp_client(url) as (read, write, _):
+            async with ClientSession(read, write) as session:
+                await session.initialize()
+                initialized += 1
+                if initialized == concurrency:
+                    all_initialized.set()
+                await start.wait()
+                i = 0
+                while time.perf_counter() < deadline:
+                    name, arguments = scenario.call(worker_id, i, led_count)
+                    started = time.perf_counter()
+                    try:
+                        failed = _is_error(await session.call_tool(name, arguments))
+                    except Exception:
+                        failed = True
+                    latencies.append(time.perf_counter() - started)
+                    errors += failed
+                    i += 1
+
+    tasks = [asyncio.create_task(worker(w)) for w in range(concurrency)]
+    await all_initialized.wait()
+    bytes_before = simulator.serial_bytes if simulator else 0
+    started = time.perf_counter()
+    deadline = started + duration
+    start.set()
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+    # 等背景效果（例如閃爍）把剩下的指令送完再統計位元組數
+    await asyncio.sleep(settle)
+
+    ops = len(latencies)
+    latencies.sort()
+    latency_ms = {
+        "mean": round(sum(latencies) / ops * 1000, 3) if ops else 0.0,
+        "p50": round(_percentile(latencies, 50) * 1000, 3),
+        "p95": round(_percentile(latencies, 95) * 1000, 3),
+        "p99": round(_percentile(latencies, 99) * 1000, 3),
+        "max": round(latencies[-1] * 1000, 3) if ops else 0.0,
+    }
+    bytes_per_op = None
+    if simulator is not None and ops:
+        bytes_per_op = round((simulator.serial_bytes - bytes_before) / ops, 2)
+    return ScenarioResult(
+        scenario=scenario.name,
+        description=scenario.description,
+        concurrency=concurrency,
+        ops=ops,
+        errors=errors,
+        duration_s=round(elapsed, 3),
+        ops_per_sec=round(ops / elapsed, 2) if elapsed else 0.0,
+        latency_ms=latency_ms,
+        serial_bytes_per_op=bytes_per_op,
+    )
+
+
+def _print_results(results: List[ScenarioResult]):
+    print(f"{'scenario':<30}{'conc':>5}{'ops':>8}{'ops/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'bytes/op':>10}{'errors':>8}")
+    for r in results:
+        bytes_per_op = "-" if r.serial_bytes_per_op is None else f"{r.serial_bytes_per_op:.1f}"
+        print(
+            f"{r.scenario:<30}{r.concurrency:>5}{r.ops:>8}{r.ops_per_sec:>10.1f}"
+            f"{r.latency_ms['p50']:>10.2f}{r.latency_ms['p95']:>10.2f}{r.latency_ms['p99']:>10.2f}"
+            f"{bytes_per_op:>10}{r.errors:>8}"
+        )
+
+
+def _print_comparison(results: List[ScenarioResult], baseline_path: str):
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = {(r["scenario"], r["concurrency"]): r for r in json.load(f)["results"]}
+    print(f"\nCompared with {baseline_path}:")
+    print(f"{'scenario':<30}{'conc':>5}{'ops/s':>12}{'p50':>12}{'p99':>12}")
+    for r in results:
+        old = baseline.get((r.scenario, r.concurrency))
+        if old is None:
+            continue
+
+        def delta(new: float, before: float) -> str:
+            return f"{(new - before) / before * 100:+.1f}%" if before else "-"
+
+        print(
+            f"{r.scenario:<30}{r.concurrency:>5}{delta(r.ops_per_sec, old['ops_per_sec']):>12}"
+            f"{delta(r.latency_ms['p50'], old['latency_ms']['p50']):>12}{delta(r.latency_ms['p99'], old['latency_ms']['p99']):>12}"
+        )
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=SERVER_DIR, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+async def _main(args) -> int:
+    simulator = None
+    server = None
+    url = args.url
+    server_env = dict(item.split("=", 1) for item in args.server_env)
+    try:
+        if url is None:
+            config = LinkConfig(baudrate=args.baud, latency=args.latency_ms / 1000, boot_delay=0.2, seed=0)
+            simulator = SimulatorThread(args.boards, args.leds, config)
+            simulator.start()
+            simulator.ready.wait()
+            port = _free_port()
+            server = _start_server(port, simulator.urls, server_env, args.server_arg, args.server_log)
+            url = f"http://127.0.0.1:{port}/mcp"
+        await _wait_until_ready(url)
+
+        led_count = args.leds * args.boards
+        results = []
+        for name in args.scenarios:
+            for concurrency in args.concurrency:
+                result = await _run_scenario(url, SCENARIOS[name], concurrency, args.duration, led_count, simulator, args.settle, args.session_per_call)
+                results.append(result)
+                print(f"{name} x{concurrency}: {result.ops_per_sec:.1f} ops/s, p50 {result.latency_ms['p50']:.2f} ms", flush=True)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=10)
+
+    print()
+    _print_results(results)
+    if args.compare:
+        _print_comparison(results, args.compare)
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "git_commit": _git_commit(),
+            "python": sys.version.split()[0],
+            "url": args.url,
+            "simulated": simulator is not None,
+            "baud": args.baud if simulator else None,
+            "latency_ms": args.latency_ms if simulator else None,
+            "boards": args.boards,
+            "leds": args.leds,
+            "duration_s": args.duration,
+            "server_env": server_env,
+            "server_args": args.server_arg,
+            "session_per_call": args.session_per_call,
+            "label": args.label,
+        },
+        "results": [asdict(result) for result in results],
+    }
+    output = args.output or os.path.join(
+        SERVER_DIR, "bench", "results", f"{datetime.now():%Y%m%d-%H%M%S}{'-' + args.label if args.label else ''}.json",
+    )
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"\nResults saved to {output}")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the lights MCP server over streamable HTTP")
+    parser.add_argument("--url", type=str, default=None, help="Benchmark an already running server (e.g. http://127.0.0.1:2828/mcp) instead of starting one against the simulator")
+    parser.add_argument("--scenarios", nargs="+", default=list(SCENARIOS), choices=list(SCENARIOS), help="Scenarios to run")
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 8], help="Number of concurrent MCP sessions, several values run the scenario once for each")
+    parser.add_argument("--duration", type=float, default=5.0, help="Seconds to run each scenario")
+    parser.add_argument("--settle", type=float, default=0.3, help="Seconds to wait for background writes before counting serial bytes")
+    parser.add_argument("--boards", type=int, default=1, help="Number of simulated boards")
+    parser.add_argument("--leds", type=int, default=3, help="Number of LEDs on each simulated board")
+    parser.add_argument("--baud", type=int, default=9600, help="Baud rate of the simulated serial link, 0 to disable pacing")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Extra reply latency of the simulated Arduino")
+    parser.add_argument("--server-env", action="append", default=[], metavar="KEY=VALUE", help="Extra environment variable for the server, can be repeated")
+    parser.add_argument("--server-arg", action="append", default=[], metavar="ARG", help="Extra command line argument for the server (e.g. --server-arg=--stateless), can be repeated")
+    parser.add_argument("--session-per-call", action="store_true", help="Open a new MCP session (initialize, call, close) for every call, like gateways which open a session per chat turn")
+    parser.add_argument("--server-log", type=str, default=None, help="Write the server output to this file")
+    parser.add_argument("--label", type=str, default=None, help="Label stored in the results and appended to the file name")
+    parser.add_argument("--output", type=str, default=None, help="Path of the JSON results, defaults to bench/results/<timestamp>.json")
+    parser.add_argument("--compare", type=str, default=None, help="Previous JSON results to compare with")
+    args = parser.parse_args()
+
+    sys.exit(asyncio.run(_main(args)))
@@ -0,0 +1,487 @@
+import argparse, asyncio, json, os, random, sys, time
+from dataclasses import dataclass, asdict, field
+from datetime import datetime
+from typing import Dict, List, Optional, Set
+
+from mcp import ClientSession
+from mcp.client.streamable_http import streamablehttp_client
+from pydantic import ValidationError
+
+from bench.mcp_bench import SERVER_DIR, SimulatorThread, _free_port, _git_commit, _is_error, _percentile, _start_server, _wait_until_ready
+from src.models.auduino import FetchLightsInfoOutput, LightInfo, LightsRangeOutput, PatternStatusOutput
+from src.simulator import LinkConfig
+
+# 每種操作的預設權重：寫入自己的燈、讀取全部（快取）、直接向 Arduino 讀取單顆燈、範圍查詢、查詢燈數、閃爍
+DEFAULT_MIX = {"write": 4, "read": 2, "read_light": 2, "read_range": 1, "count": 1, "blink": 1}
+# 違規紀錄最多保留的筆數（計數不受限制）
+MAX_VIOLATION_SAMPLES = 50
+# 壓測前檢查 pattern 的燈：前幾顆燈播放呼吸燈，再以寫入合併層的群組寫入把燈設回播放前的值
+PATTERN_LIGHTS = 3
+PATTERN_PERIOD_MS = 400
+# 指令在佇列中超過呼叫期限而沒有送出時，工具回傳的錯誤訊息（負載過高時的預期行為，不算失敗）
+DEADLINE_MESSAGES = ("passed its deadline", "passed before it was queued")
+
+
+def _to_pwm(value_100: int) -> int:
+    # 與伺服器相同的換算
+    return int(round((value_100 / 100.0) * 255))
+
+
+def _to_percent(value_255: int) -> int:
+    return int(round((value_255 / 255.0) * 100))
+
+
+@dataclass
+class Expected:
+    """
+    一顆燈預期的亮度：最後一次成功寫入的值，以及之後失敗的寫入（可能已經送到 Arduino，也可能沒有）。
+
+    每顆被寫入的燈只屬於一個 client，client 依序呼叫工具，因此讀取時不會有自己尚未完成的寫入。
+    """
+
+    acked: int = 0
+    uncertain: Set[int] = field(default_factory=set)
+
+    def allowed(self) -> Set[int]:
+        return {self.acked} | self.uncertain
+
+
+@dataclass
+class Violation:
+    concurrency: int
+    client: int
+    operation: str
+    message: str
+
+
+@dataclass
+class LevelResult:
+    concurrency: int
+    ops: int
+    # 回傳錯誤的呼叫數，不含逾期
+    errors: int
+    error_rate: float
+    # 超過呼叫期限而沒有送出的呼叫數
+    expired: int
+    violations: int
+    duration_s: float
+    ops_per_sec: float
+    # 全部操作合計的延遲
+    latency_ms: Dict[str, float]
+    # 各種操作的呼叫次數、錯誤數、逾期數與延遲
+    operations: Dict[str, dict]
+    # 結束後 Arduino、伺服器快取與預期狀態的比對結果
+    final_state_ok: bool
+
+
+class Tracker:
+    """
+    記錄壓測期間的預期狀態、延遲與違規。
+
+    Args:
+        led_count (int): 總燈數。
+        owned (int): 前 `owned` 顆燈分別屬於編號相同的 client，只有它會寫入；其餘 client 只讀取與閃爍。
+        blink_lights (List[int]): 只用來閃爍的燈，效果結束後為 0。
+    """
+
+    def __init__(self, led_count: int, owned: int, blink_lights: List[int]):
+        self.led_count = led_count
+        self.owned = owned
+        self.blink_lights = blink_lights
+        # 預期狀態跨越各個並行數保留，Arduino 的狀態也不會在兩輪之間重置
+        self.expected: Dict[int, Expected] = {light_id: Expected() for light_id in range(owned)}
+        self.violations: List[Violation] = []
+        self.violation_count = 0
+        self.reset_level(0)
+
+    def reset_level(self, concurrency: int):
+        self.concurrency = concurrency
+        self.latencies: Dict[str, List[float]] = {name: [] for name in DEFAULT_MIX}
+        self.errors: Dict[str, int] = {name: 0 for name in DEFAULT_MIX}
+        self.expired: Dict[str, int] = {name: 0 for name in DEFAULT_MIX}
+        self.level_violations = 0
+
+    def violate(self, client: int, operation: str, message: str):
+        self.violation_count += 1
+        self.level_violations += 1
+        if len(self.violations) < MAX_VIOLATION_SAMPLES:
+            self.violations.append(Violation(self.concurrency, client, operation, message))
+
+    def check_owned(self, client: int, operation: str, light_id: int, value_100: int):
+        """檢查 client 讀到的自己的燈是否為它最後寫入的值。"""
+        expected = self.expected.get(light_id)
+        if expected is None or light_id != client:
+            return
+        if value_100 not in expected.allowed():
+            self.violate(client, operation, f"light-{light_id} reads {value_100}%, expected one of {sorted(expected.allowed())}")
+
+
+class Client:
+    """一個 MCP session，依權重隨機挑選操作並檢查每個回應。"""
+
+    def __init__(self, client_id: int, tracker: Tracker, mix: Dict[str, int], think: float, seed: int):
+        self.client_id = client_id
+        self.tracker = tracker
+        self.own_light = client_id if client_id < tracker.owned else None
+        self.think = think
+        self.random = random.Random(seed * 100003 + client_id)
+        # 沒有自己的燈的 client 不寫入
+        names = [name for name in mix if mix[name] > 0 and (name != "write" or self.own_light is not None)]
+        self.operations = names
+        self.weights = [mix[name] for name in names]
+
+    async def run(self, session: ClientSession, deadline: float):
+        while time.perf_counter() < deadline:
+            name = self.random.choices(self.operations, self.weights)[0]
+            await self.call(session, name)
+            if self.think:
+                await asyncio.sleep(self.random.uniform(0, 2 * self.think))
+
+    def _target(self) -> int:
+        return self.own_light if self.own_light is not None else self.random.randrange(self.tracker.led_count)
+
+    async def call(self, session: ClientSession, name: str):
+        tracker = self.tracker
+        if name == "write":
+            light_id, value = self.own_light, self.random.randint(0, 100)
+            arguments = {"light_id": light_id, "brightness": value}
+            tool = "set_light_brightness"
+        elif name == "read":
+            tool, arguments = "get_lights_statuses", {}
+        elif name == "read_light":
+            tool, arguments = "get_lights_statuses", {"light_id": self._target(), "force_refresh": True}
+        elif name == "read_range":
+            light_id = self._target()
+            start = self.random.randint(max(0, light_id - 15), light_id)
+            count = self.random.randint(light_id - start + 1, min(tracker.led_count - start, 32))
+            tool, arguments = "get_lights_statuses", {"start": start, "count": count}
+        elif name == "count":
+            tool, arguments = "get_light_count", {}
+        else:
+            tool, arguments = "blink_light", {"light_id": self.random.choice(tracker.blink_lights), "times": 1, "interval": 0.02}
+
+        started = time.perf_counter()
+        try:
+            result = await session.call_tool(tool, arguments)
+            failed = _is_error(result)
+            text = getattr(result.content[0], "text", "") if result.content else ""
+        except Exception as e:
+            failed, text = True, repr(e)
+        tracker.latencies[name].append(time.perf_counter() - started)
+
+        if name == "write":
+            expected = tracker.expected[light_id]
+            if failed:
+                # 失敗的寫入可能已經送到 Arduino（例如確認逾時），在下一次成功寫入前兩種結果都算正確
+                expected.uncertain.add(value)
+            else:
+                expected.acked, expected.uncertain = value, set()
+                # 只有這個 client 會寫這顆燈，Arduino 回覆的亮度一定是剛寫入的值；不同時代表回應被交給了其他寫入
+                if text != f"The bightness of light-{light_id} is set to {value}%, confirmed by the Arduino":
+                    tracker.violate(self.client_id, name, f"unexpected reply {text!r}")
+        if failed:
+            if any(message in text for message in DEADLINE_MESSAGES):
+                tracker.expired[name] += 1
+            else:
+                tracker.errors[name] += 1
+            return
+        try:
+            self.check(name, arguments, text)
+        except (ValueError, ValidationError) as e:
+            tracker.violate(self.client_id, name, f"reply does not parse ({e.__class__.__name__}): {text[:200]!r}")
+
+    def check(self, name: str, arguments: dict, text: str):
+        tracker = self.tracker
+        if name == "read":
+            infos = FetchLightsInfoOutput.model_validate_json(text).infos
+            if [info.light_id for info in infos] != list(range(tracker.led_count)):
+                tracker.violate(self.client_id, name, f"expected lights 0-{tracker.led_count - 1}, got {len(infos)} lights")
+            for info in infos:
+                self.check_value(name, info.light_id, info.brightness)
+        elif name == "read_light":
+            info = LightInfo.model_validate_json(text)
+            if info.light_id != arguments["light_id"]:
+                # 回應被交給了查詢其他燈的呼叫端
+                tracker.violate(self.client_id, name, f"asked for light-{arguments['light_id']}, got light-{info.light_id}")
+            self.check_value(name, info.light_id, info.brightness)
+        elif name == "read_range":
+            output = LightsRangeOutput.model_validate_json(text)
+            if output.start != arguments["start"] or len(output.brightness) != arguments["count"]:
+                tracker.violate(
+                    self.client_id, name,
+                    f"asked for {arguments['count']} lights from light-{arguments['start']}, got {len(output.brightness)} from light-{output.start}",
+                )
+            for offset, value in enumerate(output.brightness):
+                self.check_value(name, output.start + offset, value)
+        elif name == "count":
+            if int(text) != tracker.led_count:
+                tracker.violate(self.client_id, name, f"expected {tracker.led_count} lights, got {text!r}")
+        elif name == "blink":
+            if "effect_id" not in text:
+                tracker.violate(self.client_id, name, f"unexpected reply {text!r}")
+
+    def check_value(self, name: str, light_id: int, value_100: int):
+        if not 0 <= value_100 <= 100:
+            self.tracker.violate(self.client_id, name, f"light-{light_id} reads {value_100}%, outside [0-100]")
+        self.tracker.check_owned(self.client_id, name, light_id, value_100)
+
+
+async def _wait_effects_done(session: ClientSession, timeout: float):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        result = await session.call_tool("list_effects", {})
+        if not json.loads(result.content[0].text)["effects"]:
+            return
+        await asyncio.sleep(0.1)
+    raise RuntimeError(f"Effects are still running {timeout}s after the clients stopped")
+
+
+async def _check_final_state(url: str, tracker: Tracker, simulator: SimulatorThread, settle: float) -> bool:
+    """
+    所有 client 停止、背景效果結束後，比對 Arduino（模擬器）的實際亮度、伺服器的快取與預期狀態：
+    被寫入的燈應為最後一次成功寫入的值，閃爍的燈與其他沒有寫入的燈應為 0。
+    """
+    async with streamablehttp_client(url) as (read, write, _):
+        async with ClientSession(read, write) as session:
+            await session.initialize()
+            await _wait_effects_done(session, timeout=10)
+            await asyncio.sleep(settle)
+            cached = FetchLightsInfoOutput.model_validate_json((await session.call_tool("get_lights_statuses", {})).content[0].text).infos
+    device = [value for link in simulator.links for value in link.device.brightness]
+
+    ok = True
+
+    def fail(message: str):
+        nonlocal ok
+        ok = False
+        tracker.violate(-1, "final_state", message)
+
+    for light_id in range(tracker.led_count):
+        expected = tracker.expected.get(light_id)
+        allowed = expected.allowed() if expected is not None else {0}
+        if device[light_id] not in {_to_pwm(value) for value in allowed}:
+            fail(f"light-{light_id} is {device[light_id]} on the Arduino, expected PWM of {sorted(allowed)}%")
+        if cached[light_id].brightness != _to_percent(device[light_id]):
+            fail(f"light-{light_id} is {cached[light_id].brightness}% in the server cache but {_to_percent(device[light_id])}% on the Arduino")
+    # 不確定的寫入以實際結果為準，下一輪的預期從 Arduino 目前的狀態開始
+    for light_id, expected in tracker.expected.items():
+        expected.acked, expected.uncertain = _to_percent(device[light_id]), set()
+    return ok
+
+
+async def _check_pattern_override(url: str, tracker: Tracker, simulator: SimulatorThread) -> bool:
+    """
+    pattern 播放中的燈，寫入與 pattern 開始前相同的值時仍要送到 Arduino：燈應該離開 pattern 並停在寫入的值，
+    而不是因為寫入合併層記得的舊值而被當成未變更略過。
+    """
+    light_ids = list(range(min(PATTERN_LIGHTS, tracker.owned)))
+    device = simulator.links[0].device
+    ok = True
+
+    def fail(message: str):
+        nonlocal ok
+        ok = False
+        tracker.violate(-1, "pattern_override", message)
+
+    async with streamablehttp_client(url) as (read, write, _):
+        async with ClientSession(read, write) as session:
+            await session.initialize()
+            await session.call_tool("turn_off_all", {})
+            result = await session.call_tool("upload_preset_pattern", {"preset": "breathe", "light_ids": light_ids, "period_ms": PATTERN_PERIOD_MS})
+            if _is_error(result):
+                fail(f"upload pattern failed: {result.content[0].text}")
+                return ok
+            await asyncio.sleep(PATTERN_PERIOD_MS / 4000)
+            await session.call_tool("turn_off_all", {})
+            # 寫入被略過時，pattern 在這段時間內會再把燈調亮
+            await asyncio.sleep(PATTERN_PERIOD_MS / 2000)
+            status = PatternStatusOutput.model_validate_json((await session.call_tool("get_pattern_status", {})).content[0].text)
+            driven = [light_id for board in status.devices for light_id in board.light_ids]
+            if driven:
+                fail(f"lights {driven} are still driven by the pattern after turn_off_all")
+            for light_id in light_ids:
+                if device.brightness[light_id] != 0:
+                    fail(f"light-{light_id} is {device.brightness[light_id]} on the Arduino after turn_off_all during a pattern")
+            await session.call_tool("stop_pattern", {})
+    for light_id in light_ids:
+        tracker.expected[light_id].acked = 0
+    return ok
+
+
+async def _run_level(url: str, tracker: Tracker, concurrency: int, args, simulator: SimulatorThread) -> LevelResult:
+    tracker.reset_level(concurrency)
+    clients = [Client(client_id, tracker, args.mix, args.think_ms / 1000, args.seed) for client_id in range(concurrency)]
+    start = asyncio.Event()
+    initialized = 0
+    all_initialized = asyncio.Event()
+    deadline = 0.0
+
+    async def worker(client: Client):
+        nonlocal initialized
+        async with streamablehttp_client(url) as (read, write, _):
+            async with ClientSession(read, write) as session:
+                await session.initialize()
+                initialized += 1
+                if initialized == concurrency:
+                    all_initialized.set()
+                await start.wait()
+                await client.run(session, deadline)
+
+    tasks = [asyncio.create_task(worker(client)) for client in clients]
+    await all_initialized.wait()
+    started = time.perf_counter()
+    deadline = started + args.duration
+    start.set()
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+    final_state_ok = await _check_final_state(url, tracker, simulator, args.settle)
+
+    def summary(latencies: List[float]) -> Dict[str, float]:
+        latencies = sorted(latencies)
+        return {
+            "p50": round(_percentile(latencies, 50) * 1000, 3),
+            "p95": round(_percentile(latencies, 95) * 1000, 3),
+            "p99": round(_percentile(latencies, 99) * 1000, 3),
+            "max": round(latencies[-1] * 1000, 3) if latencies else 0.0,
+        }
+
+    all_latencies = [latency for latencies in tracker.latencies.values() for latency in latencies]
+    ops = len(all_latencies)
+    errors = sum(tracker.errors.values())
+    expired = sum(tracker.expired.values())
+    return LevelResult(
+        concurrency=concurrency,
+        ops=ops,
+        errors=errors,
+        error_rate=round(errors / ops, 4) if ops else 0.0,
+        expired=expired,
+        violations=tracker.level_violations,
+        duration_s=round(elapsed, 3),
+        ops_per_sec=round(ops / elapsed, 2) if elapsed else 0.0,
+        latency_ms=summary(all_latencies),
+        operations={
+            name: {"ops": len(latencies), "errors": tracker.errors[name], "expired": tracker.expired[name], "latency_ms": summary(latencies)}
+            for name, latencies in tracker.latencies.items() if latencies
+        },
+        final_state_ok=final_state_ok,
+    )
+
+
+def _print_results(results: List[LevelResult]):
+    print(f"{'conc':>5}{'operation':>12}{'ops':>8}{'errors':>8}{'expired':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for r in results:
+        rows = [("all", {"ops": r.ops, "errors": r.errors, "expired": r.expired, "latency_ms": r.latency_ms})] + list(r.operations.items())
+        for name, stats in rows:
+            latency = stats["latency_ms"]
+            print(
+                f"{r.concurrency:>5}{name:>12}{stats['ops']:>8}{stats['errors']:>8}{stats['expired']:>9}"
+                f"{latency['p50']:>10.2f}{latency['p95']:>10.2f}{latency['p99']:>10.2f}{latency['max']:>10.2f}"
+            )
+        print(f"{'':>5}{'violations':>12}{r.violations:>8}  final state {'OK' if r.final_state_ok else 'MISMATCH'}, {r.ops_per_sec:.1f} ops/s")
+
+
+def _parse_mix(items: List[str]) -> Dict[str, int]:
+    mix = dict(DEFAULT_MIX)
+    for item in items:
+        name, _, weight = item.partition("=")
+        if name not in mix:
+            raise SystemExit(f"Unknown operation '{name}' in --mix, expected one of {', '.join(DEFAULT_MIX)}")
+        mix[name] = int(weight)
+    return mix
+
+
+async def _main(args) -> int:
+    led_count = args.leds * args.boards
+    if not 1 <= args.blink_lights < led_count:
+        raise SystemExit(f"--blink-lights must be between [1-{led_count - 1}], got {args.blink_lights}")
+    owned = led_count - args.blink_lights
+    tracker = Tracker(led_count, owned, list(range(owned, led_count)))
+    server_env = dict(item.split("=", 1) for item in args.server_env)
+
+    config = LinkConfig(baudrate=args.baud, latency=args.latency_ms / 1000, boot_delay=0.2, seed=args.seed)
+    simulator = SimulatorThread(args.boards, args.leds, config)
+    simulator.start()
+    simulator.ready.wait()
+    port = _free_port()
+    server = _start_server(port, simulator.urls, server_env, args.server_arg, args.server_log)
+    url = f"http://127.0.0.1:{port}/mcp"
+    results = []
+    try:
+        await _wait_until_ready(url)
+        pattern_override_ok = await _check_pattern_override(url, tracker, simulator)
+        print(f"Write after start_pattern: {'OK' if pattern_override_ok else 'SKIPPED'}", flush=True)
+        for concurrency in args.concurrency:
+            result = await _run_level(url, tracker, concurrency, args, simulator)
+            results.append(result)
+            print(
+                f"x{concurrency}: {result.ops_per_sec:.1f} ops/s, p99 {result.latency_ms['p99']:.2f} ms, "
+                f"error rate {result.error_rate:.2%}, {result.expired} expired, {result.violations} violations", flush=True,
+            )
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+
+    print()
+    _print_results(results)
+    for violation in tracker.violations:
+        print(f"VIOLATION x{violation.concurrency} client {violation.client} {violation.operation}: {violation.message}")
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "git_commit": _git_commit(),
+            "python": sys.version.split()[0],
+            "baud": args.baud,
+            "latency_ms": args.latency_ms,
+            "boards": args.boards,
+            "leds": args.leds,
+            "blink_lights": args.blink_lights,
+            "duration_s": args.duration,
+            "think_ms": args.think_ms,
+            "mix": args.mix,
+            "seed": args.seed,
+            "server_env": server_env,
+            "server_args": args.server_arg,
+            "label": args.label,
+        },
+        "results": [asdict(result) for result in results],
+        "violations": [asdict(violation) for violation in tracker.violations],
+        "violation_count": tracker.violation_count,
+        "pattern_override_ok": pattern_override_ok,
+    }
+    output = args.output or os.path.join(
+        SERVER_DIR, "bench", "results", f"stress-{datetime.now():%Y%m%d-%H%M%S}{'-' + args.label if args.label else ''}.json",
+    )
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"\nResults saved to {output}")
+
+    failed = tracker.violation_count > 0 or any(result.error_rate > args.max_error_rate for result in results)
+    print("FAIL" if failed else "PASS")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stress the lights MCP server with many concurrent clients against the simulator and check invariants")
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[50, 100, 200], help="Number of concurrent MCP sessions, several values run one round for each")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds to run each round")
+    parser.add_argument("--think-ms", type=float, default=20.0, help="Average pause of each client between calls, 0 to call back to back")
+    parser.add_argument("--mix", action="append", default=[], metavar="OPERATION=WEIGHT", help=f"Weight of an operation ({', '.join(DEFAULT_MIX)}), can be repeated")
+    parser.add_argument("--settle", type=float, default=0.3, help="Seconds to wait after the effects finish before checking the final state")
+    parser.add_argument("--boards", type=int, default=1, help="Number of simulated boards")
+    parser.add_argument("--leds", type=int, default=128, help="Number of LEDs on each simulated board")
+    parser.add_argument("--blink-lights", type=int, default=8, help="Number of lights (the last ones) used only for blinking, every other light is written by one client")
+    parser.add_argument("--baud", type=int, default=115200, help="Baud rate of the simulated serial link, 0 to disable pacing")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Extra reply latency of the simulated Arduino")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the operation mix and of the simulated link")
+    parser.add_argument("--max-error-rate", type=float, default=0.0, help="Fail when the ratio of calls returning an error (other than an expired deadline) in any round is higher than this")
+    parser.add_argument("--server-env", action="append", default=[], metavar="KEY=VALUE", help="Extra environment variable for the server, can be repeated")
+    parser.add_argument("--server-arg", action="append", default=[], metavar="ARG", help="Extra command line argument for the server, can be repeated")
+    parser.add_argument("--server-log", type=str, default=None, help="Write the server output to this file")
+    parser.add_argument("--label", type=str, default=None, help="Label stored in the results and appended to the file name")
+    parser.add_argument("--output", type=str, default=None, help="Path of the JSON results, defaults to bench/results/stress-<timestamp>.json")
+    args = parser.parse_args()
+    args.mix = _parse_mix(args.mix)
+
+    sys.exit(asyncio.run(_main(args)))
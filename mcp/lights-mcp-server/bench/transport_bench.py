@@ -0,0 +1,205 @@
+import argparse, asyncio, json, os, sys, time
+from contextlib import AsyncExitStack
+from dataclasses import dataclass, asdict
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import httpx
+from mcp import ClientSession, StdioServerParameters
+from mcp.client.sse import sse_client
+from mcp.client.stdio import stdio_client
+from mcp.client.streamable_http import streamablehttp_client
+
+from bench.mcp_bench import SERVER_DIR, SimulatorThread, _free_port, _git_commit, _is_error, _percentile, _start_server
+from src.simulator import LinkConfig
+
+TRANSPORTS = ("stdio", "streamable-http", "sse")
+# 由淺到深：get_write_stats 只有 transport 與 JSON-RPC 的開銷，其餘兩個再加上快取讀取與序列埠寫入
+SCENARIOS = {
+    "get_write_stats": lambda i, n: ("get_write_stats", {}),
+    "get_lights_statuses": lambda i, n: ("get_lights_statuses", {}),
+    # 每次都換一個值，避免被寫入合併層當成未變更而略過
+    "set_light_brightness": lambda i, n: ("set_light_brightness", {"light_id": i % n, "brightness": (i * 7) % 101}),
+}
+
+
+@dataclass
+class TransportResult:
+    transport: str
+    scenario: str
+    calls: int
+    errors: int
+    latency_ms: Dict[str, float]
+
+
+async def _open_session(stack: AsyncExitStack, transport: str, url: str, params: Optional[StdioServerParameters], errlog) -> ClientSession:
+    if transport == "stdio":
+        read, write = await stack.enter_async_context(stdio_client(params, errlog=errlog))
+    elif transport == "sse":
+        read, write = await stack.enter_async_context(sse_client(f"{url}/sse"))
+    else:
+        read, write, _ = await stack.enter_async_context(streamablehttp_client(f"{url}/mcp"))
+    session = await stack.enter_async_context(ClientSession(read, write))
+    await session.initialize()
+    return session
+
+
+async def _wait_http_ready(url: str, timeout: float = 20.0):
+    # HTTP transport 要等伺服器開始監聽；/metrics 在 streamable HTTP 與 SSE 的 app 都有
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while True:
+            try:
+                if (await client.get(f"{url}/metrics")).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"MCP server at {url} is not ready after {timeout}s")
+            await asyncio.sleep(0.3)
+
+
+async def _measure(session: ClientSession, transport: str, scenario: str, calls: int, warmup: int, led_count: int) -> TransportResult:
+    latencies: List[float] = []
+    errors = 0
+    for i in range(warmup + calls):
+        name, arguments = SCENARIOS[scenario](i, led_count)
+        started = time.perf_counter()
+        try:
+            failed = _is_error(await session.call_tool(name, arguments))
+        except Exception:
+            failed = True
+        if i >= warmup:
+            latencies.append(time.perf_counter() - started)
+            errors += failed
+    latencies.sort()
+    return TransportResult(
+        transport=transport,
+        scenario=scenario,
+        calls=calls,
+        errors=errors,
+        latency_ms={
+            "mean": round(sum(latencies) / len(latencies) * 1000, 3) if latencies else 0.0,
+            "p50": round(_percentile(latencies, 50) * 1000, 3),
+            "p95": round(_percentile(latencies, 95) * 1000, 3),
+            "p99": round(_percentile(latencies, 99) * 1000, 3),
+        },
+    )
+
+
+async def _check_shared_state(sessions: Dict[str, ClientSession]) -> bool:
+    """每個 transport 輪流寫入同一顆燈，再從其他 transport 讀回，確認所有 transport 看到的是同一份狀態。"""
+    transports = list(sessions)
+    for index, transport in enumerate(transports):
+        value = 10 + index
+        await sessions[transport].call_tool("set_light_brightness", {"light_id": 0, "brightness": value})
+        reader = transports[(index + 1) % len(transports)]
+        result = await sessions[reader].call_tool("get_lights_statuses", {"light_id": 0, "force_refresh": True})
+        if json.loads(result.content[0].text)["brightness"] != value:
+            print(f"Light-0 written as {value}% over {transport} reads {result.content[0].text} over {reader}")
+            return False
+    return True
+
+
+async def _main(args) -> int:
+    transports = list(dict.fromkeys(args.transports))
+    config = LinkConfig(baudrate=args.baud, latency=args.latency_ms / 1000, boot_delay=0.2, seed=0)
+    simulator = SimulatorThread(1, args.leds, config)
+    simulator.start()
+    simulator.ready.wait()
+    port = _free_port()
+    url = f"http://127.0.0.1:{port}"
+    server_env = dict(item.split("=", 1) for item in args.server_env)
+    server_args = ["--transport", *transports]
+
+    # 所有 transport 由同一個伺服器行程提供：有 stdio 時由 stdio client 啟動（伺服器的 stderr 寫到 log），否則以子行程啟動
+    server, params, log = None, None, None
+    if "stdio" in transports:
+        params = StdioServerParameters(
+            command=sys.executable, args=["-m", "src.server", *server_args, "--host", "127.0.0.1", "--port", str(port)],
+            env=dict(os.environ, SERIAL_PORTS=",".join(simulator.urls), **server_env), cwd=SERVER_DIR,
+        )
+        log = open(args.server_log or os.devnull, "w")
+    else:
+        server = _start_server(port, simulator.urls, server_env, server_args, args.server_log)
+    results = []
+    try:
+        async with AsyncExitStack() as stack:
+            sessions = {}
+            # stdio 的 client 會啟動伺服器，要先連線，HTTP transport 再等伺服器開始監聽
+            if "stdio" in transports:
+                sessions["stdio"] = await _open_session(stack, "stdio", url, params, log)
+            if len(sessions) < len(transports):
+                await _wait_http_ready(url)
+            for transport in transports:
+                if transport not in sessions:
+                    sessions[transport] = await _open_session(stack, transport, url, params, log)
+            # 第一次呼叫會建立序列埠連線並協商協定，不計入量測
+            await sessions[transports[0]].call_tool("get_light_count", {})
+            shared_state_ok = await _check_shared_state(sessions)
+            for scenario in args.scenarios:
+                for transport in transports:
+                    result = await _measure(sessions[transport], transport, scenario, args.calls, args.warmup, args.leds)
+                    results.append(result)
+                    print(f"{transport} {scenario}: p50 {result.latency_ms['p50']:.2f} ms, p99 {result.latency_ms['p99']:.2f} ms", flush=True)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=10)
+        if log is not None:
+            log.close()
+    # 所有 transport 共用同一個 owner 時，模擬的 Arduino 只會被連線一次
+    serial_connections = sum(link.sessions for link in simulator.links)
+
+    print(f"\n{'transport':<18}{'scenario':<24}{'calls':>7}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}")
+    for r in results:
+        print(
+            f"{r.transport:<18}{r.scenario:<24}{r.calls:>7}{r.latency_ms['mean']:>10.2f}{r.latency_ms['p50']:>10.2f}"
+            f"{r.latency_ms['p95']:>10.2f}{r.latency_ms['p99']:>10.2f}{r.errors:>8}"
+        )
+    print(f"\nShared state across transports: {'OK' if shared_state_ok else 'MISMATCH'}, serial connections to the Arduino: {serial_connections}")
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "git_commit": _git_commit(),
+            "python": sys.version.split()[0],
+            "transports": transports,
+            "baud": args.baud,
+            "latency_ms": args.latency_ms,
+            "leds": args.leds,
+            "calls": args.calls,
+            "warmup": args.warmup,
+            "server_env": server_env,
+            "label": args.label,
+        },
+        "results": [asdict(result) for result in results],
+        "shared_state_ok": shared_state_ok,
+        "serial_connections": serial_connections,
+    }
+    output = args.output or os.path.join(
+        SERVER_DIR, "bench", "results", f"transport-{datetime.now():%Y%m%d-%H%M%S}{'-' + args.label if args.label else ''}.json",
+    )
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"\nResults saved to {output}")
+    return 0 if shared_state_ok and serial_connections == 1 else 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the per-call latency of the MCP transports served by one lights server process")
+    parser.add_argument("--transports", nargs="+", default=list(TRANSPORTS), choices=TRANSPORTS, help="Transports to enable on the server and benchmark")
+    parser.add_argument("--scenarios", nargs="+", default=list(SCENARIOS), choices=list(SCENARIOS), help="Scenarios to run on each transport")
+    parser.add_argument("--calls", type=int, default=300, help="Sequential calls of each scenario on each transport")
+    parser.add_argument("--warmup", type=int, default=20, help="Calls before each measurement which are not counted")
+    parser.add_argument("--leds", type=int, default=3, help="Number of LEDs on the simulated board")
+    parser.add_argument("--baud", type=int, default=9600, help="Baud rate of the simulated serial link, 0 to disable pacing")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Extra reply latency of the simulated Arduino")
+    parser.add_argument("--server-env", action="append", default=[], metavar="KEY=VALUE", help="Extra environment variable for the server, can be repeated")
+    parser.add_argument("--server-log", type=str, default=None, help="Write the server output (stderr for stdio) to this file")
+    parser.add_argument("--label", type=str, default=None, help="Label stored in the results and appended to the file name")
+    parser.add_argument("--output", type=str, default=None, help="Path of the JSON results, defaults to bench/results/transport-<timestamp>.json")
+    args = parser.parse_args()
+
+    sys.exit(asyncio.run(_main(args)))
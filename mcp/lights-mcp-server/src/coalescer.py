@@ -0,0 +1,253 @@
+import asyncio, math, time
+from dataclasses import dataclass, asdict
+from typing import Dict, List, Optional, Set, Tuple
+
+from .scheduler import CallContext, current_call, merge_calls
+
+
+@dataclass
+class CoalesceStats:
+    # 呼叫端要求寫入的燈次數（批次寫入中的每顆燈各算一次）
+    requested: int = 0
+    # 在同一個時間窗內被同一顆燈的新值覆蓋、沒有送出的次數
+    coalesced: int = 0
+    # 與 Arduino 上已知亮度相同而略過的次數
+    skipped_unchanged: int = 0
+    # 實際送到序列埠的燈次數
+    sent: int = 0
+    # 實際送出的寫入指令數（一個時間窗內的多顆燈合併為一個批次 frame）
+    flushes: int = 0
+
+    @property
+    def absorbed(self) -> int:
+        return self.coalesced + self.skipped_unchanged
+
+
+class WriteCoalescer:
+    """
+    每顆燈的寫入合併（coalescing / debouncing）層，位於序列埠寫入之前。
+
+    在 `window` 秒的時間窗內，同一顆燈只會送出最後一次的值；與 Arduino 上已知亮度相同的寫入會直接略過；
+    同一個時間窗內多顆燈的更新會合併成一個批次 frame，全部是同一個值時（例如全部關燈）改用一個群組指令；
+    時間窗內有呼叫端要求確認時，整批改用一個寫入並確認的指令，所有呼叫端都從這次的回覆取得結果。
+    呼叫端會等到自己的值被送出（或被吸收）後才返回；合併後的指令以時間窗內呼叫端中最高的優先順序排程。
+    提供與 `SerialEngine` 相同的高階介面，讀取類指令直接轉給下游。
+
+    Args:
+        downstream: 實際寫入的物件（`SerialEngine` 或 `DeviceRegistry`）。
+        window (float, optional): 合併時間窗秒數，`0` 表示不等待、只略過未變更的寫入，預設為 0.02。
+    """
+
+    def __init__(self, downstream, window: float = 0.02):
+        self.downstream = downstream
+        self.window = window
+        self.stats = CoalesceStats()
+
+        self._pending: Dict[int, int] = {}
+        # (等待的 future, 要求確認時為該呼叫端寫入的值，否則為 None)
+        self._waiters: List[Tuple[asyncio.Future, Optional[Dict[int, int]]]] = []
+        # 時間窗內各呼叫端的排程資訊
+        self._pending_calls: List[CallContext] = []
+        self._flush_task: Optional[asyncio.Task] = None
+        # 已知 Arduino 上的亮度（最後一次送出或讀回的值）
+        self._known: Dict[int, int] = {}
+        # 正在由 Arduino 漸變的燈與預計結束時間，期間讀回的中間值不視為已知亮度
+        self._fading_until: Dict[int, float] = {}
+        self._written_during_read: Optional[Set[int]] = None
+
+    # ---------- 寫入 ----------
+
+    async def set_brightness(self, light_id: int, value_255: int):
+        await self.set_brightness_batch({light_id: value_255})
+
+    async def set_brightness_batch(self, values: Dict[int, int]):
+        await self._enqueue(values, confirm=False)
+
+    async def set_brightness_confirm(self, values: Dict[int, int]) -> Dict[int, int]:
+        """
+        寫入並回傳 Arduino 上實際的亮度，與一般寫入一樣等待時間窗：同一顆燈以時間窗內最後的值為準，
+        所有呼叫端共用一次寫入並確認的往返；與已知亮度相同的燈不送出，直接以已知亮度回答。
+
+        Returns:
+            Dict[int, int]: 燈號對應 Arduino 上的 PWM 值；被之後的寫入取代的燈回傳取代後的值。
+        """
+        return await self._enqueue(values, confirm=True)
+
+    async def _enqueue(self, values: Dict[int, int], confirm: bool):
+        for light_id, value_255 in values.items():
+            self.stats.requested += 1
+            if light_id in self._pending:
+                self.stats.coalesced += 1
+            self._pending[light_id] = value_255
+        self._pending_calls.append(current_call.get())
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append((waiter, dict(values) if confirm else None))
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.get_running_loop().create_task(self._flush_after_window(), name="coalescer-flush")
+        return await waiter
+
+    def _answer(self, values: Optional[Dict[int, int]]) -> Optional[Dict[int, int]]:
+        # 漸變中的燈沒有已知亮度，回傳要求的值
+        if values is None:
+            return None
+        return {light_id: self._known.get(light_id, value) for light_id, value in values.items()}
+
+    async def _flush_after_window(self):
+        if self.window > 0:
+            await asyncio.sleep(self.window)
+        # 送出期間進來的新寫入會在這一輪送完後緊接著送出
+        while self._pending:
+            pending, self._pending = self._pending, {}
+            waiters, self._waiters = self._waiters, []
+            calls, self._pending_calls = self._pending_calls, []
+            # flush task 有自己的 context，設定只影響這個 task
+            current_call.set(merge_calls(calls))
+            await self._flush(pending, waiters)
+        # 值被之後的漸變指令取代而沒有送出的呼叫端
+        waiters, self._waiters = self._waiters, []
+        for waiter, values in waiters:
+            if not waiter.done():
+                waiter.set_result(self._answer(values))
+
+    async def fade(self, light_id: int, value_255: int, duration_ms: int):
+        """漸變指令直接送出；同一顆燈還沒送出的值會被它取代，避免晚到的寫入中斷漸變。"""
+        superseded = self._pending.pop(light_id, None)
+        if superseded is not None:
+            self.stats.coalesced += 1
+        self.stats.requested += 1
+        try:
+            await self.downstream.fade(light_id, value_255, duration_ms)
+        except Exception:
+            # 漸變沒有送出（例如韌體不支援），被取代的值仍要寫入
+            if superseded is not None:
+                self.stats.coalesced -= 1
+                self.stats.requested -= 1
+                await self.set_brightness(light_id, superseded)
+            raise
+        self.stats.flushes += 1
+        self.stats.sent += 1
+        # 漸變期間 Arduino 上的亮度一直在變，下一次寫入不能因為「與已知值相同」而略過
+        self._known.pop(light_id, None)
+        self._fading_until[light_id] = time.monotonic() + duration_ms / 1000
+        if self._written_during_read is not None:
+            self._written_during_read.add(light_id)
+
+    async def set_frame(self, pixels, changed):
+        """
+        畫面寫入直接送出：呼叫端已經只挑出有變化的燈，再等待時間窗只會增加延遲。
+
+        時間窗內還沒送出的單燈寫入不受影響，會在畫面之後送出，與影子快取的記錄順序一致。
+        """
+        light_ids = changed.tolist()
+        self.stats.requested += len(light_ids)
+        try:
+            await self.downstream.set_frame(pixels, changed)
+        except Exception:
+            for light_id in light_ids:
+                self._known.pop(light_id, None)
+            raise
+        if light_ids:
+            self.stats.flushes += 1
+            self.stats.sent += len(light_ids)
+        self._known.update(zip(light_ids, pixels[changed].tolist()))
+        for light_id in light_ids:
+            self._fading_until.pop(light_id, None)
+        if self._written_during_read is not None:
+            self._written_during_read.update(light_ids)
+
+    async def _flush(self, pending: Dict[int, int], waiters: List[Tuple[asyncio.Future, Optional[Dict[int, int]]]]):
+        to_send = {light_id: value for light_id, value in pending.items() if self._known.get(light_id) != value}
+        self.stats.skipped_unchanged += len(pending) - len(to_send)
+        confirm = any(values is not None for _, values in waiters)
+        confirmed: Dict[int, int] = {}
+        error: Optional[BaseException] = None
+        try:
+            if confirm and to_send:
+                # 有呼叫端要求確認時，整批以寫入並確認的指令送出，Arduino 回報的值即為之後的已知亮度
+                confirmed = await self.downstream.set_brightness_confirm(to_send)
+            elif len(to_send) == 1:
+                (light_id, value), = to_send.items()
+                await self.downstream.set_brightness(light_id, value)
+            elif len(set(to_send.values())) == 1:
+                await self.downstream.set_brightness_group(list(to_send), next(iter(to_send.values())))
+            elif to_send:
+                await self.downstream.set_brightness_batch(to_send)
+        except Exception as e:
+            error = e
+            for light_id in to_send:
+                self._known.pop(light_id, None)
+        else:
+            if to_send:
+                self.stats.flushes += 1
+                self.stats.sent += len(to_send)
+            self._known.update(to_send)
+            self._known.update(confirmed)
+            for light_id in to_send:
+                self._fading_until.pop(light_id, None)
+            if self._written_during_read is not None:
+                self._written_during_read.update(to_send)
+
+        for waiter, values in waiters:
+            if waiter.done():
+                continue
+            if error is not None:
+                waiter.set_exception(error)
+            else:
+                waiter.set_result(self._answer(values))
+
+    def pattern_started(self, light_ids: List[int]):
+        """
+        Arduino 開始播放 pattern：這些燈的亮度由 Arduino 自行改變，已知亮度不再可信。
+
+        與漸變相同，直到燈被重新寫入前，寫入都不會因為「與已知值相同」而略過，讀回的值也不當成已知亮度。
+        """
+        for light_id in light_ids:
+            self._known.pop(light_id, None)
+            self._fading_until[light_id] = math.inf
+
+    def pattern_stopped(self, light_ids: List[int]):
+        """pattern 已停止，這些燈停在未知的亮度，下一次讀回或寫入後恢復略過未變更的值。"""
+        for light_id in light_ids:
+            if self._fading_until.get(light_id) == math.inf:
+                del self._fading_until[light_id]
+
+    def observe(self, light_id: int, value_255: int):
+        """記錄 Arduino 主動回報的亮度，之後的寫入可以據此略過未變更的值。"""
+        self._fading_until.pop(light_id, None)
+        self._known[light_id] = value_255
+
+    # ---------- 讀取（直接轉給下游） ----------
+
+    async def read_status(self) -> List[int]:
+        """讀回實際亮度，並更新已知亮度；讀取期間被寫入的燈以寫入的值為準。"""
+        self._written_during_read = set()
+        try:
+            status = await self.downstream.read_status()
+        finally:
+            written, self._written_during_read = self._written_during_read, None
+        now = time.monotonic()
+        for light_id, value in enumerate(status):
+            if light_id not in written and self._fading_until.get(light_id, 0) <= now:
+                self._known[light_id] = value
+        return status
+
+    async def read_info(self) -> int:
+        return await self.downstream.read_info()
+
+    # ---------- pattern（直接轉給下游） ----------
+
+    async def upload_pattern(self, program):
+        return await self.downstream.upload_pattern(program)
+
+    async def run_pattern(self, start: bool):
+        return await self.downstream.run_pattern(start)
+
+    async def read_pattern(self):
+        return await self.downstream.read_pattern()
+
+    def stats_dict(self) -> dict:
+        stats = asdict(self.stats)
+        stats["absorbed"] = self.stats.absorbed
+        stats["window_ms"] = round(self.window * 1000, 3)
+        return stats
@@ -0,0 +1,245 @@
+import logging, threading, time
+from typing import Optional
+
+import serial
+
+try:
+    import termios
+except ImportError:
+    # Windows 沒有 termios
+    termios = None
+
+logger = logging.getLogger(__name__)
+
+READY_BANNER = "Arduino Ready."
+
+
+class SerialConnection:
+    """
+    單一 Arduino 的連線管理。
+
+    * 開啟連線後以短 timeout 輪詢 `Arduino Ready.` 開機訊息，收到就立即返回，最多等到 `ready_timeout`，不再固定 sleep 2 秒。
+    * `no_reset=True` 時避免 Arduino 因 DTR 自動重置（僅對直接連接的序列埠有效）：Linux / macOS 清除序列埠的 HUPCL，
+      關閉後 DTR 維持拉高，之後的開啟（重新連線、伺服器重新啟動）不會重置板子；插上板子後第一次開啟仍會重置。
+      Windows 的驅動程式在開啟時就套用 DTR 的設定，開啟前先拉低 DTR/RTS 即可。
+    * 連線中斷（`SerialException`）後由 `reconnect()` 以指數退避重新連線，直接序列埠與 `socket://` 皆適用。
+    * 連線與恢復所花的時間都會記錄在日誌中，並保存在 `last_connect_seconds`、`last_outage_seconds`。
+
+    Args:
+        url (str): 序列埠路徑（例如 `/dev/ttyACM0`）或 pyserial URL（例如 `socket://host:5555`）。
+        baudrate (int, optional): 鮑率，預設為 9600。
+        timeout (float, optional): 讀取 timeout 秒數，預設為 1。
+        ready_timeout (float, optional): 等待開機訊息的最長秒數，預設為 3。
+        no_reset (bool, optional): 是否避免 DTR 自動重置，預設為 False。
+        backoff_initial (float, optional): 重新連線的第一次等待秒數，預設為 0.5。
+        backoff_max (float, optional): 重新連線等待秒數的上限，預設為 10。
+    """
+
+    def __init__(
+        self,
+        url: str,
+        baudrate: int = 9600,
+        timeout: float = 1,
+        ready_timeout: float = 3,
+        no_reset: bool = False,
+        backoff_initial: float = 0.5,
+        backoff_max: float = 10,
+    ):
+        self.url = url
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.ready_timeout = ready_timeout
+        self.no_reset = no_reset
+        self.backoff_initial = backoff_initial
+        self.backoff_max = backoff_max
+
+        self.reconnects = 0
+        self.last_connect_seconds: Optional[float] = None
+        self.last_outage_seconds: Optional[float] = None
+        # 累計寫入與讀取的位元組數（寫入只在 writer thread、讀取只在 reader thread 更新）
+        self.bytes_written = 0
+        self.bytes_read = 0
+
+        self._ser = None
+        self._broken = False
+        self._lock = threading.Lock()
+
+    # ---------- 連線 ----------
+
+    @property
+    def connected(self) -> bool:
+        return self._ser is not None and not self._broken
+
+    def ensure_connected(self):
+        """尚未連線時建立連線（阻塞），失敗時拋出例外。"""
+        with self._lock:
+            if self.connected:
+                return
+            self._close_handle()
+            try:
+                self._open()
+            except Exception as e:
+                self._log_connect_error(e)
+                raise
+
+    def _open(self):
+        started = time.monotonic()
+        if "://" in self.url:
+            # 使用 TCP 連接模式（適用於 macOS + Docker），socket:// URL 來建立 TCP 連接
+            logger.info(f"Connecting to Arduino via URL: {self.url}")
+            ser = serial.serial_for_url(self.url, baudrate=self.baudrate, timeout=self.timeout)
+        else:
+            # 使用直接串口連接模式（適用於 Linux + Docker 或 host 直接運行）
+            logger.info(f"Connecting to Arduino via serial port: {self.url}")
+            ser = serial.Serial()
+            ser.port = self.url
+            ser.baudrate = self.baudrate
+            ser.timeout = self.timeout
+            if self.no_reset and termios is None:
+                # Windows：開啟前先把 DTR/RTS 拉低，避免觸發 Arduino 的自動重置
+                ser.dtr = False
+                ser.rts = False
+            ser.open()
+
+        board_reset = "://" in self.url or not self.no_reset or self._keep_dtr(ser)
+        banner = self._wait_ready(ser, board_reset)
+        self._ser = ser
+        self._broken = False
+        self.last_connect_seconds = time.monotonic() - started
+        if banner:
+            logger.info(f"Connect to Arduino({self.url}) success in {self.last_connect_seconds:.2f}s: {banner}")
+        else:
+            logger.info(
+                f"Connect to Arduino({self.url}) in {self.last_connect_seconds:.2f}s "
+                f"without '{READY_BANNER}' banner (board was not reset)"
+            )
+
+    def _keep_dtr(self, ser) -> bool:
+        """
+        清除序列埠的 HUPCL，關閉時不放掉 DTR，之後開啟序列埠時 DTR 沒有變化，Arduino 不會重置。
+
+        Linux 開啟序列埠時核心一定會拉高 DTR（在 `open()` 前設定 `dtr = False` 無效，開啟後再拉低反而讓下一次開啟觸發重置），
+        所以 HUPCL 原本仍設定時（例如插上板子後第一次開啟），DTR 在開啟前是放掉的，這次開啟仍會重置板子。
+
+        Returns:
+            bool: 這次開啟是否讓板子重置。
+        """
+        if termios is None:
+            return False
+        attrs = termios.tcgetattr(ser.fd)
+        if not attrs[2] & termios.HUPCL:
+            return False
+        attrs[2] &= ~termios.HUPCL
+        termios.tcsetattr(ser.fd, termios.TCSANOW, attrs)
+        logger.info(f"Cleared HUPCL on {self.url}, the Arduino was reset by this open but will keep running on later connections")
+        return True
+
+    def _wait_ready(self, ser, board_reset: bool = True) -> Optional[str]:
+        """以短 timeout 輪詢開機訊息，收到即返回；板子沒有重置時不需要等待。"""
+        if not board_reset:
+            ser.reset_input_buffer()
+            return None
+        deadline = time.monotonic() + self.ready_timeout
+        received = bytearray()
+        ser.timeout = 0.05
+        try:
+            # 以 read() 累積資料再找開機訊息；pyserial 的 socket:// 在短 timeout 下 readline() 會讀不到資料
+            while time.monotonic() < deadline:
+                received.extend(ser.read(ser.in_waiting or 1))
+                if READY_BANNER.encode("utf-8") in received:
+                    return READY_BANNER
+        finally:
+            ser.timeout = self.timeout
+        return None
+
+    def reconnect(self, stop: threading.Event) -> bool:
+        """
+        關閉中斷的連線並以指數退避重新連線，直到成功或 `stop` 被設定。
+
+        Returns:
+            bool: 是否成功重新連線。
+        """
+        outage_started = time.monotonic()
+        delay = self.backoff_initial
+        attempts = 0
+        with self._lock:
+            self._close_handle()
+        while not stop.is_set():
+            attempts += 1
+            with self._lock:
+                try:
+                    self._open()
+                except Exception as e:
+                    logger.warning(f"Reconnect to Arduino({self.url}) attempt {attempts} failed, retry in {delay:.1f}s: {e}")
+                else:
+                    self.reconnects += 1
+                    self.last_outage_seconds = time.monotonic() - outage_started
+                    logger.info(f"Reconnected to Arduino({self.url}) after {self.last_outage_seconds:.2f}s ({attempts} attempts)")
+                    return True
+            stop.wait(delay)
+            delay = min(delay * 2, self.backoff_max)
+        return False
+
+    def mark_broken(self):
+        """標記連線已中斷，讀取端會在下一次讀取時發現並重新連線。"""
+        self._broken = True
+
+    def _close_handle(self):
+        if self._ser is not None:
+            try:
+                self._ser.close()
+            except Exception:
+                pass
+        self._ser = None
+
+    def close(self):
+        with self._lock:
+            self._close_handle()
+
+    # ---------- 讀寫 ----------
+
+    def _handle(self):
+        ser = self._ser
+        if ser is None or self._broken:
+            raise serial.SerialException(f"Arduino({self.url}) is not connected")
+        return ser
+
+    def write(self, data: bytes):
+        try:
+            written = self._handle().write(data)
+        except (serial.SerialException, OSError):
+            self.mark_broken()
+            raise
+        self.bytes_written += len(data)
+        return written
+
+    def read_available(self) -> bytes:
+        """讀取目前緩衝區中的所有資料（至少等待 1 byte 或直到 timeout）。"""
+        ser = self._handle()
+        try:
+            data = ser.read(ser.in_waiting or 1)
+        except (serial.SerialException, OSError):
+            self.mark_broken()
+            raise
+        self.bytes_read += len(data)
+        return data
+
+    def _log_connect_error(self, e: Exception):
+        if self.url.startswith("socket://"):
+            tcp_port = self.url.rsplit(":", 1)[-1]
+            logger.error(
+                f"Connect to Arduino via TCP ({self.url}) error.\n"
+                f"Please make sure:\n"
+                f"> socat is running on your host machine\n"
+                f"> Command: socat TCP-LISTEN:{tcp_port},reuseaddr,fork /dev/cu.usbmodem*,raw,echo=0\n"
+                f"Detail error log:\n"
+                f"{e}"
+            )
+        else:
+            logger.error(
+                f"Connect to Arduino({self.url}) error, please check:\n"
+                f"> Did Arduino connect to your computer?\n"
+                f"> Is the port name `{self.url}` correct?\n"
+                f"Detail error log:\n"
+                f"{e}"
+            )
@@ -0,0 +1,200 @@
+import asyncio, logging
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .patterns import PatternProgram, localize
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Device:
+    name: str
+    engine: object
+    # 這塊板子第一顆燈在全域 ID 中的位置，以及板子上的燈數
+    offset: int = 0
+    led_count: int = 0
+    # 上傳到這塊板子的 pattern（板子上的燈號），None 表示沒有
+    pattern: Optional[PatternProgram] = None
+
+
+class DeviceRegistry:
+    """
+    多塊 Arduino 的裝置註冊表。
+
+    把所有板子的燈排成一個連續的全域 ID 空間（依註冊順序，第一塊板子是 0 ~ n-1，第二塊接續編號），
+    並把全域 ID 對應到 (板子, 板子上的燈號)。寫到不同板子的指令會同時送出，不會彼此排隊。
+    提供與 `SerialEngine` 相同的高階介面，`ShadowState` 可以直接把它當成單一裝置使用。
+
+    Args:
+        devices (List[Tuple[str, SerialEngine]]): (名稱, 引擎) 的列表，名稱通常是序列埠路徑或 `socket://` URL。
+        default_led_count (int, optional): 尚未查詢到燈數前，每塊板子預設的燈數，預設為 3。
+    """
+
+    def __init__(self, devices: List[Tuple[str, object]], default_led_count: int = 3):
+        if not devices:
+            raise ValueError("DeviceRegistry needs at least one device")
+        self.devices: List[Device] = [Device(name, engine, led_count=default_led_count) for name, engine in devices]
+        # 最後一次上傳的 pattern（全域 ID）
+        self.pattern: Optional[PatternProgram] = None
+        self._mapped = False
+        self._map_lock: Optional[asyncio.Lock] = None
+        self._assign_offsets()
+
+    def _assign_offsets(self):
+        offset = 0
+        for device in self.devices:
+            device.offset = offset
+            offset += device.led_count
+
+    @property
+    def led_count(self) -> int:
+        return sum(device.led_count for device in self.devices)
+
+    async def _ensure_mapped(self):
+        if self._mapped:
+            return
+        if self._map_lock is None:
+            self._map_lock = asyncio.Lock()
+        async with self._map_lock:
+            if not self._mapped:
+                await self.read_info()
+
+    def locate(self, light_id: int) -> Tuple[Device, int]:
+        """把全域燈號轉為 (板子, 板子上的燈號)。"""
+        for device in self.devices:
+            if device.offset <= light_id < device.offset + device.led_count:
+                return device, light_id - device.offset
+        raise ValueError(f"Light {light_id} is out of range [0-{self.led_count - 1}]")
+
+    def _group(self, values: Dict[int, int]) -> Dict[int, Tuple[Device, Dict[int, int]]]:
+        groups: Dict[int, Tuple[Device, Dict[int, int]]] = {}
+        for light_id, value in values.items():
+            device, local_id = self.locate(light_id)
+            groups.setdefault(id(device), (device, {}))[1][local_id] = value
+        return groups
+
+    # ---------- 與 SerialEngine 相同的高階介面 ----------
+
+    async def set_brightness(self, light_id: int, value_255: int):
+        await self._ensure_mapped()
+        device, local_id = self.locate(light_id)
+        await device.engine.set_brightness(local_id, value_255)
+
+    async def set_brightness_batch(self, values: Dict[int, int]):
+        """依板子分組，每塊板子一個 frame，不同板子同時寫入。"""
+        await self._ensure_mapped()
+        groups = self._group(values).values()
+        await asyncio.gather(*[device.engine.set_brightness_batch(local_values) for device, local_values in groups])
+
+    async def set_brightness_confirm(self, values: Dict[int, int]) -> Dict[int, int]:
+        """依板子分組寫入並確認，不同板子同時寫入，回傳以全域 ID 表示的實際亮度。"""
+        await self._ensure_mapped()
+        groups = list(self._group(values).values())
+        confirmed = await asyncio.gather(*[device.engine.set_brightness_confirm(local_values) for device, local_values in groups])
+        return {
+            device.offset + local_id: value
+            for (device, _), device_values in zip(groups, confirmed)
+            for local_id, value in device_values.items()
+        }
+
+    async def set_brightness_group(self, light_ids: List[int], value_255: int):
+        """把同一個值套用到多顆燈，每塊板子一個遮罩指令，不同板子同時寫入。"""
+        await self._ensure_mapped()
+        groups = self._group({light_id: value_255 for light_id in light_ids}).values()
+        await asyncio.gather(*[device.engine.set_brightness_group(list(local_values), value_255) for device, local_values in groups])
+
+    async def set_frame(self, pixels: np.ndarray, changed: np.ndarray):
+        """
+        依板子切開畫面，每塊板子只送出自己有變化的燈，不同板子同時寫入。
+
+        Args:
+            pixels (np.ndarray): 所有燈的新畫面（索引為全域 ID）。
+            changed (np.ndarray): 有變化的全域 ID，由小到大。
+        """
+        await self._ensure_mapped()
+        if len(changed) and changed[-1] >= self.led_count:
+            raise ValueError(f"Light {changed[-1]} is out of range [0-{self.led_count - 1}]")
+        writes = []
+        for device in self.devices:
+            end = device.offset + device.led_count
+            low, high = np.searchsorted(changed, [device.offset, end])
+            if low < high:
+                writes.append(device.engine.set_frame(pixels[device.offset:end], changed[low:high] - device.offset))
+        await asyncio.gather(*writes)
+
+    async def fade(self, light_id: int, value_255: int, duration_ms: int):
+        await self._ensure_mapped()
+        device, local_id = self.locate(light_id)
+        await device.engine.fade(local_id, value_255, duration_ms)
+
+    async def read_status(self) -> List[int]:
+        """同時查詢所有板子，依全域 ID 順序串接。"""
+        await self._ensure_mapped()
+        statuses = await asyncio.gather(*[device.engine.read_status() for device in self.devices])
+        result: List[int] = []
+        for device, status in zip(self.devices, statuses):
+            # 以板子回報的燈數為準，避免長度不一致時全域 ID 錯位
+            result.extend((list(status) + [0] * device.led_count)[:device.led_count])
+        return result
+
+    async def read_info(self) -> int:
+        """同時查詢所有板子的燈數並重新分配全域 ID，回傳總燈數；查詢失敗的板子沿用原本的燈數。"""
+        counts = await asyncio.gather(*[device.engine.read_info() for device in self.devices], return_exceptions=True)
+        if all(isinstance(count, BaseException) for count in counts):
+            raise counts[0]
+        for device, count in zip(self.devices, counts):
+            if isinstance(count, BaseException):
+                logger.warning(f"Query light count of {device.name} failed, keep {device.led_count}: {count}")
+            else:
+                device.led_count = count
+        self._assign_offsets()
+        self._mapped = True
+        return self.led_count
+
+    # ---------- pattern ----------
+
+    async def upload_pattern(self, program: PatternProgram) -> List[Device]:
+        """
+        把 pattern 拆給各板子並同時上傳；沒有用到的板子上原本的 pattern 會被停止並清除。
+
+        Args:
+            program (PatternProgram): 已驗證、以全域 ID 表示的程式。
+
+        Returns:
+            List[Device]: 收到程式的板子。
+        """
+        await self._ensure_mapped()
+        local = {id(device): localize(program, device.offset, device.led_count) for device in self.devices}
+        targets = [device for device in self.devices if local[id(device)] is not None]
+        stale = [device for device in self.devices if local[id(device)] is None and device.pattern is not None]
+        await asyncio.gather(
+            *[device.engine.upload_pattern(local[id(device)]) for device in targets],
+            *[device.engine.run_pattern(False) for device in stale],
+        )
+        for device in stale:
+            device.pattern = None
+        for device in targets:
+            device.pattern = local[id(device)]
+        self.pattern = program
+        return targets
+
+    def _pattern_devices(self) -> List[Device]:
+        devices = [device for device in self.devices if device.pattern is not None]
+        if not devices:
+            raise ValueError("No pattern has been uploaded, call upload_pattern first")
+        return devices
+
+    async def run_pattern(self, start: bool) -> List[Device]:
+        """同時開始或停止所有板子上的 pattern，各板子因此從同一個時間點開始播放。"""
+        devices = self._pattern_devices()
+        await asyncio.gather(*[device.engine.run_pattern(start) for device in devices])
+        return devices
+
+    async def read_pattern(self) -> List[Tuple[Device, List[int]]]:
+        """同時查詢有 pattern 的板子的播放狀態。"""
+        devices = self._pattern_devices()
+        states = await asyncio.gather(*[device.engine.read_pattern() for device in devices])
+        return list(zip(devices, states))
@@ -0,0 +1,133 @@
+import asyncio, contextvars, logging, time, uuid
+from dataclasses import dataclass, field, replace
+from typing import Any, Awaitable, Dict, List, Optional
+
+from .scheduler import PRIORITY_EFFECT, current_call
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Effect:
+    effect_id: str
+    light_id: int
+    kind: str
+    params: Dict[str, Any]
+    started_at: float
+    # 效果被手動取消後要寫回的亮度（0-255），None 表示維持當下狀態
+    final_value: Optional[int] = None
+    task: Optional[asyncio.Task] = field(default=None, repr=False)
+
+
+class EffectScheduler:
+    """
+    燈光效果排程器。
+
+    每個效果（例如閃爍）都是一個可取消的 asyncio task，呼叫端啟動後立即取得 effect id，
+    不需要等待整段動畫結束。每顆燈同一時間只會有一個效果，新的效果或新的寫入會搶占正在執行的效果。
+    """
+
+    def __init__(self):
+        self._effects: Dict[str, Effect] = {}
+        self._by_light: Dict[int, str] = {}
+
+    def start(self, light_id: int, kind: str, params: Dict[str, Any], coro: Awaitable, final_value: Optional[int] = None) -> Effect:
+        """
+        啟動一個效果，並搶占該燈上正在執行的效果。
+
+        Args:
+            light_id (int): 效果作用的燈。
+            kind (str): 效果種類，例如 `"blink"`。
+            params (Dict[str, Any]): 效果參數，僅用於列出效果時顯示。
+            coro (Awaitable): 實際執行效果的 coroutine。
+            final_value (Optional[int], optional): 效果被 `cancel()` 取消後要寫回的亮度。
+
+        Returns:
+            Effect: 新建立的效果。
+        """
+        self.preempt(light_id)
+        effect = Effect(
+            effect_id=uuid.uuid4().hex[:8],
+            light_id=light_id,
+            kind=kind,
+            params=params,
+            started_at=time.time(),
+            final_value=final_value,
+        )
+        # 效果的指令以較低的優先順序排程、沒有期限，不會擋住工具呼叫，也不會因為啟動它的工具呼叫的期限而失敗
+        context = contextvars.copy_context()
+        context.run(current_call.set, replace(current_call.get(), priority=PRIORITY_EFFECT, deadline=None))
+        effect.task = asyncio.get_running_loop().create_task(coro, name=f"effect-{kind}-{effect.effect_id}", context=context)
+        effect.task.add_done_callback(lambda task, effect=effect: self._on_done(effect, task))
+        self._effects[effect.effect_id] = effect
+        self._by_light[light_id] = effect.effect_id
+        logger.info(f"Effect {effect.effect_id} ({kind}) started on light-{light_id}")
+        return effect
+
+    def _on_done(self, effect: Effect, task: asyncio.Task):
+        self._effects.pop(effect.effect_id, None)
+        if self._by_light.get(effect.light_id) == effect.effect_id:
+            del self._by_light[effect.light_id]
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Effect {effect.effect_id} ({effect.kind}) on light-{effect.light_id} failed: {task.exception()}")
+
+    def preempt(self, light_id: int) -> Optional[Effect]:
+        """
+        取消指定燈上正在執行的效果（不寫回任何值），供新的寫入搶占使用。
+
+        效果在取消前已送出的指令仍會先於之後的寫入抵達 Arduino，因此不需要等待 task 結束。
+        """
+        effect_id = self._by_light.pop(light_id, None)
+        if effect_id is None:
+            return None
+        effect = self._effects.pop(effect_id, None)
+        if effect is not None and effect.task is not None:
+            effect.task.cancel()
+            logger.info(f"Effect {effect_id} ({effect.kind}) on light-{light_id} preempted")
+        return effect
+
+    def cancel(self, effect_id: str) -> Optional[Effect]:
+        """取消指定 id 的效果，回傳被取消的效果；找不到則回傳 None。"""
+        effect = self._effects.get(effect_id)
+        if effect is None:
+            return None
+        return self.preempt(effect.light_id)
+
+    def get(self, effect_id: str) -> Optional[Effect]:
+        return self._effects.get(effect_id)
+
+    def running(self) -> List[Effect]:
+        return sorted(self._effects.values(), key=lambda effect: effect.started_at)
+
+
+async def blink(writer, light_id: int, times: int, interval: float):
+    """
+    讓燈以固定間隔亮滅 `times` 次，最後停在關閉狀態。
+
+    Args:
+        writer: 提供 `set_brightness(light_id, value_255)` 的物件，通常是 `ShadowState`，讓快取跟著更新。
+    """
+    for _ in range(times):
+        # Turn on
+        await writer.set_brightness(light_id, 255)
+        await asyncio.sleep(interval)
+        # Turn off
+        await writer.set_brightness(light_id, 0)
+        await asyncio.sleep(interval)
+
+
+async def fade(writer, light_id: int, start: int, target: int, duration: float, steps_per_second: float = 20):
+    """
+    由 host 逐步寫入來漸變亮度，只在韌體不支援漸變指令時使用。
+
+    Args:
+        writer: 提供 `set_brightness(light_id, value_255)` 的物件，通常是 `ShadowState`。
+        start (int): 起始 PWM 值（0-255）。
+        target (int): 目標 PWM 值（0-255）。
+        duration (float): 漸變秒數。
+        steps_per_second (float, optional): 每秒寫入次數，預設為 20。
+    """
+    steps = max(1, int(duration * steps_per_second))
+    for step in range(1, steps + 1):
+        await asyncio.sleep(duration / steps)
+        await writer.set_brightness(light_id, round(start + (target - start) * step / steps))
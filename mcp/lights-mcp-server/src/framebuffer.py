@@ -0,0 +1,116 @@
+from typing import List, Tuple
+
+import numpy as np
+
+from .protocol import MAX_BYTE_LIGHT_ID, WRITE_PAYLOAD, BinaryCodec, Opcode, encode_frame, encode_runs
+
+# SPARSE frame 的表頭：基準燈號 (uint16) 與點陣圖長度
+SPARSE_HEADER = 3
+
+
+class FrameBuffer:
+    """
+    以 NumPy uint8 陣列保存每顆燈的 PWM 值（0-255），索引即燈的全域 ID。
+
+    比對新畫面與目前內容只需要一次向量運算，數百顆燈的燈條也不需要逐顆建立 Python 物件。
+
+    Args:
+        size (int, optional): 初始燈數，預設為 0。
+    """
+
+    def __init__(self, size: int = 0):
+        self.pixels = np.zeros(size, dtype=np.uint8)
+
+    def __len__(self) -> int:
+        return len(self.pixels)
+
+    def resize(self, size: int):
+        """調整燈數，保留既有的值，新增的燈為 0。"""
+        if size == len(self.pixels):
+            return
+        pixels = np.zeros(size, dtype=np.uint8)
+        keep = min(size, len(self.pixels))
+        pixels[:keep] = self.pixels[:keep]
+        self.pixels = pixels
+
+    def get(self, start: int = 0, stop: int = None) -> np.ndarray:
+        return self.pixels[start:stop].copy()
+
+    def diff(self, start: int, values: np.ndarray) -> np.ndarray:
+        """
+        找出從 `start` 開始的一段新值中與目前內容不同的燈。
+
+        Returns:
+            np.ndarray: 有變化的燈的全域 ID（由小到大）。
+        """
+        return np.flatnonzero(self.pixels[start:start + len(values)] != values) + start
+
+    def load(self, values) -> np.ndarray:
+        """以整個新畫面取代目前內容（燈數以新畫面為準），回傳有變化的燈。"""
+        values = np.asarray(values, dtype=np.uint8)
+        old = self.pixels[:len(values)]
+        changed = np.flatnonzero(old != values[:len(old)])
+        if len(values) > len(old):
+            changed = np.concatenate([changed, np.arange(len(old), len(values))])
+        self.pixels = values.copy()
+        return changed
+
+
+def _runs(changed: np.ndarray) -> List[Tuple[int, int]]:
+    """把由小到大的燈號切成連續區段，回傳 (起始燈號, 結束燈號 + 1)。"""
+    breaks = np.flatnonzero(np.diff(changed) != 1) + 1
+    starts = changed[np.concatenate(([0], breaks))]
+    stops = changed[np.concatenate((breaks - 1, [len(changed) - 1]))] + 1
+    return list(zip(starts.tolist(), stops.tolist()))
+
+
+def encode_run_delta(pixels: np.ndarray, changed: np.ndarray) -> bytes:
+    """以連續區段（RUNS）表示變化，適合相鄰的燈一起變化（例如漸層或整段改色）。"""
+    return encode_runs([(start, pixels[start:stop].tobytes()) for start, stop in _runs(changed)])
+
+
+def encode_sparse_delta(pixels: np.ndarray, changed: np.ndarray) -> bytes:
+    """
+    以點陣圖表示變化（SPARSE），payload 為 `基準燈號 (uint16), 點陣圖長度, 點陣圖, 點陣圖中每顆燈的 PWM 值`。
+
+    適合零散但彼此距離不遠的燈；每個 frame 從第一顆還沒送出的燈開始，盡量涵蓋到 payload 放不下為止。
+    """
+    frames = []
+    changed_list = changed.tolist()
+    index = 0
+    while index < len(changed_list):
+        base = changed_list[index]
+        end = index + 1
+        while (
+            end < len(changed_list)
+            and SPARSE_HEADER + (changed_list[end] - base) // 8 + 1 + (end - index + 1) <= WRITE_PAYLOAD
+        ):
+            end += 1
+        offsets = changed[index:end] - base
+        bitmap = np.zeros(int(offsets[-1]) // 8 + 1, dtype=np.uint8)
+        np.bitwise_or.at(bitmap, offsets >> 3, (1 << (offsets & 7)).astype(np.uint8))
+        payload = base.to_bytes(2, "little") + bytes([len(bitmap)]) + bitmap.tobytes() + pixels[changed[index:end]].tobytes()
+        frames.append(encode_frame(Opcode.SPARSE, payload))
+        index = end
+    return b"".join(frames)
+
+
+def encode_delta(pixels: np.ndarray, changed: np.ndarray) -> bytes:
+    """
+    把一個畫面與 Arduino 目前內容的差異打包成 frame，只送出有變化的燈，長度與變化的燈數成正比而不是燈條長度。
+
+    分別以連續區段、點陣圖與（燈號都在 1 byte 內時的）批次指令編碼，取總長度最短的一種。
+
+    Args:
+        pixels (np.ndarray): 板子上完整的新畫面（板子上的燈號）。
+        changed (np.ndarray): 有變化的燈號，由小到大。
+
+    Returns:
+        bytes: 依序送出的 frame，沒有變化時為空。
+    """
+    if not len(changed):
+        return b""
+    candidates = [encode_run_delta(pixels, changed), encode_sparse_delta(pixels, changed)]
+    if changed[-1] <= MAX_BYTE_LIGHT_ID:
+        candidates.append(BinaryCodec().set_brightness_batch(dict(zip(changed.tolist(), pixels[changed].tolist()))))
+    return min(candidates, key=len)
@@ -0,0 +1,54 @@
+import logging, time
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+from .store import JsonStore
+
+logger = logging.getLogger(__name__)
+
+GROUPS_FILE_VERSION = 1
+MAX_GROUP_NAME = 64
+# 內建的廣播群組，永遠包含目前所有的燈，不能建立或刪除
+BROADCAST_GROUP = "all"
+
+
+@dataclass
+class Group:
+    name: str
+    # 燈的全域 ID，由小到大排列
+    light_ids: List[int] = field(default_factory=list)
+    created_at: float = field(default_factory=time.time)
+
+
+class GroupStore(JsonStore[Group]):
+    """
+    具名燈光群組的儲存區，保存在本機的 JSON 檔中（寫入方式見 `JsonStore`），啟動時載入。
+
+    檔案格式為 `{"version": 1, "groups": {"<name>": {"light_ids": [0, 1]}}}`，可以事先手動編寫作為設定檔，
+    執行期間新增或刪除的群組也會寫回同一個檔案。
+
+    Args:
+        path (str): 群組檔路徑，檔案不存在時視為沒有任何群組。
+    """
+
+    def __init__(self, path: str):
+        super().__init__(path, "groups", GROUPS_FILE_VERSION)
+
+    def _decode(self, name: str, data: dict) -> Optional[Group]:
+        if name == BROADCAST_GROUP:
+            logger.warning(f"Group '{BROADCAST_GROUP}' in {self.path} is reserved for all lights, ignored")
+            return None
+        return Group(
+            name=name,
+            light_ids=sorted({int(light_id) for light_id in data["light_ids"]}),
+            created_at=data.get("created_at", time.time()),
+        )
+
+    def _encode(self, group: Group) -> dict:
+        return {"light_ids": group.light_ids, "created_at": group.created_at}
+
+    def save(self, name: str, light_ids: List[int]) -> Group:
+        """新增或覆寫群組並寫入檔案。"""
+        if name == BROADCAST_GROUP:
+            raise ValueError(f"Group name '{BROADCAST_GROUP}' is reserved for all lights")
+        return self._put(name, Group(name=name, light_ids=sorted(set(light_ids))))
@@ -0,0 +1,168 @@
+import time
+from dataclasses import dataclass
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+# 每顆燈的值還不知道時使用的標記
+UNKNOWN = -1
+
+
+@dataclass
+class LightSummary:
+    light_id: int
+    # 每個區間中燈亮著（PWM > 0）的秒數
+    on_seconds: np.ndarray
+    # 每個區間中以時間加權的平均 PWM 值（0-255），區間內完全不知道狀態時為 NaN
+    mean_255: np.ndarray
+    # 每個區間中知道燈的狀態的秒數（第一次記錄之前與未來的時間不算）
+    known_seconds: np.ndarray
+
+
+class BrightnessHistory:
+    """
+    固定記憶體的亮度歷史：以 NumPy 環形緩衝區保存 `(時間, 燈號, PWM 值)` 樣本，寫滿後覆寫最舊的樣本。
+
+    只記錄有變化的值，亮度是階梯函數：每個樣本的值維持到同一顆燈的下一個樣本為止。
+    被覆寫的樣本不會直接遺失狀態，每顆燈保留最後一個被覆寫的樣本作為起點，因此仍然知道緩衝區中第一個樣本之前的亮度。
+    查詢時以累積積分在區間邊界上內插（`np.interp`），時間與樣本數成線性，不需要逐筆重播。
+
+    Args:
+        capacity (int, optional): 最多保存的樣本數，預設為 65536（約 720 KB）。
+    """
+
+    def __init__(self, capacity: int = 65536):
+        if capacity <= 0:
+            raise ValueError(f"The history capacity must be a positive integer, got {capacity}")
+        self.capacity = capacity
+        self.times = np.zeros(capacity, dtype=np.float64)
+        self.lights = np.zeros(capacity, dtype=np.uint16)
+        self.values = np.zeros(capacity, dtype=np.uint8)
+        # 累計寫入的樣本數，下一個樣本寫在 `count % capacity`
+        self.count = 0
+        # 每顆燈最後記錄的值，用於略過沒有變化的樣本
+        self._last = np.full(0, UNKNOWN, dtype=np.int16)
+        # 每顆燈最後一個被覆寫的樣本
+        self._baseline_values = np.full(0, UNKNOWN, dtype=np.int16)
+        self._baseline_times = np.zeros(0, dtype=np.float64)
+
+    def __len__(self) -> int:
+        return min(self.count, self.capacity)
+
+    def _ensure_lights(self, size: int):
+        if size <= len(self._last):
+            return
+        grow = size - len(self._last)
+        self._last = np.concatenate([self._last, np.full(grow, UNKNOWN, dtype=np.int16)])
+        self._baseline_values = np.concatenate([self._baseline_values, np.full(grow, UNKNOWN, dtype=np.int16)])
+        self._baseline_times = np.concatenate([self._baseline_times, np.zeros(grow, dtype=np.float64)])
+
+    def record(self, light_ids: Sequence[int], values: Sequence[int], timestamp: Optional[float] = None):
+        """
+        記錄一組燈目前的 PWM 值，與上一次記錄相同的值會被略過。
+
+        Args:
+            light_ids (Sequence[int]): 燈的全域 ID，不重複。
+            values (Sequence[int]): 對應的 PWM 值（0-255）。
+            timestamp (Optional[float], optional): 樣本時間（`time.time()`），預設為現在。
+        """
+        light_ids = np.asarray(light_ids, dtype=np.intp)
+        values = np.asarray(values, dtype=np.int16)
+        if not len(light_ids):
+            return
+        self._ensure_lights(int(light_ids.max()) + 1)
+        changed = self._last[light_ids] != values
+        light_ids, values = light_ids[changed], values[changed]
+        if not len(light_ids):
+            return
+        self._last[light_ids] = values
+        timestamp = time.time() if timestamp is None else timestamp
+        for offset in range(0, len(light_ids), self.capacity):
+            self._append(light_ids[offset:offset + self.capacity], values[offset:offset + self.capacity], timestamp)
+
+    def _append(self, light_ids: np.ndarray, values: np.ndarray, timestamp: float):
+        positions = self.count + np.arange(len(light_ids))
+        slots = positions % self.capacity
+        evicted = slots[positions >= self.capacity]
+        if len(evicted):
+            # 被覆寫的樣本依時間順序排列，每顆燈只留最後一個作為起點
+            evicted_lights = self.lights[evicted][::-1]
+            lights, index = np.unique(evicted_lights, return_index=True)
+            newest = evicted[::-1][index]
+            self._baseline_values[lights] = self.values[newest]
+            self._baseline_times[lights] = self.times[newest]
+        self.times[slots] = timestamp
+        self.lights[slots] = light_ids
+        self.values[slots] = values
+        self.count += len(light_ids)
+
+    def _chronological(self):
+        if self.count <= self.capacity:
+            return self.times[:self.count], self.lights[:self.count], self.values[:self.count]
+        head = self.count % self.capacity
+        return (
+            np.concatenate([self.times[head:], self.times[:head]]),
+            np.concatenate([self.lights[head:], self.lights[:head]]),
+            np.concatenate([self.values[head:], self.values[:head]]),
+        )
+
+    @property
+    def covered_from(self) -> Optional[float]:
+        """最早知道狀態的時間（最舊的樣本或被覆寫的起點），沒有任何樣本時為 None。"""
+        if not self.count:
+            return None
+        oldest = self.times[self.count % self.capacity] if self.count > self.capacity else self.times[0]
+        known = self._baseline_values != UNKNOWN
+        return float(min(oldest, self._baseline_times[known].min())) if known.any() else float(oldest)
+
+    def light_ids(self) -> List[int]:
+        """曾經記錄過的燈。"""
+        return np.flatnonzero(self._last != UNKNOWN).tolist()
+
+    def summarize(self, light_ids: Sequence[int], edges: np.ndarray, now: Optional[float] = None) -> List[LightSummary]:
+        """
+        把每顆燈的亮度依區間彙總。
+
+        每顆燈的亮度是階梯函數，先算出在每個樣本時間上的累積積分（PWM 值 × 秒數、亮著的秒數、知道狀態的秒數），
+        再以 `np.interp` 在區間邊界上內插，相鄰邊界的差就是區間內的總和。
+
+        Args:
+            light_ids (Sequence[int]): 要彙總的燈。
+            edges (np.ndarray): 遞增的區間邊界（`time.time()`），n + 1 個邊界對應 n 個區間。
+            now (Optional[float], optional): 最後一個值持續到的時間，預設為現在。
+
+        Returns:
+            List[LightSummary]: 與 `light_ids` 相同順序的彙總。
+        """
+        now = time.time() if now is None else now
+        times, lights, values = self._chronological()
+        # 依燈號穩定排序，同一顆燈的樣本仍依時間排列
+        order = np.argsort(lights, kind="stable")
+        sorted_lights = lights[order]
+        summaries = []
+        for light_id in light_ids:
+            lo, hi = np.searchsorted(sorted_lights, [light_id, light_id + 1])
+            sample_times = times[order[lo:hi]]
+            sample_values = values[order[lo:hi]].astype(np.float64)
+            if light_id < len(self._baseline_values) and self._baseline_values[light_id] != UNKNOWN:
+                sample_times = np.concatenate([[self._baseline_times[light_id]], sample_times])
+                sample_values = np.concatenate([[float(self._baseline_values[light_id])], sample_values])
+            if not len(sample_times):
+                empty = np.zeros(len(edges) - 1)
+                summaries.append(LightSummary(light_id, empty, np.full(len(edges) - 1, np.nan), empty))
+                continue
+            # 最後一個值持續到現在；系統時間被往回調時仍保持遞增
+            knots = np.maximum.accumulate(np.append(sample_times, max(now, sample_times[-1])))
+            durations = np.diff(knots)
+
+            def integrate(weights: np.ndarray) -> np.ndarray:
+                cumulative = np.concatenate([[0.0], np.cumsum(weights * durations)])
+                return np.diff(np.interp(edges, knots, cumulative))
+
+            area = integrate(sample_values)
+            on_seconds = integrate((sample_values > 0).astype(np.float64))
+            known_seconds = integrate(np.ones(len(durations)))
+            with np.errstate(invalid="ignore", divide="ignore"):
+                mean_255 = np.where(known_seconds > 0, area / known_seconds, np.nan)
+            summaries.append(LightSummary(light_id, on_seconds, mean_255, known_seconds))
+        return summaries
@@ -0,0 +1,404 @@
+import argparse, asyncio, contextvars, json, logging, math, mmap, os, struct, sys, time
+from dataclasses import dataclass, asdict
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from .patterns import PatternProgram, PatternStep
+
+logger = logging.getLogger(__name__)
+
+# 目前正在執行的 MCP 工具名稱，由 server 在呼叫工具前設定；背景 reconcile 等內部讀寫為空字串
+current_tool: contextvars.ContextVar = contextvars.ContextVar("lights_current_tool", default="")
+
+JOURNAL_MAGIC = b"LJNL"
+JOURNAL_VERSION = 3
+# magic, version, record size, capacity, 已寫入的總筆數（下一筆紀錄的位置）, 最後使用的指令序號
+_HEADER = struct.Struct("<4sHHIQI")
+HEADER_SIZE = 64
+_WRITTEN_OFFSET = 12
+_SEQ_OFFSET = 20
+# 時間戳記, 指令序號, 延遲（微秒）, 指令種類, 結果, 燈號, PWM 值, 漸變毫秒數, 工具名稱
+# 燈號與值以無號整數保存，多塊板子的全域燈號可超過 32767；負數（沒有燈號或值、pattern 的標記）以補數保存，讀出時還原
+_RECORD = struct.Struct("<dIIBBIHH24s")
+RECORD_SIZE = _RECORD.size
+
+OP_SET = 1
+OP_BATCH = 2
+OP_FADE = 3
+OP_STATUS = 4
+OP_INFO = 5
+OP_GROUP = 6
+OP_FRAME = 7
+OP_CONFIRM = 8
+OP_PATTERN = 9
+OP_PATTERN_START = 10
+OP_PATTERN_STOP = 11
+OP_NAMES = {
+    OP_SET: "set", OP_BATCH: "batch", OP_FADE: "fade", OP_STATUS: "status", OP_INFO: "info", OP_GROUP: "group", OP_FRAME: "frame", OP_CONFIRM: "confirm",
+    OP_PATTERN: "pattern", OP_PATTERN_START: "start", OP_PATTERN_STOP: "stop",
+}
+# 一個指令包含多顆燈、每顆燈各記一筆紀錄的指令種類
+MULTI_LIGHT_OPS = (OP_BATCH, OP_GROUP, OP_FRAME, OP_CONFIRM, OP_PATTERN)
+# 上傳 pattern 的紀錄：第一筆為程式（燈號 -1，值為步驟數，毫秒數欄位為圈數），
+# 每個步驟一筆標記（燈號 -2，值為是否漸變，毫秒數欄位為步驟長度），之後是步驟中每顆燈的值
+PATTERN_PROGRAM_ID = -1
+PATTERN_STEP_ID = -2
+
+RESULT_OK = 0
+RESULT_ERROR = 1
+RESULT_TIMEOUT = 2
+RESULT_NAMES = {RESULT_OK: "ok", RESULT_ERROR: "error", RESULT_TIMEOUT: "timeout"}
+
+
+@dataclass
+class JournalRecord:
+    timestamp: float
+    # 同一個指令（例如批次寫入的每顆燈）共用同一個序號
+    seq: int
+    latency_us: int
+    op: int
+    result: int
+    light_id: int
+    value: int
+    duration_ms: int
+    tool: str
+
+    def to_dict(self) -> dict:
+        record = asdict(self)
+        record["op"] = OP_NAMES.get(self.op, str(self.op))
+        record["result"] = RESULT_NAMES.get(self.result, str(self.result))
+        return record
+
+
+class CommandJournal:
+    """
+    固定大小、以 mmap 對應到檔案的指令日誌環形緩衝區。
+
+    每筆紀錄固定 50 bytes，寫入只是一次 `struct.pack_into()` 到記憶體，不開檔也不 flush，
+    由作業系統在背景把髒頁寫回檔案；伺服器異常結束後檔案內容仍可用於事後分析。寫滿後從頭覆蓋最舊的紀錄。
+
+    Args:
+        path (str): 日誌檔路徑；已存在且格式相同時接續寫入，否則重新建立。
+        capacity (int, optional): 最多保留的紀錄筆數，預設為 65536（約 3 MB）。
+    """
+
+    def __init__(self, path: str, capacity: int = 65536):
+        if capacity <= 0:
+            raise ValueError(f"Journal capacity must be positive, got {capacity}")
+        self.path = path
+        self.capacity = capacity
+        size = HEADER_SIZE + capacity * RECORD_SIZE
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._file = open(path, "a+b")
+        self._file.seek(0, os.SEEK_END)
+        reuse = self._file.tell() == size
+        if not reuse:
+            self._file.truncate(size)
+        self._mm = mmap.mmap(self._file.fileno(), size)
+
+        magic, version, record_size, stored_capacity, written, seq = _HEADER.unpack_from(self._mm, 0)
+        if reuse and (magic, version, record_size, stored_capacity) == (JOURNAL_MAGIC, JOURNAL_VERSION, RECORD_SIZE, capacity):
+            # 指令序號也接續下去，重新啟動前後的指令不會共用序號而在重播時被合併
+            self.written = written
+            self._seq = seq
+            logger.info(f"Continue command journal {path} ({min(written, capacity)} records)")
+        else:
+            self.written = 0
+            self._seq = 0
+            self._mm[:HEADER_SIZE] = bytes(HEADER_SIZE)
+            _HEADER.pack_into(self._mm, 0, JOURNAL_MAGIC, JOURNAL_VERSION, RECORD_SIZE, capacity, 0, 0)
+
+    def next_seq(self) -> int:
+        self._seq = (self._seq + 1) & 0xFFFFFFFF
+        struct.pack_into("<I", self._mm, _SEQ_OFFSET, self._seq)
+        return self._seq
+
+    def append(self, seq: int, latency: float, op: int, result: int, light_id: int = -1, value: int = -1, duration_ms: int = 0, tool: str = ""):
+        """寫入一筆紀錄；先寫紀錄再更新 header 的筆數，讀取端不會看到寫到一半的紀錄。"""
+        offset = HEADER_SIZE + (self.written % self.capacity) * RECORD_SIZE
+        _RECORD.pack_into(
+            self._mm, offset,
+            time.time(), seq, min(int(latency * 1_000_000), 0xFFFFFFFF), op, result,
+            light_id & 0xFFFFFFFF, value & 0xFFFF, duration_ms, tool.encode("utf-8")[:24],
+        )
+        self.written += 1
+        struct.pack_into("<Q", self._mm, _WRITTEN_OFFSET, self.written)
+
+    def close(self):
+        self._mm.flush()
+        self._mm.close()
+        self._file.close()
+
+
+def read_journal(path: str) -> List[JournalRecord]:
+    """依時間順序讀出日誌中仍保留的所有紀錄。"""
+    with open(path, "rb") as f:
+        data = f.read()
+    magic, version, record_size, capacity, written, _ = _HEADER.unpack_from(data, 0)
+    if magic != JOURNAL_MAGIC or version != JOURNAL_VERSION or record_size != RECORD_SIZE:
+        raise ValueError(f"{path} is not a lights command journal (version {JOURNAL_VERSION})")
+    count = min(written, capacity)
+    first = written - count
+    records = []
+    for index in range(first, written):
+        timestamp, seq, latency_us, op, result, light_id, value, duration_ms, tool = _RECORD.unpack_from(data, HEADER_SIZE + (index % capacity) * RECORD_SIZE)
+        records.append(JournalRecord(
+            timestamp, seq, latency_us, op, result,
+            light_id - (1 << 32) if light_id >= 1 << 31 else light_id,
+            value - (1 << 16) if value >= 1 << 15 else value,
+            duration_ms, tool.rstrip(b"\0").decode("utf-8", errors="replace"),
+        ))
+    return records
+
+
+class JournalRecorder:
+    """
+    把經過的每個裝置指令記錄到 `CommandJournal`：時間、工具、燈號、值、延遲與結果。
+
+    提供與 `SerialEngine` 相同的高階介面，放在寫入合併層與 `DeviceRegistry` 之間，記錄的是實際送到 Arduino 的指令。
+
+    Args:
+        downstream: 實際送出指令的物件（通常是 `DeviceRegistry`）。
+        journal (CommandJournal): 日誌。
+    """
+
+    def __init__(self, downstream, journal: CommandJournal):
+        self.downstream = downstream
+        self.journal = journal
+
+    async def _run(self, op: int, lights: Dict[int, int], awaitable, duration_ms: int = 0, entries: Optional[List[Tuple[int, int, int]]] = None):
+        seq = self.journal.next_seq()
+        result = RESULT_OK
+        started = time.perf_counter()
+        try:
+            return await awaitable
+        except TimeoutError:
+            result = RESULT_TIMEOUT
+            raise
+        except Exception:
+            result = RESULT_ERROR
+            raise
+        finally:
+            latency = time.perf_counter() - started
+            tool = current_tool.get()
+            if entries is None:
+                entries = [(light_id, value, duration_ms) for light_id, value in (lights.items() if lights else [(-1, -1)])]
+            for light_id, value, entry_ms in entries:
+                self.journal.append(seq, latency, op, result, light_id, value, entry_ms, tool)
+
+    async def set_brightness(self, light_id: int, value_255: int):
+        await self._run(OP_SET, {light_id: value_255}, self.downstream.set_brightness(light_id, value_255))
+
+    async def set_brightness_batch(self, values: Dict[int, int]):
+        await self._run(OP_BATCH, values, self.downstream.set_brightness_batch(values))
+
+    async def set_brightness_confirm(self, values: Dict[int, int]) -> Dict[int, int]:
+        # 記錄要求的值，Arduino 回報的值由影子快取與亮度歷史記錄
+        return await self._run(OP_CONFIRM, values, self.downstream.set_brightness_confirm(values))
+
+    async def set_brightness_group(self, light_ids: List[int], value_255: int):
+        await self._run(OP_GROUP, {light_id: value_255 for light_id in light_ids}, self.downstream.set_brightness_group(light_ids, value_255))
+
+    async def set_frame(self, pixels, changed):
+        # 只記錄有變化的燈，與實際送出的內容一致
+        await self._run(OP_FRAME, dict(zip(changed.tolist(), pixels[changed].tolist())), self.downstream.set_frame(pixels, changed))
+
+    async def fade(self, light_id: int, value_255: int, duration_ms: int):
+        await self._run(OP_FADE, {light_id: value_255}, self.downstream.fade(light_id, value_255, duration_ms), duration_ms)
+
+    async def upload_pattern(self, program: PatternProgram):
+        return await self._run(OP_PATTERN, {}, self.downstream.upload_pattern(program), entries=pattern_entries(program))
+
+    async def run_pattern(self, start: bool):
+        return await self._run(OP_PATTERN_START if start else OP_PATTERN_STOP, {}, self.downstream.run_pattern(start))
+
+    async def read_pattern(self):
+        return await self.downstream.read_pattern()
+
+    async def read_status(self) -> List[int]:
+        return await self._run(OP_STATUS, {}, self.downstream.read_status())
+
+    async def read_info(self) -> int:
+        return await self._run(OP_INFO, {}, self.downstream.read_info())
+
+
+def pattern_entries(program: PatternProgram) -> List[Tuple[int, int, int]]:
+    """把 pattern 程式轉成日誌紀錄的 (燈號, 值, 毫秒數)，格式見 `PATTERN_PROGRAM_ID`。"""
+    entries = [(PATTERN_PROGRAM_ID, len(program.steps), program.loops)]
+    for step in program.steps:
+        entries.append((PATTERN_STEP_ID, int(step.ramp), step.duration_ms))
+        entries.extend((light_id, value, step.duration_ms) for light_id, value in step.values.items())
+    return entries
+
+
+def pattern_from_records(records: List[JournalRecord]) -> PatternProgram:
+    """由一個上傳 pattern 指令的紀錄還原程式，程式名稱不會記錄。"""
+    steps: List[PatternStep] = []
+    for record in records[1:]:
+        if record.light_id == PATTERN_STEP_ID:
+            steps.append(PatternStep(record.duration_ms, {}, ramp=bool(record.value)))
+        else:
+            steps[-1].values[record.light_id] = record.value
+    return PatternProgram(steps, records[0].duration_ms, "journal")
+
+
+# ==================== CLI ====================
+
+def _group_commands(records: List[JournalRecord]) -> Iterator[List[JournalRecord]]:
+    """把共用序號的紀錄（同一個批次或群組指令）合併成一個指令。"""
+    group: List[JournalRecord] = []
+    for record in records:
+        if group and (record.seq != group[0].seq or record.op not in MULTI_LIGHT_OPS):
+            yield group
+            group = []
+        group.append(record)
+    if group:
+        yield group
+
+
+def _format_record(record: JournalRecord) -> str:
+    when = datetime.fromtimestamp(record.timestamp).strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+    target = ""
+    if record.op == OP_PATTERN and record.light_id == PATTERN_PROGRAM_ID:
+        target = f"steps={record.value} loops={record.duration_ms}"
+    elif record.op == OP_PATTERN and record.light_id == PATTERN_STEP_ID:
+        target = f"step ramp={record.value} duration={record.duration_ms}ms"
+    elif record.light_id >= 0:
+        target = f"light={record.light_id} value={record.value}"
+        if record.op == OP_FADE:
+            target += f" duration={record.duration_ms}ms"
+    return (
+        f"{when}  #{record.seq:<8}{record.tool or '-':<24}{OP_NAMES.get(record.op, '?'):<8}"
+        f"{target:<36}{record.latency_us / 1000:>9.2f} ms  {RESULT_NAMES.get(record.result, '?')}"
+    )
+
+
+def _dump(args) -> int:
+    records = read_journal(args.file)
+    if args.last:
+        records = records[-args.last:]
+    for record in records:
+        print(json.dumps(record.to_dict(), ensure_ascii=False) if args.json else _format_record(record))
+    return 0
+
+
+def _percentile(sorted_values: List[float], p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[max(1, math.ceil(p / 100 * len(sorted_values))) - 1]
+
+
+async def _replay(args) -> int:
+    import numpy as np
+
+    from .connection import SerialConnection
+    from .devices import DeviceRegistry
+    from .serial_engine import SerialEngine
+
+    records = read_journal(args.file)
+    if args.last:
+        records = records[-args.last:]
+    commands = [group for group in _group_commands(records) if not (args.writes_only and group[0].op in (OP_STATUS, OP_INFO))]
+    if not commands:
+        print("No commands to replay")
+        return 0
+
+    devices = DeviceRegistry([
+        (url, SerialEngine(SerialConnection(url, baudrate=args.baud, timeout=1, ready_timeout=args.ready_timeout), protocol=args.protocol))
+        for url in args.port
+    ])
+    await devices.read_info()
+
+    def issue(group: List[JournalRecord]):
+        first = group[0]
+        if first.op == OP_SET:
+            return devices.set_brightness(first.light_id, first.value)
+        if first.op == OP_BATCH:
+            return devices.set_brightness_batch({record.light_id: record.value for record in group})
+        if first.op == OP_CONFIRM:
+            return devices.set_brightness_confirm({record.light_id: record.value for record in group})
+        if first.op == OP_GROUP:
+            return devices.set_brightness_group([record.light_id for record in group], first.value)
+        if first.op == OP_FRAME:
+            changed = np.array([record.light_id for record in group], dtype=np.intp)
+            pixels = np.zeros(max(devices.led_count, int(changed.max()) + 1), dtype=np.uint8)
+            pixels[changed] = [record.value for record in group]
+            return devices.set_frame(pixels, changed)
+        if first.op == OP_PATTERN:
+            return devices.upload_pattern(pattern_from_records(group))
+        if first.op in (OP_PATTERN_START, OP_PATTERN_STOP):
+            return devices.run_pattern(first.op == OP_PATTERN_START)
+        if first.op == OP_FADE:
+            return devices.fade(first.light_id, first.value, first.duration_ms)
+        if first.op == OP_STATUS:
+            return devices.read_status()
+        return devices.read_info()
+
+    latencies: List[float] = []
+    errors = 0
+
+    async def run(group: List[JournalRecord]):
+        nonlocal errors
+        started = time.perf_counter()
+        try:
+            await issue(group)
+        except Exception as e:
+            errors += 1
+            logger.warning(f"Replay command #{group[0].seq} ({OP_NAMES.get(group[0].op)}) failed: {e}")
+        latencies.append(time.perf_counter() - started)
+
+    # 依原本的時間間隔（除以 speed）發出指令，不等前一個指令完成，重現原本的負載；speed 為 0 時依序盡快送出
+    origin = commands[0][0].timestamp
+    started = time.perf_counter()
+    tasks = []
+    for group in commands:
+        if args.speed > 0:
+            delay = (group[0].timestamp - origin) / args.speed - (time.perf_counter() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(run(group)))
+        else:
+            await run(group)
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+
+    original = sorted(group[0].latency_us / 1_000_000 for group in commands)
+    latencies.sort()
+    print(f"Replayed {len(commands)} commands in {elapsed:.2f}s ({errors} errors)")
+    print(f"{'latency ms':<12}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}")
+    for label, values in (("original", original), ("replay", latencies)):
+        print(
+            f"{label:<12}{_percentile(values, 50) * 1000:>10.2f}{_percentile(values, 95) * 1000:>10.2f}"
+            f"{_percentile(values, 99) * 1000:>10.2f}{values[-1] * 1000:>10.2f}"
+        )
+    for device in devices.devices:
+        await device.engine.close()
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Dump or replay the command journal of the lights MCP server")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    dump_parser = subparsers.add_parser("dump", help="Print the journal records in time order")
+    dump_parser.add_argument("file", type=str, help="Journal file (LIGHTS_JOURNAL_FILE of the server)")
+    dump_parser.add_argument("--last", type=int, default=0, help="Only the last N records")
+    dump_parser.add_argument("--json", action="store_true", help="One JSON object per line")
+
+    replay_parser = subparsers.add_parser("replay", help="Send the journaled commands to a real or simulated Arduino")
+    replay_parser.add_argument("file", type=str, help="Journal file (LIGHTS_JOURNAL_FILE of the server)")
+    replay_parser.add_argument("--port", type=str, action="append", required=True, help="Serial port or socket:// URL of a board, repeat for several boards in the same order as the server")
+    replay_parser.add_argument("--speed", type=float, default=1.0, help="Replay speed factor (2 = twice as fast), 0 sends the commands back to back")
+    replay_parser.add_argument("--last", type=int, default=0, help="Only replay the last N records")
+    replay_parser.add_argument("--writes-only", action="store_true", help="Skip the status and info queries")
+    replay_parser.add_argument("--baud", type=int, default=9600, help="Baud rate")
+    replay_parser.add_argument("--protocol", type=str, default="auto", choices=["auto", "ascii", "binary"], help="Serial protocol")
+    replay_parser.add_argument("--ready-timeout", type=float, default=3, help="Seconds to wait for the 'Arduino Ready.' banner")
+    args = parser.parse_args()
+
+    if args.command == "dump":
+        sys.exit(_dump(args))
+    sys.exit(asyncio.run(_replay(args)))
@@ -0,0 +1,161 @@
+import math
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+# 工具延遲的預設 bucket（秒），涵蓋只讀快取的工具到等待序列埠回應的工具
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+Labels = Tuple[str, ...]
+
+
+def percentile_ms(sorted_values: Sequence[float], p: float) -> float:
+    """由小到大排列的秒數取第 p 百分位（nearest-rank），換算成毫秒。"""
+    if not sorted_values:
+        return 0.0
+    return round(sorted_values[max(1, math.ceil(p / 100 * len(sorted_values))) - 1] * 1000, 3)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Labels, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """只增不減的計數器，每組 label 值一個數值；熱路徑上只有一次 dict 更新。"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, labels: Labels = (), amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, labels: Labels = ()) -> float:
+        return self._values.get(labels, 0)
+
+    def samples(self) -> Iterable[str]:
+        for labels, value in self._values.items():
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+
+
+class Histogram:
+    """
+    固定 bucket 的直方圖。`observe()` 只做一次二分搜尋與幾個整數加法，累積分佈在輸出時才計算。
+
+    Args:
+        name (str): 指標名稱。
+        help (str): 說明文字。
+        labelnames (Sequence[str], optional): label 名稱。
+        buckets (Sequence[float], optional): 由小到大的 bucket 上限，預設為 `LATENCY_BUCKETS`。
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # 每組 label：[各 bucket 的個別次數..., 超過最大 bucket 的次數], 總和
+        self._counts: Dict[Labels, List[int]] = {}
+        self._sums: Dict[Labels, float] = {}
+
+    def observe(self, labels: Labels, value: float):
+        counts = self._counts.get(labels)
+        if counts is None:
+            counts = self._counts[labels] = [0] * (len(self.buckets) + 1)
+            self._sums[labels] = 0.0
+        counts[bisect_left(self.buckets, value)] += 1
+        self._sums[labels] += value
+
+    def count(self, labels: Labels = ()) -> int:
+        return sum(self._counts.get(labels, ()))
+
+    def samples(self) -> Iterable[str]:
+        for labels, counts in self._counts.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                le = _format_labels(self.labelnames, labels, f'le="{_format_value(float(bound))}"')
+                yield f"{self.name}_bucket{le} {cumulative}"
+            plain = _format_labels(self.labelnames, labels)
+            yield f"{self.name}_sum{plain} {_format_value(self._sums[labels])}"
+            yield f"{self.name}_count{plain} {cumulative}"
+
+
+class CallbackMetric:
+    """
+    輸出時才向 callback 取值的指標，用於序列埠位元組數、佇列深度等本來就記錄在其他物件上的數值，熱路徑上沒有任何額外成本。
+
+    Args:
+        name (str): 指標名稱。
+        help (str): 說明文字。
+        kind (str): `"counter"` 或 `"gauge"`。
+        labelnames (Sequence[str]): label 名稱。
+        collect (Callable[[], Iterable[Tuple[Labels, float]]]): 回傳 (label 值, 數值) 的 callback。
+    """
+
+    def __init__(self, name: str, help: str, kind: str, labelnames: Sequence[str], collect: Callable[[], Iterable[Tuple[Labels, float]]]):
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.labelnames = tuple(labelnames)
+        self.collect = collect
+
+    def samples(self) -> Iterable[str]:
+        for labels, value in self.collect():
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+
+
+class MetricsRegistry:
+    """
+    精簡的 Prometheus 指標註冊表，`render()` 輸出 text exposition format（0.0.4），不依賴 `prometheus_client`。
+
+    所有指標都只在 event loop 上更新，不需要鎖。
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+
+    def _register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric '{metric.name}' is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    def callback(self, name: str, help: str, kind: str, labelnames: Sequence[str], collect: Callable[[], Iterable[Tuple[Labels, float]]]) -> CallbackMetric:
+        return self._register(CallbackMetric(name, help, kind, labelnames, collect))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
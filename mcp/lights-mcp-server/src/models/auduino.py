@@ -1,9 +1,90 @@
 from pydantic import BaseModel, Field, NonNegativeInt
-from typing import List
+from typing import Any, Dict, List, Optional
 
 class LightInfo(BaseModel):
     light_id: NonNegativeInt = Field(..., description="燈的編號")
     brightness: NonNegativeInt = Field(..., ge=0, le=255, description="目前的亮度(0-255)")
 
 class FetchLightsInfoOutput(BaseModel):
-    infos: List[LightInfo] = Field(default_factory=list)
\ No newline at end of file
+    infos: List[LightInfo] = Field(default_factory=list)
+
+class LightsRangeOutput(BaseModel):
+    start: NonNegativeInt = Field(..., description="第一顆燈的編號")
+    brightness: List[int] = Field(default_factory=list, description="從 start 開始每顆燈的亮度百分比(0-100)")
+
+class LightUpdate(BaseModel):
+    light_id: NonNegativeInt = Field(..., description="燈的編號")
+    brightness: NonNegativeInt = Field(..., description="亮度百分比(0-100)")
+
+class EffectInfo(BaseModel):
+    effect_id: str = Field(..., description="效果的編號")
+    light_id: NonNegativeInt = Field(..., description="效果作用的燈的編號")
+    kind: str = Field(..., description="效果種類，例如 blink")
+    params: Dict[str, Any] = Field(default_factory=dict, description="效果參數")
+    elapsed: float = Field(..., description="效果已執行的秒數")
+
+class ListEffectsOutput(BaseModel):
+    effects: List[EffectInfo] = Field(default_factory=list)
+
+class DeviceInfo(BaseModel):
+    name: str = Field(..., description="裝置名稱（序列埠路徑或 socket:// URL）")
+    protocol: str = Field(..., description="目前使用的序列埠協定（ascii 或 binary）")
+    first_light_id: NonNegativeInt = Field(..., description="這塊板子第一顆燈的全域編號")
+    led_count: NonNegativeInt = Field(..., description="這塊板子上的燈數")
+    ack: Dict[str, Any] = Field(default_factory=dict, description="確認模式的統計：是否啟用、視窗大小、未確認數、重送與逾時次數、RTT 百分位數（毫秒）")
+    scheduler: Dict[str, Any] = Field(default_factory=dict, description="指令排程的統計：各優先順序的佇列深度、送出 / 逾期 / 取消數與等待時間百分位數（毫秒），以及各 session 排隊中的指令數")
+
+class ListDevicesOutput(BaseModel):
+    devices: List[DeviceInfo] = Field(default_factory=list)
+
+class SceneInfo(BaseModel):
+    name: str = Field(..., description="場景名稱")
+    lights: List[LightInfo] = Field(default_factory=list, description="場景中每顆燈的亮度")
+    created_at: str = Field(..., description="場景儲存的時間（ISO 8601）")
+
+class ListScenesOutput(BaseModel):
+    scenes: List[SceneInfo] = Field(default_factory=list)
+
+class GroupInfo(BaseModel):
+    name: str = Field(..., description="群組名稱")
+    light_ids: List[NonNegativeInt] = Field(default_factory=list, description="群組中燈的編號")
+    builtin: bool = Field(False, description="是否為內建的廣播群組（all）")
+    created_at: Optional[str] = Field(None, description="群組建立的時間（ISO 8601），內建群組沒有")
+
+class ListGroupsOutput(BaseModel):
+    groups: List[GroupInfo] = Field(default_factory=list)
+
+class PatternStepInput(BaseModel):
+    duration_ms: NonNegativeInt = Field(..., description="步驟長度（毫秒，0-65535）")
+    lights: List[LightUpdate] = Field(default_factory=list, description="步驟結束時各燈的亮度百分比(0-100)，沒有列出的燈維持原值")
+    ramp: bool = Field(True, description="True 時在步驟期間漸變到目標亮度，False 時步驟一開始就切換")
+
+class PatternDeviceStatus(BaseModel):
+    name: str = Field(..., description="裝置名稱")
+    running: bool = Field(..., description="是否正在播放")
+    step: NonNegativeInt = Field(..., description="目前的步驟")
+    step_count: NonNegativeInt = Field(..., description="步驟數")
+    loop: NonNegativeInt = Field(..., description="已播放完的圈數")
+    light_ids: List[NonNegativeInt] = Field(default_factory=list, description="目前由 pattern 控制的燈（全域編號）")
+
+class PatternStatusOutput(BaseModel):
+    name: str = Field(..., description="pattern 名稱（preset 名稱或 custom）")
+    loops: NonNegativeInt = Field(..., description="播放圈數，0 表示無限循環")
+    period_ms: NonNegativeInt = Field(..., description="一圈的毫秒數")
+    light_ids: List[NonNegativeInt] = Field(default_factory=list, description="pattern 使用的燈")
+    devices: List[PatternDeviceStatus] = Field(default_factory=list)
+
+class LightHistory(BaseModel):
+    light_id: NonNegativeInt = Field(..., description="燈的編號")
+    on_seconds: float = Field(..., description="整個查詢範圍內燈亮著（亮度大於 0）的秒數")
+    mean_brightness: Optional[float] = Field(None, description="整個查詢範圍內以時間加權的平均亮度百分比(0-100)，沒有任何紀錄時為 null")
+    known_seconds: float = Field(..., description="查詢範圍內有紀錄的秒數，第一次紀錄之前與未來的時間不算")
+    bucket_on_seconds: List[float] = Field(default_factory=list, description="每個區間中燈亮著的秒數")
+    bucket_mean_brightness: List[Optional[float]] = Field(default_factory=list, description="每個區間以時間加權的平均亮度百分比(0-100)，區間內沒有紀錄時為 null")
+
+class LightHistoryOutput(BaseModel):
+    start: str = Field(..., description="查詢範圍的開始時間（ISO 8601）")
+    end: str = Field(..., description="查詢範圍的結束時間（ISO 8601）")
+    bucket_seconds: float = Field(..., description="每個區間的秒數，第 i 個區間從 start + i * bucket_seconds 開始，最後一個區間在 end 結束")
+    covered_from: Optional[str] = Field(None, description="歷史紀錄最早的時間（ISO 8601），更早的狀態已被覆寫或尚未記錄")
+    lights: List[LightHistory] = Field(default_factory=list)
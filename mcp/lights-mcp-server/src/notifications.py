@@ -0,0 +1,64 @@
+import asyncio, logging, weakref
+from typing import Dict, Iterable, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+STATE_URI = "lights://state"
+
+
+def light_uri(light_id: int) -> str:
+    return f"lights://{light_id}"
+
+
+class ResourceNotifier:
+    """
+    MCP resource 訂閱管理：記錄每個 URI 由哪些 session 訂閱，燈光狀態改變時送出 `notifications/resources/updated`。
+
+    同一個時間窗內的多次變化（例如閃爍、批次寫入）會合併成每個 URI 一則通知，
+    session 以 weak reference 保存，連線結束後自動移除。
+
+    Args:
+        window (float, optional): 合併通知的時間窗秒數，預設為 0.05。
+    """
+
+    def __init__(self, window: float = 0.05):
+        self.window = window
+        self.sent = 0
+        self._subscriptions: Dict[str, "weakref.WeakSet"] = {}
+        self._dirty: Set[int] = set()
+        self._flush_task: Optional[asyncio.Task] = None
+
+    def subscribe(self, uri: str, session):
+        self._subscriptions.setdefault(uri, weakref.WeakSet()).add(session)
+        logger.info(f"Resource {uri} subscribed ({len(self._subscriptions[uri])} subscribers)")
+
+    def unsubscribe(self, uri: str, session):
+        sessions = self._subscriptions.get(uri)
+        if sessions is not None:
+            sessions.discard(session)
+
+    @property
+    def subscriber_count(self) -> int:
+        return sum(len(sessions) for sessions in self._subscriptions.values())
+
+    def lights_changed(self, light_ids: Iterable[int]):
+        """`ShadowState` 的 listener：記下改變的燈，時間窗結束後送出通知；沒有任何訂閱時直接略過。"""
+        if not self.subscriber_count:
+            return
+        self._dirty.update(light_ids)
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.get_running_loop().create_task(self._flush_after_window(), name="resource-notify")
+
+    async def _flush_after_window(self):
+        await asyncio.sleep(self.window)
+        dirty, self._dirty = self._dirty, set()
+        uris = [STATE_URI] + [light_uri(light_id) for light_id in sorted(dirty)]
+        for uri in uris:
+            for session in list(self._subscriptions.get(uri, ())):
+                try:
+                    await session.send_resource_updated(uri)
+                    self.sent += 1
+                except Exception as e:
+                    # 連線已中斷的 session 不再通知
+                    logger.info(f"Drop subscriber of {uri}: {e}")
+                    self.unsubscribe(uri, session)
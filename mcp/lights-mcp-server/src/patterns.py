@@ -0,0 +1,183 @@
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from .protocol import MAX_FADE_MS, Opcode, encode_frame
+
+# 韌體保存 pattern 的容量：最多 16 個步驟，每個步驟以 16 位元遮罩表示涉及的燈
+MAX_PATTERN_STEPS = 16
+MAX_PATTERN_LIGHTS = 16
+MAX_PATTERN_LOOPS = 0xFFFF
+# 步驟旗標：bit 0 為 1 時燈在步驟期間線性漸變到目標值，否則步驟一開始就跳到目標值並維持到步驟結束
+STEP_RAMP = 0x01
+PRESETS = ("chase", "pulse", "breathe")
+
+
+@dataclass
+class PatternStep:
+    # 步驟長度（毫秒），也是漸變的時間
+    duration_ms: int
+    # 燈號對應步驟結束時的 PWM 值（0-255），沒有列出的燈維持原值
+    values: Dict[int, int] = field(default_factory=dict)
+    ramp: bool = True
+
+
+@dataclass
+class PatternProgram:
+    """
+    上傳到 Arduino 播放的 pattern 程式：依序播放每個步驟（關鍵影格），播完後從頭開始，共播放 `loops` 圈。
+
+    Args:
+        steps (List[PatternStep]): 步驟列表，最多 `MAX_PATTERN_STEPS` 個。
+        loops (int, optional): 播放圈數，`0` 表示無限循環，預設為 0。
+        name (str, optional): 程式名稱（例如 preset 名稱），只用於顯示，預設為 `"custom"`。
+    """
+
+    steps: List[PatternStep]
+    loops: int = 0
+    name: str = "custom"
+
+    @property
+    def light_ids(self) -> List[int]:
+        return sorted({light_id for step in self.steps for light_id in step.values})
+
+    @property
+    def period_ms(self) -> int:
+        return sum(step.duration_ms for step in self.steps)
+
+
+def validate_program(program: PatternProgram, led_count: int):
+    """
+    檢查程式能否被韌體播放。
+
+    Args:
+        program (PatternProgram): 要檢查的程式，燈號為全域 ID。
+        led_count (int): 目前的總燈數。
+
+    Raises:
+        ValueError: 程式不合法，訊息可以直接回傳給 MCP client。
+    """
+    if not 1 <= len(program.steps) <= MAX_PATTERN_STEPS:
+        raise ValueError(f"A pattern must have between [1-{MAX_PATTERN_STEPS}] steps, got {len(program.steps)}")
+    if not 0 <= program.loops <= MAX_PATTERN_LOOPS:
+        raise ValueError(f"The loops must be a integer between [0-{MAX_PATTERN_LOOPS}], got {program.loops}")
+    for index, step in enumerate(program.steps):
+        if not 0 <= step.duration_ms <= MAX_FADE_MS:
+            raise ValueError(f"The duration_ms of step {index} must be a integer between [0-{MAX_FADE_MS}], got {step.duration_ms}")
+        for light_id, value in step.values.items():
+            if not 0 <= light_id < led_count:
+                raise ValueError(f"The light_id of step {index} must be a integer between [0-{led_count - 1}], got {light_id}")
+            if not 0 <= value <= 255:
+                raise ValueError(f"The PWM value of light-{light_id} in step {index} must be between [0-255], got {value}")
+    if not program.light_ids:
+        raise ValueError("A pattern must set at least one light")
+    if program.period_ms <= 0:
+        raise ValueError("The total duration of a pattern must be longer than 0 ms")
+
+
+def localize(program: PatternProgram, offset: int, led_count: int) -> Optional[PatternProgram]:
+    """
+    取出一塊板子負責的部分並轉成板子上的燈號；步驟與時間不變，各板子因此能同步播放。
+
+    Args:
+        program (PatternProgram): 以全域 ID 表示的程式。
+        offset (int): 板子第一顆燈的全域 ID。
+        led_count (int): 板子上的燈數。
+
+    Returns:
+        Optional[PatternProgram]: 板子上的程式，程式沒有用到這塊板子的燈時為 None。
+
+    Raises:
+        ValueError: 板子上參與的燈號超出韌體遮罩能表示的範圍。
+    """
+    steps = [
+        PatternStep(
+            step.duration_ms,
+            {light_id - offset: value for light_id, value in step.values.items() if offset <= light_id < offset + led_count},
+            step.ramp,
+        )
+        for step in program.steps
+    ]
+    local = PatternProgram(steps, program.loops, program.name)
+    if not local.light_ids:
+        return None
+    if local.light_ids[-1] >= MAX_PATTERN_LIGHTS:
+        raise ValueError(f"Patterns can only drive the first {MAX_PATTERN_LIGHTS} lights of each board, got light-{local.light_ids[-1] + offset}")
+    return local
+
+
+def compile_program(program: PatternProgram) -> bytes:
+    """
+    把（單一板子的）程式打包成上傳用的 frame：一個 PATTERN_BEGIN 加上每個步驟一個 PATTERN_STEP。
+
+    PATTERN_BEGIN 的 payload 為 `步驟數, 圈數 (uint16)`，PATTERN_STEP 為
+    `步驟編號, 旗標, 長度 (uint16), 燈的遮罩 (uint16), 遮罩中每顆燈的 PWM 值`，多位元組欄位皆為 little-endian。
+
+    Returns:
+        bytes: 依序送出的 frame。
+    """
+    frames = [encode_frame(Opcode.PATTERN_BEGIN, bytes([len(program.steps)]) + program.loops.to_bytes(2, "little"))]
+    for index, step in enumerate(program.steps):
+        light_ids = sorted(step.values)
+        mask = sum(1 << light_id for light_id in light_ids)
+        payload = (
+            bytes([index, STEP_RAMP if step.ramp else 0])
+            + step.duration_ms.to_bytes(2, "little")
+            + mask.to_bytes(2, "little")
+            + bytes(step.values[light_id] for light_id in light_ids)
+        )
+        frames.append(encode_frame(Opcode.PATTERN_STEP, payload))
+    return b"".join(frames)
+
+
+# ---------- 內建 pattern ----------
+
+def chase(light_ids: List[int], value_255: int, period_ms: int, loops: int = 0) -> PatternProgram:
+    """跑馬燈：每個步驟只點亮一顆燈，依序輪流。"""
+    step_ms = max(1, period_ms // len(light_ids))
+    steps = [
+        PatternStep(step_ms, {light_id: value_255 if light_id == lit else 0 for light_id in light_ids}, ramp=False)
+        for lit in light_ids
+    ]
+    return PatternProgram(steps, loops, "chase")
+
+
+def pulse(light_ids: List[int], value_255: int, period_ms: int, loops: int = 0) -> PatternProgram:
+    """脈衝：快速亮起（週期的 1/5）後緩慢熄滅。"""
+    rise_ms = max(1, period_ms // 5)
+    steps = [
+        PatternStep(rise_ms, {light_id: value_255 for light_id in light_ids}),
+        PatternStep(max(1, period_ms - rise_ms), {light_id: 0 for light_id in light_ids}),
+    ]
+    return PatternProgram(steps, loops, "pulse")
+
+
+def breathe(light_ids: List[int], value_255: int, period_ms: int, loops: int = 0) -> PatternProgram:
+    """呼吸燈：以相同的時間漸亮再漸暗。"""
+    half_ms = max(1, period_ms // 2)
+    steps = [
+        PatternStep(half_ms, {light_id: value_255 for light_id in light_ids}),
+        PatternStep(half_ms, {light_id: 0 for light_id in light_ids}),
+    ]
+    return PatternProgram(steps, loops, "breathe")
+
+
+def build_preset(name: str, light_ids: List[int], value_255: int, period_ms: int, loops: int = 0) -> PatternProgram:
+    """
+    依名稱建立內建 pattern。
+
+    Args:
+        name (str): `chase`、`pulse` 或 `breathe`。
+        light_ids (List[int]): 參與的燈（全域 ID），跑馬燈依這個順序輪流。
+        value_255 (int): 亮起時的 PWM 值（0-255）。
+        period_ms (int): 一圈的毫秒數。
+        loops (int, optional): 播放圈數，`0` 表示無限循環，預設為 0。
+
+    Raises:
+        ValueError: 未知的 preset 名稱或沒有指定任何燈。
+    """
+    builders = {"chase": chase, "pulse": pulse, "breathe": breathe}
+    if name not in builders:
+        raise ValueError(f"Unknown pattern preset '{name}', expected one of {', '.join(PRESETS)}")
+    if not light_ids:
+        raise ValueError("A pattern preset needs at least one light")
+    return builders[name](list(dict.fromkeys(light_ids)), value_255, period_ms, loops)
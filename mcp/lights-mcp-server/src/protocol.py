@@ -0,0 +1,395 @@
+import logging
+from dataclasses import dataclass, field
+from enum import IntEnum
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# ==================== 二進位 frame 格式 ====================
+# | START (0xA5) | OPCODE | LEN | PAYLOAD (LEN bytes) | CRC8 |
+# CRC8 (poly 0x07, init 0x00) 的計算範圍為 OPCODE、LEN 與 PAYLOAD。
+# START 選用 0xA5 是因為它不會出現在 ASCII 文字中，讀取端可以在同一條資料流中區分 frame 與文字行。
+
+FRAME_START = 0xA5
+# 韌體以 `V,<version>` 回報支援的版本：1 起支援二進位 frame，2 起支援漸變（fade）指令，
+# 3 起可以主動回報 Arduino 自行造成的亮度變化（例如漸變結束），4 起可以用位元遮罩一次把同一個值套用到多顆燈，
+# 5 起支援帶序號的 frame：Arduino 依序處理並逐一確認（ACK），Host 可以維持多個未確認的指令並在逾時時重送，
+# 6 起可以上傳 pattern 程式（關鍵影格），由 Arduino 依 millis() 自行播放，
+# 7 起以 16 位元燈號寫入連續區段（RUNS）或以點陣圖標示的零散燈（SPARSE），並可以分段讀取亮度，支援數百顆燈的燈條，
+# 8 起支援寫入後立即回覆結果（SET_CONFIRM），一次往返就能寫入並確認 Arduino 上實際的亮度
+PROTOCOL_VERSION = 8
+BINARY_MIN_VERSION = 1
+FADE_MIN_VERSION = 2
+REPORT_MIN_VERSION = 3
+MASK_MIN_VERSION = 4
+ACK_MIN_VERSION = 5
+PATTERN_MIN_VERSION = 6
+FRAME_MIN_VERSION = 7
+CONFIRM_MIN_VERSION = 8
+# 漸變時間在二進位 frame 中以 uint16（little-endian）表示
+MAX_FADE_MS = 0xFFFF
+MAX_PAYLOAD = 32
+# 序號 frame 的 payload 開頭多了序號與原本的 opcode，所有指令的 payload 都預留這 2 bytes，才能被包成序號 frame
+SEQ_OVERHEAD = 2
+# 韌體 ASCII 指令緩衝區為 96 bytes，每組 `id,val;` 最多 8 字元，批次指令超過時拆成多行
+ASCII_BATCH_PAIRS = 10
+BINARY_BATCH_PAIRS = (MAX_PAYLOAD - SEQ_OVERHEAD) // 2
+# 遮罩指令可以涵蓋的燈數：ASCII 以 32 位元整數解析，二進位 frame 扣掉一個 byte 的值
+ASCII_MASK_LIGHTS = 32
+BINARY_MASK_LIGHTS = (MAX_PAYLOAD - SEQ_OVERHEAD - 1) * 8
+# 可以被包成序號 frame 的寫入指令 payload 上限
+WRITE_PAYLOAD = MAX_PAYLOAD - SEQ_OVERHEAD
+# SET / BATCH / FADE 以 1 byte 表示燈號，更大的燈號只能用 RUNS / SPARSE 寫入
+MAX_BYTE_LIGHT_ID = 0xFF
+# 分段讀取亮度時一次最多讀取的燈數（回應的 payload 開頭為 2 bytes 的起始燈號）
+STATUS_RANGE_LIGHTS = MAX_PAYLOAD - 2
+# 寫入並確認的指令每顆燈 3 bytes（燈號 uint16, 值），回應的格式相同
+CONFIRM_LIGHTS = WRITE_PAYLOAD // 3
+# Arduino (AVR) 的序列埠接收緩衝區大小，確認模式下未確認的 frame 總長度不超過它，避免溢位
+RX_BUFFER_SIZE = 64
+
+
+class Opcode(IntEnum):
+    # Host -> Arduino
+    SET = 0x01
+    BATCH = 0x02
+    STATUS = 0x03
+    INFO = 0x04
+    FADE = 0x05
+    REPORT = 0x06
+    MASK = 0x07
+    SEQ = 0x08
+    SYNC = 0x09
+    PATTERN_BEGIN = 0x0A
+    PATTERN_STEP = 0x0B
+    PATTERN_RUN = 0x0C
+    PATTERN_QUERY = 0x0D
+    RUNS = 0x0E
+    SPARSE = 0x0F
+    STATUS_RANGE = 0x10
+    SET_CONFIRM = 0x11
+    # Arduino -> Host
+    STATUS_REPLY = 0x81
+    INFO_REPLY = 0x82
+    CHANGE = 0x83
+    ACK = 0x84
+    SYNC_REPLY = 0x85
+    PATTERN_REPLY = 0x86
+    STATUS_RANGE_REPLY = 0x87
+    CONFIRM_REPLY = 0x88
+    ERROR = 0xE0
+
+
+class ErrorCode(IntEnum):
+    CRC = 0x01
+    OPCODE = 0x02
+    LENGTH = 0x03
+    RANGE = 0x04
+
+
+# 回應種類，ASCII 與二進位回應都會轉成同一種表示法，查詢端依種類等待
+REPLY_STATUS = "S"
+REPLY_INFO = "I"
+REPLY_VERSION = "V"
+# Arduino 主動送出的亮度變化（`C,id,val`），不對應任何查詢
+REPLY_CHANGE = "C"
+# 序號 frame 的確認（序號, 結果），以及序號同步的回應（下一個序號）
+REPLY_ACK = "A"
+REPLY_SYNC = "Y"
+# pattern 播放狀態（是否播放中, 步驟數, 目前步驟, 目前圈數, 總圈數, 由 pattern 控制的燈的遮罩）
+REPLY_PATTERN = "P"
+# 分段亮度（起始燈號, 各燈 PWM 值...）
+REPLY_RANGE = "R"
+# 寫入後 Arduino 上實際的亮度（燈號, PWM 值, 燈號, PWM 值...）
+REPLY_CONFIRM = "W"
+REPLY_ERROR = "E"
+REPLY_TEXT = "text"
+
+# 查詢指令的 opcode 對應到它預期的回應種類，用於把錯誤回應交給正確的查詢
+QUERY_REPLY_KIND: Dict[int, str] = {
+    Opcode.STATUS: REPLY_STATUS,
+    Opcode.INFO: REPLY_INFO,
+    Opcode.SYNC: REPLY_SYNC,
+    Opcode.PATTERN_QUERY: REPLY_PATTERN,
+    Opcode.STATUS_RANGE: REPLY_RANGE,
+    Opcode.SET_CONFIRM: REPLY_CONFIRM,
+}
+
+
+class UnsupportedCommand(Exception):
+    """連接的韌體版本不支援這個指令（例如舊韌體沒有漸變指令），呼叫端可以改用 host 端的替代做法。"""
+
+
+class DeviceError(Exception):
+    """Arduino 明確回報的錯誤（例如 CRC 錯誤或 ID 超出範圍）。"""
+
+    def __init__(self, code: int, opcode: int):
+        self.code = code
+        self.opcode = opcode
+        try:
+            code_name = ErrorCode(code).name
+        except ValueError:
+            code_name = f"0x{code:02X}"
+        super().__init__(f"Arduino rejected opcode 0x{opcode:02X}: {code_name}")
+
+
+@dataclass
+class Reply:
+    kind: str
+    values: List[int] = field(default_factory=list)
+    raw: str = ""
+
+
+def crc8(data: bytes) -> int:
+    """CRC-8 (poly 0x07, init 0x00)，與韌體中的 `crc8()` 相同。"""
+    crc = 0
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x07) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+    return crc
+
+
+def encode_frame(opcode: int, payload: bytes = b"") -> bytes:
+    if len(payload) > MAX_PAYLOAD:
+        raise ValueError(f"Frame payload is limited to {MAX_PAYLOAD} bytes, got {len(payload)}")
+    body = bytes([opcode, len(payload)]) + payload
+    return bytes([FRAME_START]) + body + bytes([crc8(body)])
+
+
+def split_frames(data: bytes) -> List[Tuple[int, bytes]]:
+    """把 codec 產生的（可能多個）frame 拆回 (opcode, payload)，用於包成序號 frame。"""
+    frames = []
+    offset = 0
+    while offset < len(data):
+        if data[offset] != FRAME_START or offset + 3 > len(data):
+            raise ValueError(f"Not a binary frame: {data[offset:].hex()}")
+        length = data[offset + 2]
+        frames.append((data[offset + 1], bytes(data[offset + 3:offset + 3 + length])))
+        offset += 3 + length + 1
+    return frames
+
+
+def encode_seq_frame(seq: int, opcode: int, payload: bytes) -> bytes:
+    """帶序號的 frame：`SEQ | LEN | seq, opcode, payload | CRC8`，Arduino 處理後回覆 `ACK | seq, 結果`。"""
+    return encode_frame(Opcode.SEQ, bytes([seq, opcode]) + payload)
+
+
+def light_mask(light_ids) -> int:
+    """把燈號轉成位元遮罩，bit i 代表第 i 顆燈。"""
+    mask = 0
+    for light_id in light_ids:
+        mask |= 1 << light_id
+    return mask
+
+
+def encode_runs(runs: List[Tuple[int, bytes]]) -> bytes:
+    """
+    把連續區段打包成 RUNS frame，每個區段為 `起始燈號 (uint16), 燈數, 各燈 PWM 值`，一個 frame 盡量塞滿多個區段。
+
+    Args:
+        runs (List[Tuple[int, bytes]]): (起始燈號, 各燈 PWM 值)，超過一個 frame 的區段會被切開。
+
+    Returns:
+        bytes: 依序送出的 frame。
+    """
+    frames = []
+    payload = bytearray()
+    for start, values in runs:
+        offset = 0
+        while offset < len(values):
+            room = WRITE_PAYLOAD - len(payload) - 3
+            # 剩下的空間太小時換下一個 frame，避免把區段切成許多只有幾顆燈、各帶 3 bytes 表頭的小段
+            if room < min(len(values) - offset, 4):
+                frames.append(encode_frame(Opcode.RUNS, bytes(payload)))
+                payload.clear()
+                continue
+            chunk = values[offset:offset + room]
+            payload += (start + offset).to_bytes(2, "little") + bytes([len(chunk)]) + chunk
+            offset += len(chunk)
+    if payload:
+        frames.append(encode_frame(Opcode.RUNS, bytes(payload)))
+    return b"".join(frames)
+
+
+def parse_line(line: str) -> Reply:
+    """將 Arduino 回傳的 ASCII 文字行（例如 `S,0,128,255`）轉為 `Reply`。"""
+    kind, _, rest = line.partition(",")
+    if kind in (REPLY_STATUS, REPLY_INFO, REPLY_VERSION, REPLY_CHANGE) and rest:
+        try:
+            return Reply(kind, [int(p) for p in rest.split(",")], line)
+        except ValueError:
+            pass
+    return Reply(REPLY_TEXT, raw=line)
+
+
+def parse_frame(opcode: int, payload: bytes) -> Reply:
+    raw = f"<frame 0x{opcode:02X} {payload.hex()}>"
+    if opcode == Opcode.STATUS_REPLY:
+        return Reply(REPLY_STATUS, list(payload), raw)
+    if opcode == Opcode.INFO_REPLY and len(payload) in (1, 2):
+        # 超過 255 顆燈的韌體以 uint16 回報燈數
+        return Reply(REPLY_INFO, [int.from_bytes(payload, "little")], raw)
+    if opcode == Opcode.CHANGE and len(payload) == 2:
+        return Reply(REPLY_CHANGE, [payload[0], payload[1]], raw)
+    if opcode == Opcode.ACK and len(payload) == 2:
+        return Reply(REPLY_ACK, [payload[0], payload[1]], raw)
+    if opcode == Opcode.SYNC_REPLY and len(payload) == 1:
+        return Reply(REPLY_SYNC, [payload[0]], raw)
+    if opcode == Opcode.PATTERN_REPLY and len(payload) == 9:
+        values = [payload[0], payload[1], payload[2]] + [int.from_bytes(payload[i:i + 2], "little") for i in (3, 5, 7)]
+        return Reply(REPLY_PATTERN, values, raw)
+    if opcode == Opcode.STATUS_RANGE_REPLY and len(payload) >= 2:
+        return Reply(REPLY_RANGE, [int.from_bytes(payload[:2], "little")] + list(payload[2:]), raw)
+    if opcode == Opcode.CONFIRM_REPLY and len(payload) % 3 == 0:
+        values = []
+        for offset in range(0, len(payload), 3):
+            values += [int.from_bytes(payload[offset:offset + 2], "little"), payload[offset + 2]]
+        return Reply(REPLY_CONFIRM, values, raw)
+    if opcode == Opcode.ERROR and len(payload) == 2:
+        return Reply(REPLY_ERROR, [payload[0], payload[1]], raw)
+    return Reply(REPLY_TEXT, raw=raw)
+
+
+class StreamDecoder:
+    """
+    把序列埠讀到的位元組流切成 `Reply`。
+
+    同一條資料流可以同時包含 ASCII 文字行（例如開機訊息 `Arduino Ready.`）與二進位 frame；
+    CRC 錯誤或長度不合理的 frame 會被計數並丟棄，並從下一個位元組重新同步。
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self.crc_errors = 0
+
+    def feed(self, data: bytes) -> List[Reply]:
+        self._buffer.extend(data)
+        replies: List[Reply] = []
+        buffer = self._buffer
+        while buffer:
+            if buffer[0] == FRAME_START:
+                if len(buffer) < 3:
+                    break
+                length = buffer[2]
+                if length > MAX_PAYLOAD:
+                    del buffer[0]
+                    continue
+                end = 3 + length + 1
+                if len(buffer) < end:
+                    break
+                if crc8(bytes(buffer[1:end - 1])) != buffer[end - 1]:
+                    self.crc_errors += 1
+                    logger.warning(f"Dropped frame with bad CRC: {bytes(buffer[:end]).hex()}")
+                    del buffer[0]
+                    continue
+                replies.append(parse_frame(buffer[1], bytes(buffer[3:end - 1])))
+                del buffer[:end]
+            else:
+                newline = buffer.find(b"\n")
+                start = buffer.find(bytes([FRAME_START]))
+                if start != -1 and (newline == -1 or start < newline):
+                    # frame 之前殘留的不完整文字
+                    text = bytes(buffer[:start]).decode("utf-8", errors="replace").strip()
+                    if text:
+                        replies.append(Reply(REPLY_TEXT, raw=text))
+                    del buffer[:start]
+                    continue
+                if newline == -1:
+                    break
+                line = bytes(buffer[:newline]).decode("utf-8", errors="replace").strip()
+                del buffer[:newline + 1]
+                if line:
+                    replies.append(parse_line(line))
+        return replies
+
+
+class AsciiCodec:
+    """原本的文字協定：`<id,val>`、`<id,val;id,val>`、`<id,val,ms>`（漸變）、`m<遮罩>,val`（群組）、`r1`/`r0`（主動回報）、`s`、`i`。"""
+
+    name = "ascii"
+
+    def set_brightness(self, light_id: int, value_255: int) -> bytes:
+        return f"<{light_id},{value_255}>\n".encode("utf-8")
+
+    def set_brightness_batch(self, values: Dict[int, int]) -> bytes:
+        pairs = [f"{light_id},{value_255}" for light_id, value_255 in values.items()]
+        return b"".join(
+            f"<{';'.join(pairs[i:i + ASCII_BATCH_PAIRS])}>\n".encode("utf-8")
+            for i in range(0, len(pairs), ASCII_BATCH_PAIRS)
+        )
+
+    def fade(self, light_id: int, value_255: int, duration_ms: int) -> bytes:
+        return f"<{light_id},{value_255},{duration_ms}>\n".encode("utf-8")
+
+    def set_brightness_mask(self, light_ids: List[int], value_255: int) -> bytes:
+        if max(light_ids) >= ASCII_MASK_LIGHTS:
+            return self.set_brightness_batch({light_id: value_255 for light_id in light_ids})
+        return f"m{light_mask(light_ids):x},{value_255}\n".encode("utf-8")
+
+    def report(self, enable: bool) -> bytes:
+        return b"r1\n" if enable else b"r0\n"
+
+    def status(self) -> bytes:
+        return b"s\n"
+
+    def info(self) -> bytes:
+        return b"i\n"
+
+
+class BinaryCodec:
+    """二進位 frame 協定，每個指令皆帶 CRC8，錯誤會由 Arduino 明確回報。"""
+
+    name = "binary"
+
+    def set_brightness(self, light_id: int, value_255: int) -> bytes:
+        if light_id > MAX_BYTE_LIGHT_ID:
+            return encode_runs([(light_id, bytes([value_255]))])
+        return encode_frame(Opcode.SET, bytes([light_id, value_255]))
+
+    def set_brightness_batch(self, values: Dict[int, int]) -> bytes:
+        if max(values) > MAX_BYTE_LIGHT_ID:
+            return encode_runs([(light_id, bytes([value_255])) for light_id, value_255 in sorted(values.items())])
+        pairs = [bytes([light_id, value_255]) for light_id, value_255 in values.items()]
+        return b"".join(
+            encode_frame(Opcode.BATCH, b"".join(pairs[i:i + BINARY_BATCH_PAIRS]))
+            for i in range(0, len(pairs), BINARY_BATCH_PAIRS)
+        )
+
+    def fade(self, light_id: int, value_255: int, duration_ms: int) -> bytes:
+        return encode_frame(Opcode.FADE, bytes([light_id, value_255]) + duration_ms.to_bytes(2, "little"))
+
+    def set_brightness_mask(self, light_ids: List[int], value_255: int) -> bytes:
+        if max(light_ids) >= BINARY_MASK_LIGHTS:
+            return self.set_brightness_batch({light_id: value_255 for light_id in light_ids})
+        mask = light_mask(light_ids)
+        return encode_frame(Opcode.MASK, bytes([value_255]) + mask.to_bytes((mask.bit_length() + 7) // 8, "little"))
+
+    def report(self, enable: bool) -> bytes:
+        return encode_frame(Opcode.REPORT, bytes([int(enable)]))
+
+    def sync(self, seq: int) -> bytes:
+        return encode_frame(Opcode.SYNC, bytes([seq]))
+
+    def pattern_run(self, start: bool) -> bytes:
+        return encode_frame(Opcode.PATTERN_RUN, bytes([int(start)]))
+
+    def pattern_query(self) -> bytes:
+        return encode_frame(Opcode.PATTERN_QUERY)
+
+    def set_brightness_confirm(self, values: Dict[int, int]) -> bytes:
+        """寫入並確認，一個 frame 最多 `CONFIRM_LIGHTS` 顆燈；Arduino 套用後以 CONFIRM_REPLY 回覆實際的亮度。"""
+        return encode_frame(Opcode.SET_CONFIRM, b"".join(light_id.to_bytes(2, "little") + bytes([value_255]) for light_id, value_255 in values.items()))
+
+    def status(self) -> bytes:
+        return encode_frame(Opcode.STATUS)
+
+    def status_range(self, start: int, count: int) -> bytes:
+        return encode_frame(Opcode.STATUS_RANGE, start.to_bytes(2, "little") + bytes([count]))
+
+    def info(self) -> bytes:
+        return encode_frame(Opcode.INFO)
+
+
+# 協商時使用的 ASCII 指令；不支援的舊韌體會直接忽略，因此逾時即退回 ASCII
+VERSION_QUERY = b"v\n"
@@ -0,0 +1,65 @@
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List
+
+from .store import JsonStore
+
+SCENES_FILE_VERSION = 1
+MAX_SCENE_NAME = 64
+
+
+@dataclass
+class Scene:
+    name: str
+    # 燈的全域 ID 對應 PWM 值（0-255）
+    lights: Dict[int, int] = field(default_factory=dict)
+    created_at: float = field(default_factory=time.time)
+
+
+class SceneStore(JsonStore[Scene]):
+    """
+    具名場景的儲存區，保存在本機的 JSON 檔中（格式與寫入方式見 `JsonStore`），啟動時載入。
+
+    Args:
+        path (str): 場景檔路徑，檔案不存在時視為沒有任何場景。
+    """
+
+    def __init__(self, path: str):
+        super().__init__(path, "scenes", SCENES_FILE_VERSION)
+
+    def _decode(self, name: str, data: dict) -> Scene:
+        return Scene(
+            name=name,
+            lights={int(light_id): int(value) for light_id, value in data["lights"].items()},
+            created_at=data.get("created_at", time.time()),
+        )
+
+    def _encode(self, scene: Scene) -> dict:
+        return {
+            "lights": {str(light_id): value for light_id, value in sorted(scene.lights.items())},
+            "created_at": scene.created_at,
+        }
+
+    def save(self, name: str, lights: Dict[int, int]) -> Scene:
+        """新增或覆寫場景並寫入檔案。"""
+        return self._put(name, Scene(name=name, lights=dict(lights)))
+
+
+def diff_scene(scene: Scene, current: List[int], overridden: Iterable[int] = ()) -> Dict[int, int]:
+    """
+    找出套用場景時實際需要寫入的燈：只保留與目前亮度不同、且燈號仍存在的燈。
+
+    Args:
+        scene (Scene): 要套用的場景。
+        current (List[int]): 目前每顆燈的 PWM 值（0-255）。
+        overridden (Iterable[int], optional): 由 Arduino 自行改變亮度的燈（見 `ShadowState.overridden`），
+            `current` 中的值不可信，即使相同也要寫入。
+
+    Returns:
+        Dict[int, int]: 需要寫入的燈與 PWM 值。
+    """
+    return {
+        light_id: value
+        for light_id, value in sorted(scene.lights.items())
+        if light_id < len(current) and (current[light_id] != value or light_id in overridden)
+    }
@@ -0,0 +1,233 @@
+import asyncio, contextvars, logging, time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, asdict, field
+from typing import Deque, Dict, FrozenSet, List, Optional
+
+from .metrics import percentile_ms
+
+logger = logging.getLogger(__name__)
+
+# 優先順序，數字越小越先送出：工具呼叫的寫入與查詢 > 背景效果 > 背景 reconcile 等內部讀取
+PRIORITY_INTERACTIVE = 0
+PRIORITY_EFFECT = 1
+PRIORITY_BACKGROUND = 2
+PRIORITY_NAMES = ("interactive", "effect", "background")
+
+
+@dataclass(frozen=True)
+class CallContext:
+    # 指令的優先順序
+    priority: int = PRIORITY_BACKGROUND
+    # 發出指令的 MCP session，同一個優先順序內各 session 輪流送出；空字串為伺服器內部
+    session: str = ""
+    # 指令最晚要開始送出的時間（time.monotonic()），None 表示沒有期限
+    deadline: Optional[float] = None
+
+
+# 目前這個呼叫（工具呼叫、效果或背景 task）的排程資訊，由 server 在呼叫工具前設定；沒有設定時視為背景指令
+current_call: contextvars.ContextVar = contextvars.ContextVar("lights_current_call", default=CallContext())
+
+
+def merge_calls(calls: List[CallContext]) -> CallContext:
+    """
+    合併多個呼叫端的排程資訊（例如寫入合併層把多個呼叫合成一個 frame）：取最高的優先順序與最晚的期限，
+    任何一個呼叫端還在等待時，合併後的指令都不會因期限而被丟棄。
+    """
+    if not calls:
+        return current_call.get()
+    first = min(calls, key=lambda call: call.priority)
+    deadline = None if any(call.deadline is None for call in calls) else max(call.deadline for call in calls)
+    return CallContext(first.priority, first.session, deadline)
+
+
+class DeadlineExceeded(TimeoutError):
+    """指令在期限內沒有輪到送出，已從佇列移除，不會再送到 Arduino。"""
+
+
+class _AllLights:
+    """涉及所有燈的指令（例如 pattern 指令），與任何寫入都有先後關係。"""
+
+    def __repr__(self) -> str:
+        return "ALL_LIGHTS"
+
+
+ALL_LIGHTS = _AllLights()
+
+
+def _conflicts(a, b) -> bool:
+    if a is None or b is None:
+        return False
+    if a is ALL_LIGHTS or b is ALL_LIGHTS:
+        return True
+    return not a.isdisjoint(b)
+
+
+@dataclass(eq=False)
+class _Entry:
+    command: object
+    future: asyncio.Future = field(repr=False)
+    call: CallContext
+    lights: object
+    enqueued_at: float
+    # 排入時已在佇列中、涉及相同燈的指令，必須比這個指令先送出
+    blockers: List["_Entry"] = field(default_factory=list, repr=False)
+    queued: bool = True
+    timer: Optional[asyncio.TimerHandle] = field(default=None, repr=False)
+
+
+@dataclass
+class PriorityStats:
+    # 排入佇列的指令數
+    enqueued: int = 0
+    # 實際送出的指令數
+    dispatched: int = 0
+    # 期限內沒有輪到而被丟棄的指令數（含排入時就已逾期的）
+    expired: int = 0
+    # 呼叫端已放棄（例如效果被取消）而沒有送出的指令數
+    cancelled: int = 0
+
+
+class CommandScheduler:
+    """
+    序列埠指令的排程佇列，取代單純的 FIFO：
+
+    * 優先順序：每次都先送出最高優先順序的指令，背景 reconcile 與效果不會擋住工具呼叫。
+    * 公平性：同一個優先順序內，各 MCP session 輪流送出一個指令（round-robin），一個大量寫入的 session 不會餓死其他 session。
+    * 期限：指令帶有期限時，到期還沒輪到就從佇列移除並讓呼叫端收到 `DeadlineExceeded`，而不是無限排隊。
+    * 順序保證：寫入會標記涉及的燈，較早排入、涉及相同燈的寫入一定先送出（不論優先順序或 session），
+      同一顆燈的寫入因此依排入順序抵達 Arduino；查詢不涉及任何燈，可以自由調整順序。
+
+    只在 event loop 上使用，不需要鎖。
+
+    Args:
+        maxsize (int, optional): 佇列上限，超過時 `put_nowait()` 丟出 `asyncio.QueueFull`，預設為 256。
+        wait_samples (int, optional): 每個優先順序保留最近多少筆等待時間用於計算百分位數，預設為 1024。
+    """
+
+    def __init__(self, maxsize: int = 256, wait_samples: int = 1024):
+        self.maxsize = maxsize
+        # 每個優先順序一個 session -> FIFO 的對應，OrderedDict 的順序即 round-robin 的順序
+        self._queues: List["OrderedDict[str, Deque[_Entry]]"] = [OrderedDict() for _ in PRIORITY_NAMES]
+        self._size = 0
+        self._not_empty = asyncio.Event()
+        self.stats = [PriorityStats() for _ in PRIORITY_NAMES]
+        self._waits: List[Deque[float]] = [deque(maxlen=wait_samples) for _ in PRIORITY_NAMES]
+
+    def qsize(self) -> int:
+        return self._size
+
+    def put_nowait(self, command, future: asyncio.Future, call: CallContext, lights: Optional[FrozenSet[int]] = None):
+        """
+        排入一個指令。
+
+        Args:
+            command: 要送出的指令，`get()` 原樣回傳。
+            future (asyncio.Future): 指令的結果，逾期時設定為 `DeadlineExceeded`；已完成（例如被取消）的指令不會送出。
+            call (CallContext): 排程資訊。
+            lights (Optional[FrozenSet[int]], optional): 寫入涉及的燈（板子上的燈號），`ALL_LIGHTS` 表示所有燈，None 表示查詢。
+
+        Raises:
+            asyncio.QueueFull: 佇列已滿。
+            DeadlineExceeded: 排入時就已經超過期限。
+        """
+        priority = min(max(call.priority, 0), len(PRIORITY_NAMES) - 1)
+        stats = self.stats[priority]
+        if self._size >= self.maxsize:
+            raise asyncio.QueueFull()
+        now = time.monotonic()
+        if call.deadline is not None and call.deadline <= now:
+            stats.expired += 1
+            raise DeadlineExceeded("The deadline of the command passed before it was queued")
+        blockers = [] if lights is None else [entry for entry in self._entries() if _conflicts(entry.lights, lights)]
+        entry = _Entry(command, future, call, lights, now, blockers)
+        self._queues[priority].setdefault(call.session, deque()).append(entry)
+        self._size += 1
+        stats.enqueued += 1
+        if call.deadline is not None:
+            entry.timer = asyncio.get_running_loop().call_later(call.deadline - now, self._expire, entry)
+        self._not_empty.set()
+
+    async def get(self):
+        """取出下一個要送出的指令，佇列為空時等待。"""
+        while True:
+            entry = self._next()
+            if entry is None:
+                self._not_empty.clear()
+                await self._not_empty.wait()
+                continue
+            self._remove(entry)
+            priority = self._priority(entry)
+            # 送出的 session 移到隊尾，下一次輪到同一個優先順序的其他 session
+            queues = self._queues[priority]
+            if entry.call.session in queues:
+                queues.move_to_end(entry.call.session)
+            if entry.future.done():
+                self.stats[priority].cancelled += 1
+                continue
+            self.stats[priority].dispatched += 1
+            self._waits[priority].append(time.monotonic() - entry.enqueued_at)
+            return entry.command
+
+    def _next(self) -> Optional[_Entry]:
+        for queues in self._queues:
+            if not queues:
+                continue
+            entry = next(iter(queues.values()))[0]
+            # 較早排入、涉及相同燈的指令先送出（它的 blocker 也一樣），blocker 一定比較早排入，不會形成循環
+            while True:
+                blocker = next((blocker for blocker in entry.blockers if blocker.queued), None)
+                if blocker is None:
+                    return entry
+                entry = blocker
+        return None
+
+    def _priority(self, entry: _Entry) -> int:
+        return min(max(entry.call.priority, 0), len(PRIORITY_NAMES) - 1)
+
+    def _entries(self):
+        for queues in self._queues:
+            for queue in queues.values():
+                yield from queue
+
+    def _remove(self, entry: _Entry):
+        queues = self._queues[self._priority(entry)]
+        queue = queues[entry.call.session]
+        queue.remove(entry)
+        if not queue:
+            del queues[entry.call.session]
+        entry.queued = False
+        entry.blockers = []
+        if entry.timer is not None:
+            entry.timer.cancel()
+        self._size -= 1
+
+    def _expire(self, entry: _Entry):
+        if not entry.queued:
+            return
+        self._remove(entry)
+        self.stats[self._priority(entry)].expired += 1
+        if not entry.future.done():
+            waited_ms = (time.monotonic() - entry.enqueued_at) * 1000
+            entry.future.set_exception(DeadlineExceeded(f"The command waited {waited_ms:.0f} ms in the serial queue and passed its deadline"))
+
+    def fail_all(self, error: Exception):
+        """清空佇列並讓所有等待中的呼叫端收到錯誤（例如引擎關閉時）。"""
+        for entry in list(self._entries()):
+            self._remove(entry)
+            if not entry.future.done():
+                entry.future.set_exception(error)
+
+    def stats_dict(self) -> dict:
+        depths = [sum(len(queue) for queue in queues.values()) for queues in self._queues]
+        sessions: Dict[str, int] = {}
+        for entry in self._entries():
+            sessions[entry.call.session or "internal"] = sessions.get(entry.call.session or "internal", 0) + 1
+        priorities = {}
+        for index, name in enumerate(PRIORITY_NAMES):
+            waits = sorted(self._waits[index])
+            priorities[name] = dict(
+                asdict(self.stats[index]),
+                depth=depths[index],
+                wait_ms={"p50": percentile_ms(waits, 50), "p95": percentile_ms(waits, 95), "p99": percentile_ms(waits, 99), "max": percentile_ms(waits, 100)},
+            )
+        return {"depth": self._size, "max_depth": self.maxsize, "priorities": priorities, "sessions": sessions}
@@ -0,0 +1,688 @@
+import asyncio, logging, threading, time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field, asdict
+from typing import Awaitable, Callable, Deque, Dict, List, Optional
+
+from .protocol import (
+    AsciiCodec, BinaryCodec, DeviceError, Opcode, Reply, StreamDecoder, UnsupportedCommand, encode_seq_frame, split_frames,
+    ACK_MIN_VERSION, BINARY_MIN_VERSION, CONFIRM_LIGHTS, CONFIRM_MIN_VERSION, FADE_MIN_VERSION, FRAME_MIN_VERSION, FRAME_START, MASK_MIN_VERSION, MAX_BYTE_LIGHT_ID, MAX_PAYLOAD,
+    PATTERN_MIN_VERSION, REPORT_MIN_VERSION, RX_BUFFER_SIZE, STATUS_RANGE_LIGHTS,
+    QUERY_REPLY_KIND, REPLY_ACK, REPLY_CHANGE, REPLY_CONFIRM, REPLY_ERROR, REPLY_INFO, REPLY_PATTERN, REPLY_RANGE, REPLY_STATUS, REPLY_SYNC, REPLY_VERSION,
+    VERSION_QUERY,
+)
+from .framebuffer import encode_delta
+from .metrics import percentile_ms
+from .patterns import PatternProgram, compile_program
+from .scheduler import ALL_LIGHTS, CommandScheduler, DeadlineExceeded, current_call
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class _WriteCommand:
+    data: bytes
+    future: asyncio.Future = field(repr=False)
+    # 查詢指令預期的回應種類與等待回應的 future，送出前才登記，回應依實際送出的順序對應
+    reply_kind: Optional[str] = None
+    waiter: Optional[asyncio.Future] = field(default=None, repr=False)
+
+
+@dataclass
+class _InFlight:
+    # 確認模式下已送出、尚未收到 ACK 的 frame
+    seq: int
+    opcode: int
+    frame: bytes
+    future: asyncio.Future = field(repr=False)
+    sent_at: float = 0.0
+    retries: int = 0
+
+
+@dataclass
+class AckStats:
+    # 以序號 frame 送出的 frame 數（不含重送）
+    sent: int = 0
+    # 收到確認的 frame 數
+    acked: int = 0
+    # 逾時或 Arduino 回報 CRC 錯誤後重送的 frame 數
+    retransmits: int = 0
+    # 重送超過上限而放棄的 frame 數
+    timeouts: int = 0
+    # 序號同步的次數（每次協商與放棄重送後各一次）
+    resyncs: int = 0
+
+
+class SerialEngine:
+    """
+    非阻塞的序列埠 I/O 引擎。
+
+    所有對 Arduino 的寫入都由單一 owner task 送出（實際的 `ser.write()` 在專用的 worker thread 執行），
+    送出的順序由 `CommandScheduler` 決定：依呼叫端的優先順序與期限，同一個優先順序內各 MCP session 輪流，
+    另有一條 reader thread 持續讀取 Arduino 的回應，依回應種類（例如 `S`、`I`）交給等待中的查詢。
+    工具函式只需要 `await` 結果，不會阻塞 uvicorn 的 event loop。
+
+    第一次使用時才建立連線，並與 Arduino 協商協定：支援二進位 frame 的韌體會回覆 `V,<version>`，
+    之後的指令都改用較精簡且帶 CRC 的二進位 frame；舊韌體不回應時則退回原本的 ASCII 協定。
+    連線中斷時 reader thread 會透過 `SerialConnection.reconnect()` 以退避方式重新連線，成功後重新協商，
+    並呼叫 `on_reconnect` 中登記的 callback（例如讓影子快取重新讀取狀態）。
+
+    韌體支援且 `ack_window` 大於 0 時啟用確認模式：每個 frame 包成帶序號的 frame，Arduino 依序處理並回覆 ACK，
+    Host 最多同時保留 `ack_window` 個（且總長度不超過 Arduino 64 bytes 接收緩衝區的）未確認 frame，
+    寫入指令在收到確認後才返回；逾時或 Arduino 回報 CRC 錯誤時，從最舊的未確認 frame 起全部重送（go-back-N），
+    並記錄每個 frame 的來回時間（RTT）。
+
+    Args:
+        conn (SerialConnection): 這塊 Arduino 的連線管理物件。
+        reply_timeout (float, optional): 等待查詢回應的秒數，預設為 1 秒。
+        max_queue (int, optional): 指令佇列的上限，超過時直接回報錯誤而不是無限排隊，預設為 256。
+        protocol (str, optional): `"auto"`（協商）、`"ascii"` 或 `"binary"`，預設為 `"auto"`。
+        report_changes (bool, optional): 韌體支援時，請 Arduino 主動回報它自行造成的亮度變化，並交給 `on_change`，預設為 False。
+        ack_window (int, optional): 確認模式下最多同時未確認的 frame 數（1-64），`0` 表示不使用確認模式，預設為 0。
+        ack_timeout (float, optional): 等待 ACK 的秒數，逾時即重送，預設為 0.25。
+        ack_retries (int, optional): 同一個 frame 最多重送的次數，超過時該指令失敗並重新同步序號，預設為 5。
+    """
+
+    def __init__(
+        self, conn, reply_timeout: float = 1.0, max_queue: int = 256, protocol: str = "auto", report_changes: bool = False,
+        ack_window: int = 0, ack_timeout: float = 0.25, ack_retries: int = 5,
+    ):
+        if protocol not in ("auto", "ascii", "binary"):
+            raise ValueError(f"Unknown serial protocol '{protocol}', expected auto, ascii or binary")
+        if not 0 <= ack_window <= 64:
+            raise ValueError(f"The ack window must be between [0-64], got {ack_window}")
+        self.conn = conn
+        self.reply_timeout = reply_timeout
+        self.max_queue = max_queue
+        self.protocol = protocol
+        self.report_changes = report_changes
+        self.ack_window = ack_window
+        self.ack_timeout = ack_timeout
+        self.ack_retries = ack_retries
+        self.ack_stats = AckStats()
+        self.codec = AsciiCodec()
+        # 協商時韌體回報的協定版本，0 表示不回應 `v` 的舊韌體
+        self.firmware_version = 0
+        # 最近一次 `read_info()` 查到的燈數，0 表示還沒查詢
+        self.led_count = 0
+        # Arduino 明確回報的錯誤次數（二進位協定）
+        self.device_errors = 0
+        # 等不到查詢回應的次數
+        self.reply_timeouts = 0
+        # 重新連線並協商完成後依序呼叫的 callback
+        self.on_reconnect: List[Callable[[], Awaitable]] = []
+        # Arduino 主動回報亮度變化時呼叫：callback(板子上的燈號, PWM 值)
+        self.on_change: List[Callable[[int, int], None]] = []
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[CommandScheduler] = None
+        self._owner_task: Optional[asyncio.Task] = None
+        self._reader_thread: Optional[threading.Thread] = None
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="serial-writer")
+        self._stop = threading.Event()
+        self._decoder = StreamDecoder()
+        self._start_lock: Optional[asyncio.Lock] = None
+        self._ready = False
+        # 依回應種類排隊的查詢；Arduino 依序處理指令，因此同一種類的回應按 FIFO 對應
+        self._waiters: Dict[str, Deque[asyncio.Future]] = {}
+
+        # ---------- 確認模式 ----------
+        self._acking = False
+        self._next_seq = 0
+        # 依序號排列的未確認 frame
+        self._inflight: "OrderedDict[int, _InFlight]" = OrderedDict()
+        self._inflight_bytes = 0
+        self._window_changed: Optional[asyncio.Event] = None
+        # 送出與重送共用，確保重送的 frame 不會和新的 frame 交錯
+        self._send_lock: Optional[asyncio.Lock] = None
+        self._retransmit_task: Optional[asyncio.Task] = None
+        # 最近的 RTT（秒），只取沒有重送過的 frame（Karn's algorithm）
+        self._rtts: Deque[float] = deque(maxlen=1024)
+
+    # ---------- 生命週期 ----------
+
+    async def _ensure_ready(self):
+        """在第一次使用時，於目前的 event loop 上啟動 owner task 與 reader thread，並協商協定。"""
+        if self._ready and not self._owner_task.done():
+            return
+        if self._start_lock is None:
+            self._start_lock = asyncio.Lock()
+        async with self._start_lock:
+            if self._ready and not self._owner_task.done():
+                return
+            self._loop = asyncio.get_running_loop()
+            # 延後到第一次使用才連線，連線（含等待開機訊息）在 thread 中進行，不阻塞 event loop
+            await self._loop.run_in_executor(None, self.conn.ensure_connected)
+            self._queue = CommandScheduler(maxsize=self.max_queue)
+            self._window_changed = asyncio.Event()
+            self._send_lock = asyncio.Lock()
+            self._stop.clear()
+            self._owner_task = self._loop.create_task(self._owner(), name="serial-owner")
+            if self.ack_window:
+                self._retransmit_task = self._loop.create_task(self._retransmit_loop(), name="serial-retransmit")
+            if self._reader_thread is None or not self._reader_thread.is_alive():
+                self._reader_thread = threading.Thread(target=self._reader, name="serial-reader", daemon=True)
+                self._reader_thread.start()
+            await self._negotiate()
+            self._ready = True
+            logger.info(f"Serial engine started (protocol: {self.codec.name}, firmware version: {self.firmware_version})")
+
+    async def _negotiate(self):
+        # 重新連線後 Arduino 可能已重置，之前未確認的 frame 不再重送，協商期間的指令也不包成序號 frame
+        self._acking = False
+        self._fail_inflight(ConnectionError(f"Connection to {self.conn.url} was renegotiated before the command was acknowledged"))
+        # 指定 ASCII 時仍查詢版本，以得知韌體支援哪些指令（例如漸變）
+        try:
+            reply = await self._query(VERSION_QUERY, REPLY_VERSION, timeout=min(self.reply_timeout, 0.5))
+            version = reply.values[0]
+        except TimeoutError:
+            version = 0
+        self.firmware_version = version
+        if self.protocol == "ascii":
+            self.codec = AsciiCodec()
+        elif version >= BINARY_MIN_VERSION:
+            self.codec = BinaryCodec()
+        elif self.protocol == "binary":
+            raise RuntimeError("Arduino firmware does not support the binary protocol, please update the firmware or use SERIAL_PROTOCOL=ascii")
+        else:
+            logger.info("Arduino firmware does not support the binary protocol, fall back to ASCII")
+            self.codec = AsciiCodec()
+        if self.ack_window and self.codec.name == BinaryCodec.name and version >= ACK_MIN_VERSION:
+            await self._sync()
+            self._acking = True
+        # 回報模式是 Arduino 端的狀態，重置後需要重新開啟，所以每次協商都送一次
+        if self.report_changes and version >= REPORT_MIN_VERSION:
+            await self._enqueue(self.codec.report(True))
+
+    async def _sync(self):
+        """讓 Arduino 從 `_next_seq` 開始接受序號 frame。"""
+        reply = await self._query(self.codec.sync(self._next_seq), REPLY_SYNC, direct=True)
+        if reply.values[0] != self._next_seq:
+            raise RuntimeError(f"Arduino({self.conn.url}) synced to sequence {reply.values[0]}, expected {self._next_seq}")
+        self.ack_stats.resyncs += 1
+
+    async def close(self):
+        """停止 owner task 與 reader thread，並關閉序列埠。"""
+        self._stop.set()
+        self._ready = False
+        for task in (self._owner_task, self._retransmit_task):
+            if task is None:
+                continue
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        if self._queue is not None:
+            self._queue.fail_all(ConnectionError(f"Serial engine of {self.conn.url} was closed"))
+        self._writer.shutdown(wait=False)
+        self.conn.close()
+
+    # ---------- 寫入端 ----------
+
+    async def _owner(self):
+        """唯一持有寫入權的 task：依排程把佇列中的指令寫到序列埠。"""
+        while True:
+            command: _WriteCommand = await self._queue.get()
+            if command.waiter is not None:
+                # 必須在寫入前登記，避免回應比登記更早抵達
+                self._waiters.setdefault(command.reply_kind, deque()).append(command.waiter)
+            try:
+                if self._acking and command.data[:1] == bytes([FRAME_START]):
+                    await self._send_sequenced(command)
+                    continue
+                await self._loop.run_in_executor(self._writer, self.conn.write, command.data)
+            except Exception as e:
+                if not command.future.done():
+                    command.future.set_exception(e)
+            else:
+                if not command.future.done():
+                    command.future.set_result(None)
+
+    # ---------- 確認模式 ----------
+
+    async def _send_sequenced(self, command: _WriteCommand):
+        """把指令的每個 frame 包成序號 frame 送出；視窗已滿時在此等待，呼叫端等到所有 frame 都被確認才返回。"""
+        futures = []
+        for opcode, payload in split_frames(command.data):
+            frame = encode_seq_frame(self._next_seq, opcode, payload)
+            while len(self._inflight) >= self.ack_window or (self._inflight and self._inflight_bytes + len(frame) > RX_BUFFER_SIZE):
+                self._window_changed.clear()
+                await self._window_changed.wait()
+            async with self._send_lock:
+                # 等待期間可能重新同步過，序號以送出當下為準
+                frame = encode_seq_frame(self._next_seq, opcode, payload)
+                entry = _InFlight(self._next_seq, opcode, frame, self._loop.create_future(), sent_at=time.monotonic())
+                self._inflight[entry.seq] = entry
+                self._inflight_bytes += len(frame)
+                self._next_seq = (self._next_seq + 1) & 0xFF
+                self.ack_stats.sent += 1
+                futures.append(entry.future)
+                try:
+                    await self._loop.run_in_executor(self._writer, self.conn.write, frame)
+                except Exception as e:
+                    self._fail_inflight(e)
+                    break
+
+        def done(gathered: asyncio.Future):
+            if command.future.done():
+                return
+            if gathered.exception() is not None:
+                command.future.set_exception(gathered.exception())
+            else:
+                command.future.set_result(None)
+
+        asyncio.gather(*futures).add_done_callback(done)
+
+    def _on_ack(self, seq: int, status: int):
+        if seq not in self._inflight:
+            # 重送後才到的重複確認
+            return
+        now = time.monotonic()
+        # Arduino 依序號順序處理，收到這個序號的確認代表更早的 frame 也都已處理（只是確認遺失了）
+        while self._inflight:
+            first_seq, entry = self._inflight.popitem(last=False)
+            self._inflight_bytes -= len(entry.frame)
+            self.ack_stats.acked += 1
+            if first_seq != seq:
+                if not entry.future.done():
+                    entry.future.set_result(None)
+                continue
+            if entry.retries == 0:
+                self._rtts.append(now - entry.sent_at)
+            if not entry.future.done():
+                if status:
+                    self.device_errors += 1
+                    entry.future.set_exception(DeviceError(status, entry.opcode))
+                else:
+                    entry.future.set_result(None)
+            break
+        self._window_changed.set()
+
+    def _fail_inflight(self, error: Exception):
+        while self._inflight:
+            _, entry = self._inflight.popitem(last=False)
+            if not entry.future.done():
+                entry.future.set_exception(error)
+        self._inflight_bytes = 0
+        if self._window_changed is not None:
+            self._window_changed.set()
+
+    async def _retransmit(self):
+        """從最舊的未確認 frame 起全部依序重送（Arduino 會丟棄序號不連續的 frame）。"""
+        async with self._send_lock:
+            entries = list(self._inflight.values())
+            if not entries:
+                return
+            now = time.monotonic()
+            for entry in entries:
+                entry.retries += 1
+                entry.sent_at = now
+            self.ack_stats.retransmits += len(entries)
+            logger.debug(f"Retransmit {len(entries)} frames to {self.conn.url} from sequence {entries[0].seq}")
+            await self._loop.run_in_executor(self._writer, self.conn.write, b"".join(entry.frame for entry in entries))
+
+    async def _retransmit_loop(self):
+        while True:
+            await asyncio.sleep(self.ack_timeout / 4)
+            if not self._inflight:
+                continue
+            oldest = next(iter(self._inflight.values()))
+            if time.monotonic() - oldest.sent_at < self.ack_timeout:
+                continue
+            try:
+                if oldest.retries >= self.ack_retries:
+                    self.ack_stats.timeouts += len(self._inflight)
+                    logger.warning(f"No ack from Arduino({self.conn.url}) for sequence {oldest.seq} after {oldest.retries} retransmits, resync")
+                    self._fail_inflight(TimeoutError(f"No ack from Arduino within {self.ack_retries} retransmits"))
+                    async with self._send_lock:
+                        await self._sync()
+                else:
+                    await self._retransmit()
+            except Exception as e:
+                logger.warning(f"Retransmit to {self.conn.url} error: {e}")
+
+    def ack_stats_dict(self) -> dict:
+        stats = asdict(self.ack_stats)
+        rtts = sorted(self._rtts)
+        stats.update(
+            enabled=self._acking,
+            window=self.ack_window,
+            in_flight=len(self._inflight),
+            rtt_ms={"p50": percentile_ms(rtts, 50), "p95": percentile_ms(rtts, 95), "p99": percentile_ms(rtts, 99), "max": percentile_ms(rtts, 100)},
+        )
+        return stats
+
+    def _enqueue(self, data: bytes, lights=None, reply_kind: Optional[str] = None, waiter: Optional[asyncio.Future] = None) -> asyncio.Future:
+        """
+        依目前呼叫的排程資訊（`current_call`）排入指令。
+
+        Args:
+            data (bytes): 要寫入的資料。
+            lights (optional): 寫入涉及的燈（板子上的燈號），用於保證同一顆燈的寫入依排入順序送出；`ALL_LIGHTS` 表示所有燈，None 表示不改變任何燈。
+            reply_kind (Optional[str], optional): 查詢指令預期的回應種類。
+            waiter (Optional[asyncio.Future], optional): 等待回應的 future，送出前才登記。
+
+        Raises:
+            RuntimeError: 佇列已滿。
+            DeadlineExceeded: 呼叫的期限已經過了。
+        """
+        future = self._loop.create_future()
+        try:
+            self._queue.put_nowait(_WriteCommand(data, future, reply_kind, waiter), future, current_call.get(), lights)
+        except asyncio.QueueFull:
+            raise RuntimeError(f"Serial command queue is full ({self.max_queue} pending commands)")
+        return future
+
+    async def write(self, data: bytes):
+        """
+        送出一筆不需要回應的指令，等到資料寫入序列埠後返回。
+
+        Args:
+            data (bytes): 要寫入的原始資料，通常由 `self.codec` 產生。
+        """
+        await self._ensure_ready()
+        await self._enqueue(data, ALL_LIGHTS)
+
+    async def query(self, data: bytes, reply_kind: str) -> Reply:
+        """
+        送出查詢指令並等待對應種類的回應。
+
+        Args:
+            data (bytes): 查詢指令，通常由 `self.codec` 產生。
+            reply_kind (str): 預期的回應種類，例如 `REPLY_STATUS`。
+
+        Returns:
+            Reply: Arduino 的回應。
+
+        Raises:
+            TimeoutError: 在 `reply_timeout` 內沒有收到回應。
+            DeviceError: Arduino 明確回報這個查詢失敗。
+        """
+        await self._ensure_ready()
+        return await self._query(data, reply_kind)
+
+    async def _query(self, data: bytes, reply_kind: str, timeout: Optional[float] = None, direct: bool = False, lights=None) -> Reply:
+        timeout = self.reply_timeout if timeout is None else timeout
+        waiter = self._loop.create_future()
+        waiters = self._waiters.setdefault(reply_kind, deque())
+        try:
+            if direct:
+                # 不經過指令佇列直接寫入：同步序號時不能被包成序號 frame，也不能排在等待確認的指令後面
+                waiters.append(waiter)
+                await self._loop.run_in_executor(self._writer, self.conn.write, data)
+            else:
+                # 排程可能調整查詢的先後，由 owner 在實際送出前登記，回應才會交給對應的查詢
+                try:
+                    await self._enqueue(data, lights, reply_kind=reply_kind, waiter=waiter)
+                except DeadlineExceeded:
+                    # 在佇列中逾期而沒有送出（逾期次數由排程統計），不算 Arduino 沒有回應，也不再等待回應
+                    waiter.cancel()
+                    raise
+            try:
+                return await asyncio.wait_for(waiter, timeout)
+            except asyncio.TimeoutError:
+                self.reply_timeouts += 1
+                logger.warning(f"Timed out waiting for '{reply_kind}' reply to {data!r}")
+                raise TimeoutError(f"No '{reply_kind}' reply from Arduino within {timeout}s")
+        finally:
+            try:
+                waiters.remove(waiter)
+            except ValueError:
+                pass
+
+    # ---------- 讀取端 ----------
+
+    def _reader(self):
+        """在背景 thread 中持續讀取 Arduino 的回應，解碼後交回 event loop 分派；連線中斷時負責重新連線。"""
+        while not self._stop.is_set():
+            try:
+                data = self.conn.read_available()
+            except Exception as e:
+                if self._stop.is_set():
+                    break
+                logger.error(f"Serial read error on {self.conn.url}: {e}")
+                self._decoder = StreamDecoder()
+                if self.conn.reconnect(self._stop):
+                    self._loop.call_soon_threadsafe(self._schedule_reconnected)
+                continue
+            if not data:
+                continue
+            replies = self._decoder.feed(data)
+            if replies:
+                self._loop.call_soon_threadsafe(self._dispatch, replies)
+
+    def _schedule_reconnected(self):
+        self._loop.create_task(self._on_reconnected(), name="serial-reconnected")
+
+    async def _on_reconnected(self):
+        # Arduino 可能因重新連線而重置，需要重新協商協定，並通知上層重新同步狀態
+        try:
+            await self._negotiate()
+            logger.info(f"Serial engine of {self.conn.url} renegotiated (protocol: {self.codec.name}, firmware version: {self.firmware_version})")
+            for callback in self.on_reconnect:
+                await callback()
+        except Exception as e:
+            logger.warning(f"Resync after reconnecting to {self.conn.url} failed: {e}")
+
+    def _dispatch(self, replies: List[Reply]):
+        for reply in replies:
+            if reply.kind == REPLY_ACK:
+                self._on_ack(*reply.values)
+            elif reply.kind == REPLY_ERROR:
+                self._on_device_error(*reply.values)
+            elif reply.kind == REPLY_CHANGE:
+                for callback in self.on_change:
+                    try:
+                        callback(*reply.values)
+                    except Exception as e:
+                        logger.warning(f"Handle state change '{reply.raw}' error: {e}")
+            elif not self._resolve(reply.kind, result=reply):
+                logger.debug(f"Unsolicited reply from Arduino: '{reply.raw}'")
+
+    def _resolve(self, reply_kind: str, result: Optional[Reply] = None, error: Optional[Exception] = None) -> bool:
+        waiters = self._waiters.get(reply_kind)
+        while waiters:
+            waiter = waiters.popleft()
+            if not waiter.done():
+                if error is not None:
+                    waiter.set_exception(error)
+                else:
+                    waiter.set_result(result)
+                return True
+        return False
+
+    def _on_device_error(self, code: int, opcode: int):
+        self.device_errors += 1
+        if opcode == Opcode.SEQ and self._inflight:
+            # 序號 frame 在傳輸中損毀，不等逾時直接重送
+            self._loop.create_task(self._retransmit(), name="serial-retransmit-now")
+            return
+        error = DeviceError(code, opcode)
+        reply_kind = QUERY_REPLY_KIND.get(opcode)
+        if reply_kind is None or not self._resolve(reply_kind, error=error):
+            logger.warning(str(error))
+
+    # ---------- 高階指令 ----------
+
+    async def set_brightness(self, light_id: int, value_255: int):
+        """設定指定燈的 PWM 值（0-255）。"""
+        await self._ensure_ready()
+        await self._enqueue(self.codec.set_brightness(light_id, value_255), frozenset((light_id,)))
+
+    async def set_brightness_batch(self, values: Dict[int, int]):
+        """
+        以單一 frame 一次設定多顆燈，Arduino 會在解析完整個 frame 後同時套用。
+
+        Args:
+            values (Dict[int, int]): 燈的 ID 對應 PWM 值（0-255）。
+        """
+        await self._ensure_ready()
+        await self._enqueue(self.codec.set_brightness_batch(values), frozenset(values))
+
+    async def set_brightness_group(self, light_ids: List[int], value_255: int):
+        """
+        把同一個 PWM 值套用到多顆燈：韌體支援時以一個位元遮罩指令送出（不論燈數），否則退回批次指令。
+
+        Args:
+            light_ids (List[int]): 板子上的燈號。
+            value_255 (int): PWM 值（0-255）。
+        """
+        await self._ensure_ready()
+        if self.firmware_version >= MASK_MIN_VERSION:
+            await self._enqueue(self.codec.set_brightness_mask(light_ids, value_255), frozenset(light_ids))
+        else:
+            await self._enqueue(self.codec.set_brightness_batch({light_id: value_255 for light_id in light_ids}), frozenset(light_ids))
+
+    async def set_brightness_confirm(self, values: Dict[int, int]) -> Dict[int, int]:
+        """
+        寫入多顆燈並取得 Arduino 套用後實際的亮度。
+
+        韌體支援時每 `CONFIRM_LIGHTS` 顆燈一個 SET_CONFIRM 指令，Arduino 套用後直接回覆結果，一次往返就完成寫入與確認；
+        各段同時送出，超過一段時不保證同時套用。舊韌體或 ASCII 協定沒有確認指令，退回一般的批次寫入並回傳寫入的值，
+        不在每次寫入後讀取狀態（實際亮度的偏差由影子快取的 reconcile 修正）。
+
+        Args:
+            values (Dict[int, int]): 板子上的燈號對應 PWM 值（0-255）。
+
+        Returns:
+            Dict[int, int]: 板子上的燈號對應 Arduino 回報的 PWM 值（不支援確認時為寫入的值）。
+        """
+        await self._ensure_ready()
+        if not self.supports_confirm:
+            await self.set_brightness_batch(values)
+            return dict(values)
+        items = list(values.items())
+        chunks = [dict(items[i:i + CONFIRM_LIGHTS]) for i in range(0, len(items), CONFIRM_LIGHTS)]
+        replies = await asyncio.gather(*(
+            self._query(self.codec.set_brightness_confirm(chunk), REPLY_CONFIRM, lights=frozenset(chunk))
+            for chunk in chunks
+        ))
+        return {light_id: value for reply in replies for light_id, value in zip(reply.values[::2], reply.values[1::2])}
+
+    async def fade(self, light_id: int, value_255: int, duration_ms: int):
+        """
+        讓 Arduino 在 `duration_ms` 毫秒內自行把燈漸變到指定的 PWM 值，只需送出一個指令。
+
+        Raises:
+            UnsupportedCommand: 韌體版本不支援漸變指令，或二進位漸變指令的 1 byte 燈號放不下這顆燈。
+        """
+        await self._ensure_ready()
+        if self.firmware_version < FADE_MIN_VERSION:
+            raise UnsupportedCommand(f"Arduino firmware (version {self.firmware_version}) does not support fade")
+        if self.codec.name == BinaryCodec.name and light_id > MAX_BYTE_LIGHT_ID:
+            raise UnsupportedCommand(f"The binary fade command only addresses lights 0-{MAX_BYTE_LIGHT_ID} of a board, got {light_id}")
+        await self._enqueue(self.codec.fade(light_id, value_255, duration_ms), frozenset((light_id,)))
+
+    @property
+    def supports_confirm(self) -> bool:
+        return self.firmware_version >= CONFIRM_MIN_VERSION and self.codec.name == BinaryCodec.name
+
+    @property
+    def supports_frames(self) -> bool:
+        return self.firmware_version >= FRAME_MIN_VERSION and self.codec.name == BinaryCodec.name
+
+    async def set_frame(self, pixels, changed):
+        """
+        把一個畫面中有變化的燈送到 Arduino：韌體支援時以連續區段或點陣圖編碼（取較短者），否則退回批次指令。
+
+        Args:
+            pixels (np.ndarray): 板子上完整的新畫面（uint8 PWM 值，索引為板子上的燈號）。
+            changed (np.ndarray): 有變化的燈號，由小到大。
+        """
+        await self._ensure_ready()
+        if not len(changed):
+            return
+        lights = frozenset(changed.tolist())
+        if self.supports_frames:
+            await self._enqueue(encode_delta(pixels, changed), lights)
+        else:
+            await self._enqueue(self.codec.set_brightness_batch(dict(zip(changed.tolist(), pixels[changed].tolist()))), lights)
+
+    def _require_patterns(self):
+        if self.firmware_version < PATTERN_MIN_VERSION or self.codec.name != BinaryCodec.name:
+            raise UnsupportedCommand(
+                f"Arduino firmware (version {self.firmware_version}, {self.codec.name} protocol) does not support patterns, "
+                f"binary protocol version {PATTERN_MIN_VERSION} is required"
+            )
+
+    async def upload_pattern(self, program: PatternProgram):
+        """
+        把 pattern 程式上傳到 Arduino，取代原本的程式（正在播放的 pattern 會先停止）；上傳後需要 `run_pattern(True)` 才開始播放。
+
+        Args:
+            program (PatternProgram): 已驗證、以板子上的燈號表示的程式。
+
+        Raises:
+            UnsupportedCommand: 韌體版本不支援 pattern。
+        """
+        await self._ensure_ready()
+        self._require_patterns()
+        await self._enqueue(compile_program(program), ALL_LIGHTS)
+
+    async def run_pattern(self, start: bool):
+        """開始（從第一個步驟）或停止播放已上傳的 pattern；停止時燈維持在當下的亮度。"""
+        await self._ensure_ready()
+        self._require_patterns()
+        await self._enqueue(self.codec.pattern_run(start), ALL_LIGHTS)
+
+    async def read_pattern(self) -> List[int]:
+        """
+        查詢 pattern 的播放狀態。
+
+        Returns:
+            List[int]: 是否播放中、步驟數、目前步驟、已播放圈數、總圈數（0 為無限）、由 pattern 控制的燈的遮罩。
+        """
+        await self._ensure_ready()
+        self._require_patterns()
+        reply = await self._query(self.codec.pattern_query(), REPLY_PATTERN)
+        return reply.values
+
+    async def read_status(self) -> List[int]:
+        """查詢所有燈目前的 PWM 值（0-255）。"""
+        await self._ensure_ready()
+        if self.supports_frames and self.led_count > MAX_PAYLOAD:
+            # 一個 STATUS 回應放不下所有燈，改成分段讀取
+            return await self.read_status_range(0, self.led_count)
+        reply = await self._query(self.codec.status(), REPLY_STATUS)
+        return reply.values
+
+    async def read_status_range(self, start: int, count: int) -> List[int]:
+        """
+        查詢從 `start` 開始 `count` 顆燈的 PWM 值（0-255），每 `STATUS_RANGE_LIGHTS` 顆燈一個查詢，各段的查詢同時送出。
+
+        Raises:
+            UnsupportedCommand: 韌體版本不支援分段讀取。
+        """
+        await self._ensure_ready()
+        if not self.supports_frames:
+            raise UnsupportedCommand(
+                f"Arduino firmware (version {self.firmware_version}, {self.codec.name} protocol) does not support range reads, "
+                f"binary protocol version {FRAME_MIN_VERSION} is required"
+            )
+        replies = await asyncio.gather(*(
+            self._query(self.codec.status_range(offset, min(STATUS_RANGE_LIGHTS, start + count - offset)), REPLY_RANGE)
+            for offset in range(start, start + count, STATUS_RANGE_LIGHTS)
+        ))
+        return [value for reply in replies for value in reply.values[1:]]
+
+    async def read_info(self) -> int:
+        """查詢 Arduino 上的燈數。"""
+        await self._ensure_ready()
+        reply = await self._query(self.codec.info(), REPLY_INFO)
+        self.led_count = reply.values[0]
+        return self.led_count
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def scheduler_stats_dict(self) -> dict:
+        """指令排程的統計：各優先順序排入、送出、逾期與取消的指令數，目前的佇列深度與等待時間的百分位數。"""
+        if self._queue is None:
+            return CommandScheduler(maxsize=self.max_queue).stats_dict()
+        return self._queue.stats_dict()
+
+    @property
+    def crc_errors(self) -> int:
+        return self._decoder.crc_errors
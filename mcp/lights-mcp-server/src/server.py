@@ -1,123 +1,402 @@
-import traceback, argparse, uvicorn, os
+import traceback, argparse, uvicorn, os, json, copy, functools
+from datetime import datetime
 from mcp.server.fastmcp import FastMCP
-import serial, time, logging
+import serial, time, asyncio, logging
+from concurrent.futures import ThreadPoolExecutor
 import serial.tools.list_ports
-from typing import Optional
-from .models.auduino import LightInfo, FetchLightsInfoOutput
+from typing import Dict, List, Optional
+import numpy as np
+from .models.auduino import LightInfo, FetchLightsInfoOutput, LightsRangeOutput, LightUpdate, EffectInfo, ListEffectsOutput, DeviceInfo, ListDevicesOutput, SceneInfo, ListScenesOutput, GroupInfo, ListGroupsOutput, PatternStepInput, PatternDeviceStatus, PatternStatusOutput, LightHistory, LightHistoryOutput
+from .connection import SerialConnection
+from .protocol import MAX_FADE_MS, UnsupportedCommand
+from .serial_engine import SerialEngine
+from .devices import DeviceRegistry
+from .effects import EffectScheduler, blink, fade
+from .shadow import ShadowState
+from .history import BrightnessHistory
+from .coalescer import WriteCoalescer
+from .scenes import SceneStore, MAX_SCENE_NAME, diff_scene
+from .groups import GroupStore, MAX_GROUP_NAME, BROADCAST_GROUP
+from .patterns import PatternProgram, PatternStep, build_preset, compile_program, validate_program
+from .notifications import ResourceNotifier, STATE_URI
+from .metrics import MetricsRegistry, CONTENT_TYPE
+from .journal import CommandJournal, JournalRecorder, current_tool
+from .scheduler import CallContext, PRIORITY_INTERACTIVE, current_call
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import Response
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 mcp = FastMCP("Auduino MCP Server")
 
-def _find_arduino_port():
+def _find_arduino_ports() -> List[str]:
     """
-    自動尋找 Arduino 連接埠
+    自動尋找所有 Arduino 連接埠
     在 Linux 上尋找 ttyACM*，在 macOS 上尋找 cu.usbmodem*
     """
+    found = []
     ports = serial.tools.list_ports.comports()
     for port in ports:
         # Linux: ttyACM0, ttyACM1, etc.
         if "ttyACM" in port.device:
-            return port.device
+            found.append(port.device)
         # macOS: cu.usbmodem*, cu.usbserial*, etc.
-        if "cu.usbmodem" in port.device or "cu.usbserial" in port.device:
-            return port.device
-    return None
+        elif "cu.usbmodem" in port.device or "cu.usbserial" in port.device:
+            found.append(port.device)
+    return sorted(found)
 
-led_count = 3
 BAUD_RATE = 9600
 
-# 支援兩種連接模式：
-# 1. 直接連接串口（Linux 或 macOS host 直接運行）
+# 支援三種連接模式：
+# 1. 直接連接串口（Linux 或 macOS host 直接運行），未指定 SERIAL_PORT 時會開啟所有找到的 Arduino
 # 2. 通過 TCP 連接（macOS + Docker，使用 socat 轉發）
+# 3. SERIAL_PORTS 指定多塊板子，以逗號分隔，可混用序列埠路徑與 socket:// URL
 USE_TCP = os.getenv("SERIAL_USE_TCP", "false").lower() == "true"
 TCP_HOST = os.getenv("SERIAL_TCP_HOST", "host.docker.internal")
 TCP_PORT = int(os.getenv("SERIAL_TCP_PORT", "5555"))
+# 序列埠協定：auto（連線時協商，韌體支援就用二進位 frame，否則退回 ASCII）、ascii 或 binary
+SERIAL_PROTOCOL = os.getenv("SERIAL_PROTOCOL", "auto").lower()
+# 背景向 Arduino 讀回實際狀態、修正影子快取的間隔秒數，0 表示停用
+RECONCILE_INTERVAL = float(os.getenv("LIGHTS_RECONCILE_INTERVAL", "30"))
+# 寫入合併的時間窗（毫秒），同一顆燈在時間窗內只送出最後一次的值，0 表示只略過未變更的寫入
+COALESCE_WINDOW_MS = float(os.getenv("LIGHTS_COALESCE_WINDOW_MS", "20"))
+# 連線管理：等待 "Arduino Ready." 的最長秒數、是否避免 DTR 自動重置、是否延後到第一次工具呼叫才連線
+READY_TIMEOUT = float(os.getenv("SERIAL_READY_TIMEOUT", "3"))
+NO_RESET = os.getenv("SERIAL_NO_RESET", "false").lower() == "true"
+LAZY_CONNECT = os.getenv("SERIAL_LAZY_CONNECT", "true").lower() == "true"
+# 韌體支援時，請 Arduino 主動回報它自行造成的亮度變化（例如漸變結束），用於推送 resource 更新通知
+REPORT_CHANGES = os.getenv("SERIAL_REPORT_CHANGES", "true").lower() == "true"
+# 確認模式：韌體支援時每個寫入指令都等 Arduino 確認，最多同時 N 個未確認的 frame，逾時未確認就重送；0 表示停用
+ACK_WINDOW = int(os.getenv("SERIAL_ACK_WINDOW", "4"))
+ACK_TIMEOUT_MS = float(os.getenv("SERIAL_ACK_TIMEOUT_MS", "250"))
+# 具名場景的保存檔
+SCENES_FILE = os.getenv("LIGHTS_SCENES_FILE", "scenes.json")
+# 具名燈光群組的保存檔，可以事先手動編寫
+GROUPS_FILE = os.getenv("LIGHTS_GROUPS_FILE", "groups.json")
+# 送到 Arduino 的每個指令都記錄在固定大小的 mmap 環形日誌中，空字串表示停用
+JOURNAL_FILE = os.getenv("LIGHTS_JOURNAL_FILE", "journal.bin")
+JOURNAL_RECORDS = int(os.getenv("LIGHTS_JOURNAL_RECORDS", "65536"))
+# 亮度歷史最多保存的樣本數（記憶體中的環形緩衝區，每個樣本 11 bytes），0 表示停用
+HISTORY_SAMPLES = int(os.getenv("LIGHTS_HISTORY_SAMPLES", "65536"))
+MAX_HISTORY_BUCKETS = 1440
+# 工具呼叫送出的指令在序列埠佇列中最多等待的毫秒數，逾期就直接失敗而不是無限排隊；0 表示不限制。
+# client 也可以在 tools/call 的 `_meta.deadline_ms` 指定單次呼叫的期限
+CALL_DEADLINE_MS = float(os.getenv("LIGHTS_CALL_DEADLINE_MS", "2000"))
+# 無狀態 HTTP 模式：不建立 MCP session、直接以 JSON 回應，也可以用 --stateless 開啟
+STATELESS_HTTP = os.getenv("LIGHTS_STATELESS_HTTP", "false").lower() == "true"
+# 提供的 transport，以逗號分隔，也可以用 --transport 指定；同時開啟多個 transport 時共用同一組 Arduino 連線
+TRANSPORTS = ("stdio", "streamable-http", "sse")
+DEFAULT_TRANSPORTS = [transport.strip() for transport in os.getenv("LIGHTS_TRANSPORT", "streamable-http").split(",") if transport.strip()]
 
-if USE_TCP:
-    # 使用 TCP 連接模式（適用於 macOS + Docker）
-    try:
-        logger.info(f"Connecting to Arduino via TCP: {TCP_HOST}:{TCP_PORT}")
-        # 使用 socket:// URL 來建立 TCP 連接
-        ser = serial.serial_for_url(f"socket://{TCP_HOST}:{TCP_PORT}", timeout=1)
-        time.sleep(2)
-        initial_message = ser.readline().decode('utf-8').strip()
-        logger.info(f"Connect to Arduino via TCP success: {initial_message}")
-    except Exception as e:
-        logger.error(
-            f"Connect to Arduino via TCP ({TCP_HOST}:{TCP_PORT}) error.\n"
-            f"Please make sure:\n"
-            f"> socat is running on your host machine\n"
-            f"> Command: socat TCP-LISTEN:{TCP_PORT},reuseaddr,fork /dev/cu.usbmodem*,raw,echo=0\n"
-            f"Detail error log:\n"
-            f"{e}"
-        )
-        exit()
+
+if os.getenv("SERIAL_PORTS"):
+    DEVICE_URLS = [url.strip() for url in os.getenv("SERIAL_PORTS").split(",") if url.strip()]
+elif USE_TCP:
+    DEVICE_URLS = [f"socket://{TCP_HOST}:{TCP_PORT}"]
 else:
-    # 使用直接串口連接模式（適用於 Linux + Docker 或 host 直接運行）
-    PORT = os.getenv("SERIAL_PORT") or _find_arduino_port()
-    
-    if PORT is None:
-        logger.error(
-            "No Arduino device found. Please ensure your Arduino is connected "
-            "and the necessary drivers are installed."
-        )
-        exit()
+    DEVICE_URLS = [os.getenv("SERIAL_PORT")] if os.getenv("SERIAL_PORT") else _find_arduino_ports()
+
+if not DEVICE_URLS:
+    logger.error(
+        "No Arduino device found. Please ensure your Arduino is connected "
+        "and the necessary drivers are installed."
+    )
+    exit()
+
+connections = [
+    SerialConnection(url, baudrate=BAUD_RATE, timeout=1, ready_timeout=READY_TIMEOUT, no_reset=NO_RESET)
+    for url in DEVICE_URLS
+]
+
+if not LAZY_CONNECT:
+    # 啟動時就同時連線所有板子；失敗的板子會在第一次工具呼叫時再嘗試，不會讓伺服器結束
+    def _connect(conn: SerialConnection):
+        try:
+            conn.ensure_connected()
+        except Exception:
+            pass
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=len(connections)) as pool:
+        list(pool.map(_connect, connections))
+    logger.info(f"Connected {sum(conn.connected for conn in connections)}/{len(connections)} Arduino in {time.monotonic() - started:.2f}s")
+
+# 每塊板子由自己的 SerialEngine 獨佔序列埠，所有工具都透過它 await 讀寫，不再直接阻塞 event loop；
+# DeviceRegistry 把所有板子的燈排成一個全域 ID 空間，寫到不同板子的指令同時送出
+devices = DeviceRegistry(
+    [(conn.url, SerialEngine(
+        conn, reply_timeout=1, protocol=SERIAL_PROTOCOL, report_changes=REPORT_CHANGES,
+        ack_window=ACK_WINDOW, ack_timeout=ACK_TIMEOUT_MS / 1000,
+    )) for conn in connections],
+    default_led_count=3,
+)
+# 指令日誌：記錄合併後實際送到 Arduino 的指令，可用 `python -m src.journal` 查看或重播
+journal = CommandJournal(JOURNAL_FILE, capacity=JOURNAL_RECORDS) if JOURNAL_FILE else None
+# 寫入合併層：短時間內對同一顆燈的連續寫入只送出最後一次，與已知亮度相同的寫入直接略過
+coalescer = WriteCoalescer(JournalRecorder(devices, journal) if journal else devices, window=COALESCE_WINDOW_MS / 1000)
+# 燈光狀態的影子快取：所有寫入都 write-through 經過它，狀態查詢直接從記憶體回答
+# 亮度歷史：記錄快取中每次亮度變化，供 get_light_history 彙總
+history = BrightnessHistory(HISTORY_SAMPLES) if HISTORY_SAMPLES > 0 else None
+shadow = ShadowState(coalescer, led_count=devices.led_count, reconcile_interval=RECONCILE_INTERVAL, history=history)
+# 訂閱 lights:// resource 的 client 會在快取中的亮度改變時收到通知
+notifier = ResourceNotifier()
+shadow.listeners.append(notifier.lights_changed)
+
+
+def _on_device_change(device):
+    # Arduino 回報的是板子上的燈號，轉成全域燈號後同步更新寫入合併層與影子快取
+    def handle(local_id: int, value_255: int):
+        light_id = device.offset + local_id
+        coalescer.observe(light_id, value_255)
+        shadow.apply_device_change(light_id, value_255)
+    return handle
+
+
+for device in devices.devices:
+    # 重新連線後 Arduino 可能已重置，立即讀回實際狀態，不等下一次 reconcile
+    device.engine.on_reconnect.append(shadow.refresh)
+    device.engine.on_change.append(_on_device_change(device))
+# 閃爍等動畫效果以背景 task 執行，新的寫入會搶占同一顆燈上的效果
+effects = EffectScheduler()
+scenes = SceneStore(SCENES_FILE)
+groups = GroupStore(GROUPS_FILE)
+
+
+# ==================== Metrics ====================
+
+# 熱路徑（每次工具呼叫）只更新計數器與直方圖；序列埠相關的數值本來就記錄在連線與引擎上，在 /metrics 被抓取時才讀取
+metrics = MetricsRegistry()
+tool_calls = metrics.counter("lights_tool_calls_total", "Number of MCP tool calls.", ("tool",))
+tool_errors = metrics.counter("lights_tool_errors_total", "Number of MCP tool calls that raised or returned an error message.", ("tool",))
+tool_latency = metrics.histogram("lights_tool_latency_seconds", "Latency of MCP tool calls in seconds.", ("tool",))
+
+
+def _per_device(value):
+    return lambda: [((device.name,), value(device.engine)) for device in devices.devices]
+
+
+metrics.callback("lights_serial_bytes_written_total", "Bytes written to the serial port.", "counter", ("device",), _per_device(lambda engine: engine.conn.bytes_written))
+metrics.callback("lights_serial_bytes_read_total", "Bytes read from the serial port.", "counter", ("device",), _per_device(lambda engine: engine.conn.bytes_read))
+metrics.callback("lights_serial_reply_timeouts_total", "Queries which got no reply from the Arduino in time.", "counter", ("device",), _per_device(lambda engine: engine.reply_timeouts))
+metrics.callback("lights_serial_crc_errors_total", "Binary frames dropped because of a CRC mismatch.", "counter", ("device",), _per_device(lambda engine: engine.crc_errors))
+metrics.callback("lights_serial_device_errors_total", "Errors reported by the Arduino.", "counter", ("device",), _per_device(lambda engine: engine.device_errors))
+metrics.callback("lights_serial_retransmits_total", "Sequenced frames retransmitted because no ack arrived in time or the frame was corrupted.", "counter", ("device",), _per_device(lambda engine: engine.ack_stats.retransmits))
+metrics.callback("lights_serial_ack_timeouts_total", "Sequenced frames given up after the maximum number of retransmits.", "counter", ("device",), _per_device(lambda engine: engine.ack_stats.timeouts))
+metrics.callback("lights_serial_in_flight", "Sequenced frames sent but not acknowledged yet.", "gauge", ("device",), _per_device(lambda engine: engine.ack_stats_dict()["in_flight"]))
+metrics.callback(
+    "lights_serial_ack_rtt_seconds", "Round trip time from sending a sequenced frame to its ack, over the recent frames.", "gauge", ("device", "quantile"),
+    lambda: [
+        ((device.name, quantile), round(device.engine.ack_stats_dict()["rtt_ms"][key] / 1000, 6))
+        for device in devices.devices
+        for quantile, key in (("0.5", "p50"), ("0.95", "p95"), ("0.99", "p99"))
+    ],
+)
+metrics.callback("lights_serial_queue_depth", "Commands waiting in the serial write queue.", "gauge", ("device",), _per_device(lambda engine: engine.queue_depth))
+metrics.callback(
+    "lights_scheduler_queue_depth", "Commands waiting in the serial command scheduler by priority.", "gauge", ("device", "priority"),
+    lambda: [
+        ((device.name, name), stats["depth"])
+        for device in devices.devices
+        for name, stats in device.engine.scheduler_stats_dict()["priorities"].items()
+    ],
+)
+metrics.callback(
+    "lights_scheduler_commands_total", "Commands leaving the serial command scheduler by priority and outcome (dispatched, expired or cancelled).", "counter",
+    ("device", "priority", "outcome"),
+    lambda: [
+        ((device.name, name, outcome), stats[outcome])
+        for device in devices.devices
+        for name, stats in device.engine.scheduler_stats_dict()["priorities"].items()
+        for outcome in ("dispatched", "expired", "cancelled")
+    ],
+)
+metrics.callback(
+    "lights_scheduler_wait_seconds", "Time commands waited in the serial command scheduler before being sent, over the recent commands.", "gauge",
+    ("device", "priority", "quantile"),
+    lambda: [
+        ((device.name, name, quantile), round(stats["wait_ms"][key] / 1000, 6))
+        for device in devices.devices
+        for name, stats in device.engine.scheduler_stats_dict()["priorities"].items()
+        for quantile, key in (("0.5", "p50"), ("0.95", "p95"), ("0.99", "p99"))
+    ],
+)
+metrics.callback("lights_serial_reconnects_total", "Successful reconnects after the connection was lost.", "counter", ("device",), _per_device(lambda engine: engine.conn.reconnects))
+metrics.callback("lights_serial_connected", "Whether the Arduino is connected (1) or not (0).", "gauge", ("device",), _per_device(lambda engine: int(engine.conn.connected)))
+metrics.callback("lights_resource_notifications_total", "Resource updated notifications sent to subscribers.", "counter", (), lambda: [((), notifier.sent)])
+
+
+def _is_error_result(result) -> bool:
+    # 工具把例外轉成以 "❌" 開頭的訊息回傳
+    return isinstance(result, str) and result.startswith("❌")
 
+
+def _call_context(context) -> CallContext:
+    """工具呼叫的排程資訊：以互動優先順序送出，依 MCP session 輪流，期限取 `_meta.deadline_ms` 或 `LIGHTS_CALL_DEADLINE_MS`。"""
+    session, deadline_ms = "", CALL_DEADLINE_MS
     try:
-        logger.info(f"Connecting to Arduino via serial port: {PORT}")
-        ser = serial.Serial(PORT, BAUD_RATE, timeout=1)
-        # 等待 2 秒，讓 Arduino 完成重置並準備就緒
-        time.sleep(2) 
-        # 讀取 Arduino 啟動時發送的 "Arduino Ready." 訊息，清空緩衝區
-        initial_message = ser.readline().decode('utf-8').strip()
-        logger.info(f"Connect to Arduino({PORT}) success: {initial_message}")
-
-    except serial.SerialException as e:
-        logger.error(
-            f"Connect to Arduino({PORT}) error, please check:\n"
-            f"> Did Arduino connect to your computer?\n"
-            f"> Is the port name `{PORT}` correct?\n"
-            f"Detail error log:\n"
-            f"{e}"
-        )
-        exit()
+        request_context = context.request_context if context is not None else None
+    except ValueError:
+        request_context = None
+    if request_context is not None:
+        request = request_context.request
+        headers = getattr(request, "headers", None)
+        # streamable HTTP 以 mcp-session-id 區分 session；stdio、SSE 與無狀態模式則以 session 物件區分
+        session = (headers.get("mcp-session-id") if headers is not None else None) or f"session-{id(request_context.session):x}"
+        requested = getattr(request_context.meta, "deadline_ms", None)
+        if isinstance(requested, (int, float)) and requested > 0:
+            deadline_ms = requested
+    deadline = time.monotonic() + deadline_ms / 1000 if deadline_ms > 0 else None
+    return CallContext(PRIORITY_INTERACTIVE, session, deadline)
+
+
+def tool(name: str, description: str):
+    """
+    註冊 MCP 工具（取代 `mcp.tool`），註冊的是包裝過的函式：記錄呼叫次數、錯誤與延遲，
+    並設定指令日誌的工具名稱與序列埠排程資訊。參數驗證失敗的呼叫不會執行到工具函式，不列入統計。
+    """
+    def decorator(fn):
+        labels = (name,)
+
+        @functools.wraps(fn)
+        async def instrumented(*args, **kwargs):
+            # 讓指令日誌知道指令是哪個工具送出的（背景效果的 task 會繼承這個值）
+            current_tool.set(name)
+            current_call.set(_call_context(mcp.get_context()))
+            started = time.perf_counter()
+            try:
+                result = await fn(*args, **kwargs)
+            except Exception:
+                tool_errors.inc(labels)
+                raise
+            else:
+                if _is_error_result(result):
+                    tool_errors.inc(labels)
+                return result
+            finally:
+                tool_calls.inc(labels)
+                tool_latency.observe(labels, time.perf_counter() - started)
+
+        mcp.add_tool(instrumented, name=name, description=description)
+        return fn
+
+    return decorator
+
+
+@mcp.custom_route("/metrics", methods=["GET"], include_in_schema=False)
+async def metrics_endpoint(request: Request) -> Response:
+    return Response(metrics.render(), media_type=CONTENT_TYPE)
+
+
+# ==================== MCP resources ====================
+
+# SDK 的 FastMCP 沒有開放 resource 訂閱，各 transport 也以不帶參數的 `create_initialization_options()` 建立能力（subscribe 固定為 False），
+# 只能直接使用底層 server 註冊 handler 並改寫 get_capabilities。requirements.txt 固定 mcp 的版本；
+# 升級後這些屬性若不存在，啟動時就失敗，而不是默默失去訂閱功能
+_LOWLEVEL_ATTRIBUTES = ("subscribe_resource", "unsubscribe_resource", "get_capabilities", "request_context")
+_missing = [attribute for attribute in _LOWLEVEL_ATTRIBUTES if not hasattr(type(getattr(mcp, "_mcp_server", None)), attribute)]
+if _missing:
+    raise RuntimeError(f"The installed mcp SDK does not provide FastMCP._mcp_server.{', '.join(_missing)}, resource subscriptions need the version in requirements.txt")
+
+
+@mcp._mcp_server.subscribe_resource()
+async def _subscribe_resource(uri) -> None:
+    notifier.subscribe(str(uri), mcp._mcp_server.request_context.session)
+
+
+@mcp._mcp_server.unsubscribe_resource()
+async def _unsubscribe_resource(uri) -> None:
+    notifier.unsubscribe(str(uri), mcp._mcp_server.request_context.session)
+
+
+_get_capabilities = mcp._mcp_server.get_capabilities
+
+
+def _get_capabilities_with_subscribe(*args, **kwargs):
+    # SDK 固定回報 resources.subscribe=False，註冊了 handler 仍需自行宣告支援訂閱；無狀態模式沒有可以推送通知的 session
+    capabilities = _get_capabilities(*args, **kwargs)
+    if capabilities.resources is not None and not mcp.settings.stateless_http:
+        capabilities.resources.subscribe = True
+    return capabilities
+
 
+mcp._mcp_server.get_capabilities = _get_capabilities_with_subscribe
 
-@mcp.tool(name="get_lights_statuses", description="Get information of all lights, or a specific light if ID is provided.")
-async def get_lights_statuses(light_id: Optional[int] = None) -> str:
+
+def _light_info(light_id: int, val_255: int) -> LightInfo:
+    # ----- 將 0-255 的值反向映射回 0-100 -----
+    return LightInfo(light_id=light_id, brightness=int(round((val_255 / 255.0) * 100)))
+
+
+def _confirmation(values_255: Dict[int, int], confirmed: Dict[int, int]) -> str:
+    # 寫入時 Arduino 已回覆實際的亮度，與寫入的值不同時（例如被 pattern 或其他寫入改變）列出實際的亮度
+    mismatched = [light_id for light_id, value_255 in values_255.items() if confirmed[light_id] != value_255]
+    if not mismatched:
+        if not all(device.engine.supports_confirm for device in devices.devices):
+            # 舊韌體或 ASCII 協定沒有確認指令，回傳的只是寫入的值
+            return "sent to the Arduino (the firmware cannot confirm writes)"
+        return "confirmed by the Arduino"
+    actual = ", ".join(f"light-{light_id}: {_light_info(light_id, confirmed[light_id]).brightness}%" for light_id in mismatched)
+    return f"but the Arduino reports {actual}"
+
+
+@mcp.resource(STATE_URI, name="lights_state", description="Brightness (0-100%) of every light, served from the server's cached state. Subscribe to get notified when any light changes.", mime_type="application/json")
+async def lights_state() -> str:
+    status = await shadow.get_brightness()
+    return FetchLightsInfoOutput(infos=[_light_info(i, val_255) for i, val_255 in enumerate(status)]).model_dump_json()
+
+
+@mcp.resource("lights://{light_id}", name="light_state", description="Brightness (0-100%) of a specific light, served from the server's cached state. Subscribe to get notified when it changes.", mime_type="application/json")
+async def light_state(light_id: int) -> str:
+    status = await shadow.get_brightness()
+    if not (0 <= light_id < len(status)):
+        raise ValueError(f"The light_id must be a integer between [0-{len(status) - 1}], got {light_id}")
+    return _light_info(light_id, status[light_id]).model_dump_json()
+
+
+@tool(name="get_lights_statuses", description="Get information of all lights, a specific light if ID is provided, or a range of lights if start or count is provided.")
+async def get_lights_statuses(light_id: Optional[int] = None, force_refresh: bool = False, start: Optional[int] = None, count: Optional[int] = None) -> str:
     """
     Get the information of all lights, or a specific light if ID is provided.
-    Generally call this tool to check the status of each light after change the brightness of it.
+    The tools which set the brightness of lights already return the brightness confirmed by the Arduino, there is no need to call this tool to check it afterwards.
+    For long LED strips, prefer a range query (`start` / `count`), which returns a compact `{"start": <int>, "brightness": [<int>, ...]}` instead of one object per light.
 
     Args:
         light_id: Optional. The ID of the light to fetch. If not provided, returns information for all lights.
+        force_refresh: Optional. Read the statuses from the Arduino directly instead of the server's cached state. Defaults to False.
+        start: Optional. The ID of the first light of the range to fetch. Defaults to 0 when `count` is provided.
+        count: Optional. The amount of lights of the range to fetch. Defaults to all lights from `start` when `start` is provided.
     """
     try:
+        led_count = await shadow.get_led_count()
         if light_id is not None and not (0 <= light_id < led_count):
             return f"The light_id must be a integer between [0-{led_count - 1}], got {light_id}"
 
-        ser.write(b's\n')
-        
-        response = ser.readline().decode('utf-8').strip()
+        if start is not None or count is not None:
+            start = 0 if start is None else start
+            if not (0 <= start < led_count):
+                return f"The start must be a integer between [0-{led_count - 1}], got {start}"
+            count = led_count - start if count is None else count
+            if not (1 <= count <= led_count - start):
+                return f"The count must be a integer between [1-{led_count - start}], got {count}"
+            frame = await shadow.get_frame(start, start + count, force_refresh=force_refresh)
+            # ----- 將 0-255 的值反向映射回 0-100（與 round() 相同的四捨五入） -----
+            brightness = np.rint(frame / 255.0 * 100).astype(int).tolist()
+            return LightsRangeOutput(start=start, brightness=brightness).model_dump_json()
+
+        status = await shadow.get_brightness(force_refresh=force_refresh)
         
         all_infos = FetchLightsInfoOutput()
-        if response and response.startswith('S,'):
-            parts = response.split(',')
-            
-            status = [int(p) for p in parts[1:]]
-            for i, val_255 in enumerate(status):
-                # ----- 將 0-255 的值反向映射回 0-100 -----
-                val_100 = int(round((val_255 / 255.0) * 100))
-                all_infos.infos.append(
-                    LightInfo(
-                        light_id=i,
-                        brightness=val_100
-                    )
+        for i, val_255 in enumerate(status):
+            # ----- 將 0-255 的值反向映射回 0-100 -----
+            val_100 = int(round((val_255 / 255.0) * 100))
+            all_infos.infos.append(
+                LightInfo(
+                    light_id=i,
+                    brightness=val_100
                 )
-        else:
-            return f"Got invaild response from Arduino: '{response}'"
+            )
         
         if light_id is not None:
             for light_info in all_infos.infos:
@@ -136,45 +415,165 @@ async def get_lights_statuses(light_id: Optional[int] = None) -> str:
             )
 
 
-@mcp.tool(name="get_light_count", description="Get the amount of lights.")
-async def get_led_count() -> str:
+@tool(name="get_light_count", description="Get the amount of lights.")
+async def get_led_count(force_refresh: bool = False) -> str:
     """Get the amount of lights that current system has.
 
     If you got the error message of something like: `The light_id must be a integer between [0-0]`, means the system still don't know how many lights is there, you should call this tool to check the amount first.
+
+    Args:
+        force_refresh: Optional. Ask the Arduino directly instead of the server's cached count. Defaults to False.
     """
-    global led_count
+    try:
+        # 需要時發送 'i' 指令，Arduino 回傳範例： 'I,3'
+        count = await shadow.get_led_count(force_refresh=force_refresh)
+        return str(count)
+
+    except Exception as e:
+        traceback.print_exc()
+        return (
+            f"❌ Get amount of lights error, error log as below:\n"
+            f"```\n{e}\n```\n\n"
+            )
+
 
-    ser.write(b'i\n') # 發送 'i' 指令
-    response = ser.readline().decode('utf-8').strip()
+def _parse_time(text: str) -> float:
+    # 沒有時區的時間視為伺服器的本地時間
+    return datetime.fromisoformat(text).timestamp()
 
+
+def _format_time(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp).astimezone().isoformat(timespec="seconds")
+
+
+@tool(name="get_light_history", description="Get how long lights were on and their mean brightness over a time range, aggregated into time buckets.")
+async def get_light_history(light_ids: Optional[List[int]] = None, start: Optional[str] = None, end: Optional[str] = None, buckets: int = 12) -> str:
+    """
+    Get the brightness history of lights over a time range, downsampled into equal time buckets.
+    Use this tool to answer questions like "how long was light 2 on today" instead of polling `get_lights_statuses`.
+    The history is kept in memory since the server started and covers a bounded number of changes, check `covered_from` for the oldest time it knows about.
+
+    Args:
+        light_ids: Optional. The IDs of the lights to summarize. Defaults to all lights.
+        start: Optional. The start of the time range in ISO 8601 (e.g. `2025-11-15T00:00:00`), in the server's local time when no timezone is given. Defaults to 1 hour before `end`.
+        end: Optional. The end of the time range in ISO 8601. Defaults to now.
+        buckets: Optional. The number of equal time buckets to split the range into. Defaults to 12.
+    """
     try:
-        if response and response.startswith('I,'):
-            # Arduino 回傳範例： 'I,3'
-            count = int(response.split(',')[1])
-            led_count = count
-            return str(count)
-        else:
-            return f"Got invaild response from Arduino: '{response}'"
+        if history is None:
+            return "The brightness history is disabled on this server (LIGHTS_HISTORY_SAMPLES=0)"
+        if not (1 <= buckets <= MAX_HISTORY_BUCKETS):
+            return f"The buckets must be a integer between [1-{MAX_HISTORY_BUCKETS}], got {buckets}"
+        try:
+            end_at = _parse_time(end) if end is not None else time.time()
+            start_at = _parse_time(start) if start is not None else end_at - 3600
+        except ValueError:
+            return f"The start and end must be ISO 8601 date times (e.g. 2025-11-15T08:30:00), got start={start}, end={end}"
+        if not (start_at < end_at):
+            return f"The start must be earlier than the end, got start={start}, end={end}"
+
+        led_count = await shadow.get_led_count()
+        if light_ids is None:
+            light_ids = list(range(led_count))
+        for light_id in light_ids:
+            if not (0 <= light_id < led_count):
+                return f"The light_id must be a integer between [0-{led_count - 1}], got {light_id}"
+
+        bucket_seconds = (end_at - start_at) / buckets
+        edges = start_at + bucket_seconds * np.arange(buckets + 1)
+        edges[-1] = end_at
+        output = LightHistoryOutput(
+            start=_format_time(start_at),
+            end=_format_time(end_at),
+            bucket_seconds=round(bucket_seconds, 3),
+            covered_from=_format_time(history.covered_from) if history.covered_from is not None else None,
+        )
+        for summary in history.summarize(light_ids, edges):
+            known = float(summary.known_seconds.sum())
+            # ----- 將 0-255 的平均值映射回 0-100 -----
+            mean_100 = summary.mean_255 / 255.0 * 100
+            total_mean = float(np.nansum(summary.mean_255 * summary.known_seconds)) / known / 255.0 * 100 if known > 0 else None
+            output.lights.append(
+                LightHistory(
+                    light_id=summary.light_id,
+                    on_seconds=round(float(summary.on_seconds.sum()), 1),
+                    mean_brightness=round(total_mean, 1) if total_mean is not None else None,
+                    known_seconds=round(known, 1),
+                    bucket_on_seconds=np.round(summary.on_seconds, 1).tolist(),
+                    bucket_mean_brightness=[None if np.isnan(value) else round(float(value), 1) for value in mean_100],
+                )
+            )
+        return output.model_dump_json()
 
     except Exception as e:
         traceback.print_exc()
         return (
-            f"❌ Get amount of lights error, error log as below:\n"
+            f"❌ Get the history of lights error, error log as below:\n"
             f"```\n{e}\n```\n\n"
             )
 
 
-@mcp.tool(name="set_light_brightness", description="Set specific light's brightness.")
+@tool(name="list_devices", description="List the Arduino boards and the range of light IDs each of them drives.")
+async def list_devices() -> str:
+    """
+    List the Arduino boards connected to this server. Light IDs are global across boards: the first board drives `[0, led_count)`, the next board continues from there.
+    """
+    try:
+        await shadow.get_led_count()
+        output = ListDevicesOutput(
+            devices=[
+                DeviceInfo(
+                    name=device.name,
+                    protocol=device.engine.codec.name,
+                    first_light_id=device.offset,
+                    led_count=device.led_count,
+                    ack=device.engine.ack_stats_dict(),
+                    scheduler=device.engine.scheduler_stats_dict(),
+                )
+                for device in devices.devices
+            ]
+        )
+        return output.model_dump_json()
+    except Exception as e:
+        traceback.print_exc()
+        return (
+            f"❌ List devices error, error log as below:\n"
+            f"```\n{e}\n```\n\n"
+            )
+
+
+@tool(name="get_write_stats", description="Get the counters of the serial write coalescing layer.")
+async def get_write_stats() -> str:
+    """
+    Get how many light writes were requested, coalesced within the time window, skipped because the brightness was unchanged, and actually sent to the Arduino.
+    Mainly for tuning `LIGHTS_COALESCE_WINDOW_MS`, you don't need to call this tool to control lights.
+    """
+    return json.dumps(coalescer.stats_dict())
+
+
+@tool(name="get_scheduler_stats", description="Get the queue depth and wait time of the serial command scheduler of each Arduino board.")
+async def get_scheduler_stats() -> str:
+    """
+    Get, for each Arduino board, how many commands are queued per priority (interactive, effect, background) and per MCP session,
+    how many were dispatched, expired before their deadline or cancelled, and the percentiles of the time they waited in the queue (milliseconds).
+    Mainly for diagnosing slow tool calls when several clients share the lights, you don't need to call this tool to control lights.
+    """
+    return json.dumps({device.name: device.engine.scheduler_stats_dict() for device in devices.devices})
+
+
+@tool(name="set_light_brightness", description="Set specific light's brightness.")
 async def set_light_brightness(light_id: int, brightness: int):
     """
     Set brightness value of specific light.
     Always use this tool to change the brightness of the light.
+    The Arduino replies with the brightness it actually applied, which is included in the result, so there is no need to check the status afterwards.
 
     Args:
         light_id: The ID of the light which is going to set brightness. It must be a integer and start with 0. Usually, user says `the first light` means the light of `light_id=0`; `the third light` means the light of `light_id=2`.
         brightness: The percentage of brightness value, must be a integer between [0-100], `0` means turn off, `100` means the maximum brightness.
     """
     try:
+        led_count = await shadow.get_led_count()
         if not (0 <= light_id < led_count):
             return f"The light_id must be a integer between [0-{led_count - 1}], got {light_id}"
 
@@ -186,9 +585,9 @@ async def set_light_brightness(light_id: int, brightness: int):
         # 使用 round() 確保四捨五入，結果更精確
         brightness_255 = int(round((brightness / 100.0) * 255))
 
-        command = f"<{light_id},{brightness_255}>\n"
-        ser.write(command.encode('utf-8'))
-        return f"The bightness of light-{light_id} is set to {brightness}%"
+        effects.preempt(light_id)
+        confirmed = await shadow.set_brightness_confirm({light_id: brightness_255})
+        return f"The bightness of light-{light_id} is set to {brightness}%, {_confirmation({light_id: brightness_255}, confirmed)}"
     except Exception as e:
         traceback.print_exc()
         return (
@@ -197,7 +596,87 @@ async def set_light_brightness(light_id: int, brightness: int):
             )
 
 
-@mcp.tool(name="turn_on_light", description="Turn specific light on.")
+@tool(name="set_lights_batch", description="Set the brightness of several lights at once.")
+async def set_lights_batch(updates: List[LightUpdate]):
+    """
+    Set brightness values of several lights in one call, all of them are applied by the Arduino at the same time.
+    Prefer this tool over calling `set_light_brightness` repeatedly when more than one light needs to change.
+    The Arduino replies with the brightness it actually applied, which is included in the result, so there is no need to check the statuses afterwards.
+
+    Args:
+        updates: A list of `{"light_id": <int>, "brightness": <int>}`. `light_id` starts with 0, `brightness` is the percentage between [0-100]. If the same light appears more than once, the last one wins.
+    """
+    try:
+        if not updates:
+            return "The updates must contain at least one light."
+
+        led_count = await shadow.get_led_count()
+        values_255 = {}
+        for update in updates:
+            if not (0 <= update.light_id < led_count):
+                return f"The light_id must be a integer between [0-{led_count - 1}], got {update.light_id}"
+            if not (0 <= update.brightness <= 100):
+                return f"The brightness value must be a integer between [0-100], got {update.brightness}"
+            values_255[update.light_id] = int(round((update.brightness / 100.0) * 255))
+
+        for light_id in values_255:
+            effects.preempt(light_id)
+        confirmed = await shadow.set_brightness_confirm(values_255)
+
+        summary = ", ".join(f"light-{update.light_id}: {update.brightness}%" for update in {u.light_id: u for u in updates}.values())
+        return f"The bightness of lights is set to {summary}, {_confirmation(values_255, confirmed)}"
+    except Exception as e:
+        traceback.print_exc()
+        return (
+            f"❌ Set the brightness of lights error, error log as below:\n"
+            f"```\n{e}\n```\n\n"
+            )
+
+
+@tool(name="set_frame", description="Set the brightness of a run of consecutive lights from an array, only the lights that changed are sent to the Arduino.")
+async def set_frame(brightness: List[int], start: int = 0):
+    """
+    Set the brightness of consecutive lights from an array, e.g. a whole LED strip or a part of it.
+    Only the lights whose brightness differs from the current state are sent, so updating a few lights of a long strip is as fast as setting them one by one.
+    Prefer this tool over `set_lights_batch` when most lights of a range need a value, e.g. gradients or full-strip updates.
+
+    Args:
+        brightness: The percentage of brightness values, each must be a integer between [0-100]. The first value is for the light of `light_id=start`, the next one for `start + 1` and so on.
+        start: Optional. The ID of the light which the first value is for. Defaults to 0.
+    """
+    try:
+        if not brightness:
+            return "The brightness must contain at least one value."
+
+        led_count = await shadow.get_led_count()
+        if not (0 <= start < led_count):
+            return f"The start must be a integer between [0-{led_count - 1}], got {start}"
+        if start + len(brightness) > led_count:
+            return f"The frame must fit in the lights [0-{led_count - 1}], got {len(brightness)} values from light-{start}"
+
+        values = np.asarray(brightness)
+        invalid = np.flatnonzero((values < 0) | (values > 100))
+        if len(invalid):
+            return f"The brightness value must be a integer between [0-100], got {brightness[invalid[0]]} for light-{start + invalid[0]}"
+
+        # ----- 將 0-100 的值映射到 0-255（與 round() 相同的四捨五入） -----
+        values_255 = np.rint(values / 100.0 * 255).astype(np.uint8)
+
+        stop = start + len(brightness)
+        for effect in effects.running():
+            if start <= effect.light_id < stop:
+                effects.preempt(effect.light_id)
+        changed = await shadow.set_frame(start, values_255)
+        return f"The frame of light-{start} to light-{stop - 1} is set, {changed} of {len(brightness)} lights changed"
+    except Exception as e:
+        traceback.print_exc()
+        return (
+            f"❌ Set the frame of lights error, error log as below:\n"
+            f"```\n{e}\n```\n\n"
+            )
+
+
+@tool(name="turn_on_light", description="Turn specific light on.")
 async def turn_on_light(light_id: int):
     """
     Turn on specific light to the maximum brightness (100%).
@@ -206,14 +685,15 @@ async def turn_on_light(light_id: int):
         light_id: The ID of the light which is going to be turned on. It must be a integer and start with 0.
     """
     try:
+        led_count = await shadow.get_led_count()
         if not (0 <= light_id < led_count):
             return f"The light_id must be a integer between [0-{led_count - 1}], got {light_id}"
 
         brightness_255 = 255
 
-        command = f"<{light_id},{brightness_255}>\n"
-        ser.write(command.encode('utf-8'))
-        return f"The bightness of light-{light_id} is set to 100%"
+        effects.preempt(light_id)
+        confirmed = await shadow.set_brightness_confirm({light_id: brightness_255})
+        return f"The bightness of light-{light_id} is set to 100%, {_confirmation({light_id: brightness_255}, confirmed)}"
     except Exception as e:
         traceback.print_exc()
         return (
@@ -222,7 +702,7 @@ async def turn_on_light(light_id: int):
             )
 
 
-@mcp.tool(name="turn_off_light", description="Turn specific light off.")
+@tool(name="turn_off_light", description="Turn specific light off.")
 async def turn_off_light(light_id: int):
     """
     Turn off specific light (set brightness to 0%).
@@ -231,14 +711,15 @@ async def turn_off_light(light_id: int):
         light_id: The ID of the light which is going to be turned off. It must be a integer and start with 0.
     """
     try:
+        led_count = await shadow.get_led_count()
         if not (0 <= light_id < led_count):
             return f"The light_id must be a integer between [0-{led_count - 1}], got {light_id}"
 
         brightness_255 = 0
 
-        command = f"<{light_id},{brightness_255}>\n"
-        ser.write(command.encode('utf-8'))
-        return f"The bightness of light-{light_id} is set to 0%"
+        effects.preempt(light_id)
+        confirmed = await shadow.set_brightness_confirm({light_id: brightness_255})
+        return f"The bightness of light-{light_id} is set to 0%, {_confirmation({light_id: brightness_255}, confirmed)}"
     except Exception as e:
         traceback.print_exc()
         return (
@@ -247,10 +728,12 @@ async def turn_off_light(light_id: int):
             )
 
 
-@mcp.tool(name="blink_light", description="Make a specific light blink a given number of times and interval.")
+@tool(name="blink_light", description="Start blinking a specific light in the background for a given number of times and interval, returns an effect id immediately.")
 async def blink_light(light_id: int, times: int, interval: float = 0.5):
     """
     Make a specific light blink a given number of times.
+    The blink runs in the background and this tool returns immediately with an effect id, use `list_effects` to check running effects and `cancel_effect` to stop it.
+    Setting the brightness of the light (or starting another blink on it) stops the running blink automatically.
 
     Args:
         light_id: The ID of the light to blink.
@@ -258,6 +741,7 @@ async def blink_light(light_id: int, times: int, interval: float = 0.5):
         interval: The time in seconds between each on/off state change. Defaults to 0.5.
     """
     try:
+        led_count = await shadow.get_led_count()
         if not (0 <= light_id < led_count):
             return f"The light_id must be an integer between [0-{led_count - 1}], got {light_id}"
         if not (times > 0):
@@ -265,28 +749,650 @@ async def blink_light(light_id: int, times: int, interval: float = 0.5):
         if not (interval > 0):
             return f"The interval must be a positive float, got {interval}"
 
-        for _ in range(times):
-            # Turn on
-            ser.write(f"<{light_id},255>\n".encode('utf-8'))
-            time.sleep(interval)
-            # Turn off
-            ser.write(f"<{light_id},0>\n".encode('utf-8'))
-            time.sleep(interval)
-        
-        return f"Light-{light_id} blinked {times} times successfully."
+        effect = effects.start(
+            light_id,
+            kind="blink",
+            params={"times": times, "interval": interval},
+            coro=blink(shadow, light_id, times, interval),
+            final_value=0,
+        )
+        return (
+            f"Light-{light_id} starts blinking {times} times in the background "
+            f"(about {times * interval * 2:.1f} seconds), effect_id: {effect.effect_id}"
+        )
     except Exception as e:
         traceback.print_exc()
         return (
             f"❌ Blink light-{light_id} error, error log as below:\n"
             f"```\n{e}\n```\n\n"
             )
+
+
+@tool(name="fade_light", description="Smoothly fade a specific light to a target brightness over a duration, the Arduino runs the transition by itself.")
+async def fade_light(light_id: int, target: int, duration_ms: int):
+    """
+    Smoothly change the brightness of a specific light to a target value over `duration_ms` milliseconds.
+    Use this tool instead of calling `set_light_brightness` many times for dimming or brightening gradually.
+    The transition runs on the Arduino and this tool returns immediately; setting the brightness of the light during the fade stops it at that value.
+
+    Args:
+        light_id: The ID of the light to fade.
+        target: The target percentage of brightness, must be a integer between [0-100].
+        duration_ms: The duration of the transition in milliseconds, must be a integer between [0-65535].
+    """
+    try:
+        led_count = await shadow.get_led_count()
+        if not (0 <= light_id < led_count):
+            return f"The light_id must be a integer between [0-{led_count - 1}], got {light_id}"
+        if not (0 <= target <= 100):
+            return f"The target value must be a integer between [0-100], got {target}"
+        if not (0 <= duration_ms <= MAX_FADE_MS):
+            return f"The duration_ms must be a integer between [0-{MAX_FADE_MS}], got {duration_ms}"
+
+        target_255 = int(round((target / 100.0) * 255))
+
+        effects.preempt(light_id)
+        try:
+            await shadow.fade(light_id, target_255, duration_ms)
+        except UnsupportedCommand as e:
+            # 舊韌體沒有漸變指令，或燈號超出漸變指令的範圍，改由 host 在背景逐步寫入
+            start_255 = (await shadow.get_brightness())[light_id]
+            effect = effects.start(
+                light_id,
+                kind="fade",
+                params={"target": target, "duration_ms": duration_ms},
+                coro=fade(shadow, light_id, start_255, target_255, duration_ms / 1000),
+            )
+            return (
+                f"Light-{light_id} is fading to {target}% over {duration_ms} ms in the background "
+                f"(the Arduino cannot run this fade: {e}; stepped by the server), effect_id: {effect.effect_id}"
+            )
+        return f"Light-{light_id} is fading to {target}% over {duration_ms} ms on the Arduino"
+    except Exception as e:
+        traceback.print_exc()
+        return (
+            f"❌ Fade light-{light_id} error, error log as below:\n"
+            f"```\n{e}\n```\n\n"
+            )
+
+
+@tool(name="list_effects", description="List the running light effects (e.g. blinking).")
+async def list_effects() -> str:
+    """
+    List the light effects which are still running in the background, such as the blink started by `blink_light`.
+    """
+    now = time.time()
+    output = ListEffectsOutput(
+        effects=[
+            EffectInfo(
+                effect_id=effect.effect_id,
+                light_id=effect.light_id,
+                kind=effect.kind,
+                params=effect.params,
+                elapsed=round(now - effect.started_at, 2),
+            )
+            for effect in effects.running()
+        ]
+    )
+    return output.model_dump_json()
+
+
+@tool(name="cancel_effect", description="Stop a running light effect by effect id, or every effect on a specific light.")
+async def cancel_effect(effect_id: Optional[str] = None, light_id: Optional[int] = None) -> str:
+    """
+    Stop a running light effect. The light is turned off after a blink is cancelled.
+
+    Args:
+        effect_id: Optional. The effect id returned by `blink_light`.
+        light_id: Optional. Stop the effect running on this light. One of `effect_id` or `light_id` must be provided.
+    """
+    try:
+        if effect_id is not None:
+            effect = effects.cancel(effect_id)
+        elif light_id is not None:
+            effect = effects.preempt(light_id)
+        else:
+            return "Either effect_id or light_id must be provided."
+
+        if effect is None:
+            return f"No running effect found for {'effect_id ' + effect_id if effect_id is not None else f'light-{light_id}'}."
+
+        if effect.final_value is not None:
+            await shadow.set_brightness(effect.light_id, effect.final_value)
+        return f"Effect {effect.effect_id} ({effect.kind}) on light-{effect.light_id} is cancelled."
+    except Exception as e:
+        traceback.print_exc()
+        return (
+            f"❌ Cancel effect error, error log as below:\n"
+            f"```\n{e}\n```\n\n"
+            )
     
 
+
+def _scene_info(scene) -> SceneInfo:
+    return SceneInfo(
+        name=scene.name,
+        lights=[
+            LightInfo(light_id=light_id, brightness=int(round((value / 255.0) * 100)))
+            for light_id, value in sorted(scene.lights.items())
+        ],
+        created_at=datetime.fromtimestamp(scene.created_at).isoformat(timespec="seconds"),
+    )
+
+
+@tool(name="save_scene", description="Save the current brightness of all lights, or the given lights, as a named scene.")
+async def save_scene(name: str, lights: Optional[List[LightUpdate]] = None) -> str:
+    """
+    Save a named scene (e.g. `movie`, `reading`) which can be restored later with `apply_scene` in a single call.
+    Saving with an existing name overwrites that scene.
+
+    Args:
+        name: The name of the scene.
+        lights: Optional. The brightness of each light in the scene. If not provided, the current brightness of all lights is saved.
+    """
+    try:
+        name = name.strip()
+        if not (0 < len(name) <= MAX_SCENE_NAME):
+            return f"The scene name must be 1-{MAX_SCENE_NAME} characters, got '{name}'"
+
+        if lights:
+            led_count = await shadow.get_led_count()
+            values_255 = {}
+            for update in lights:
+                if not (0 <= update.light_id < led_count):
+                    return f"The light_id must be a integer between [0-{led_count - 1}], got {update.light_id}"
+                if not (0 <= update.brightness <= 100):
+                    return f"The brightness value must be a integer between [0-100], got {update.brightness}"
+                values_255[update.light_id] = int(round((update.brightness / 100.0) * 255))
+        else:
+            values_255 = dict(enumerate(await shadow.get_brightness()))
+
+        scene = scenes.save(name, values_255)
+        return f"Scene '{name}' is saved with {len(scene.lights)} lights: {_scene_info(scene).model_dump_json()}"
+    except Exception as e:
+        traceback.print_exc()
+        return (
+            f"❌ Save scene '{name}' error, error log as below:\n"
+            f"```\n{e}\n```\n\n"
+            )
+
+
+@tool(name="list_scenes", description="List the saved scenes.")
+async def list_scenes() -> str:
+    """
+    List the saved scenes and the brightness of each light in them.
+    """
+    return ListScenesOutput(scenes=[_scene_info(scene) for scene in scenes.all()]).model_dump_json()
+
+
+@tool(name="apply_scene", description="Apply a saved scene, all of its lights change at the same time.")
+async def apply_scene(name: str) -> str:
+    """
+    Restore a scene saved by `save_scene` in one call.
+    Only the lights whose brightness differs from the scene, or that are fading or driven by a running pattern, are written, and they are sent to the Arduino as one batch so they change at the same time.
+    Running effects (e.g. blinking) on the lights of the scene are stopped.
+
+    Args:
+        name: The name of the scene.
+    """
+    try:
+        scene = scenes.get(name.strip())
+        if scene is None:
+            return f"Scene '{name}' does not exist, use `list_scenes` to see the saved scenes."
+
+        for light_id in scene.lights:
+            effects.preempt(light_id)
+        current = await shadow.get_brightness()
+        changes = diff_scene(scene, current, set(shadow.overridden()))
+        missing = sorted(light_id for light_id in scene.lights if light_id >= len(current))
+
+        if changes:
+            await shadow.set_brightness_batch(changes)
+
+        message = f"Scene '{scene.name}' is applied: {len(changes)} lights changed, {len(scene.lights) - len(changes) - len(missing)} already matched"
+        if missing:
+            message += f", lights {missing} no longer exist and are skipped"
+        return message
+    except Exception as e:
+        traceback.print_exc()
+        return (
+            f"❌ Apply scene '{name}' error, error log as below:\n"
+            f"```\n{e}\n```\n\n"
+            )
+
+
+@tool(name="delete_scene", description="Delete a saved scene.")
+async def delete_scene(name: str) -> str:
+    """
+    Delete a scene saved by `save_scene`.
+
+    Args:
+        name: The name of the scene.
+    """
+    try:
+        if scenes.delete(name.strip()) is None:
+            return f"Scene '{name}' does not exist."
+        return f"Scene '{name}' is deleted."
+    except Exception as e:
+        traceback.print_exc()
+        return (
+            f"❌ Delete scene '{name}' error, error log as below:\n"
+            f"```\n{e}\n```\n\n"
+            )
+
+
+# ==================== 燈光群組 ====================
+
+def _group_info(group) -> GroupInfo:
+    return GroupInfo(
+        name=group.name,
+        light_ids=group.light_ids,
+        created_at=datetime.fromtimestamp(group.created_at).isoformat(timespec="seconds"),
+    )
+
+
+async def _set_group(name: str, brightness: int) -> str:
+    """把群組中的燈設為同一個亮度；同一個值的多顆燈會由寫入合併層以一個群組指令送出。"""
+    led_count = await shadow.get_led_count()
+    if name == BROADCAST_GROUP:
+        light_ids, missing = list(range(led_count)), []
+    else:
+        group = groups.get(name)
+        if group is None:
+            return f"Group '{name}' does not exist, use `list_groups` to see the groups."
+        light_ids = [light_id for light_id in group.light_ids if light_id < led_count]
+        missing = [light_id for light_id in group.light_ids if light_id >= led_count]
+
+    brightness_255 = int(round((brightness / 100.0) * 255))
+    for light_id in light_ids:
+        effects.preempt(light_id)
+    if light_ids:
+        await shadow.set_brightness_batch({light_id: brightness_255 for light_id in light_ids})
+
+    message = f"The bightness of group '{name}' ({len(light_ids)} lights) is set to {brightness}%"
+    if missing:
+        message += f", lights {missing} no longer exist and are skipped"
+    return message
+
+
+@tool(name="create_group", description="Create or overwrite a named group of lights, which can be controlled with a single call later.")
+async def create_group(name: str, light_ids: List[int]) -> str:
+    """
+    Create a named group of lights (e.g. `living_room`), then use `set_group_brightness` to change all of them in one call.
+    Creating with an existing name overwrites that group. The group `all` is built in and always contains every light.
+
+    Args:
+        name: The name of the group.
+        light_ids: The IDs of the lights in the group, each of them starts with 0.
+    """
+    try:
+        name = name.strip()
+        if not (0 < len(name) <= MAX_GROUP_NAME):
+            return f"The group name must be 1-{MAX_GROUP_NAME} characters, got '{name}'"
+        if name == BROADCAST_GROUP:
+            return f"The group '{BROADCAST_GROUP}' is built in and always contains every light."
+        if not light_ids:
+            return "The light_ids must contain at least one light."
+
+        led_count = await shadow.get_led_count()
+        for light_id in light_ids:
+            if not (0 <= light_id < led_count):
+                return f"The light_id must be a integer between [0-{led_count - 1}], got {light_id}"
+
+        group = groups.save(name, light_ids)
+        return f"Group '{name}' is saved with lights {group.light_ids}"
+    except Exception as e:
+        traceback.print_exc()
+        return (
+            f"❌ Create group '{name}' error, error log as below:\n"
+            f"```\n{e}\n```\n\n"
+            )
+
+
+@tool(name="list_groups", description="List the light groups, including the built-in group `all`.")
+async def list_groups() -> str:
+    """
+    List the light groups and the lights in each of them. The built-in group `all` always contains every light.
+    """
+    try:
+        led_count = await shadow.get_led_count()
+        broadcast = GroupInfo(name=BROADCAST_GROUP, light_ids=list(range(led_count)), builtin=True)
+        return ListGroupsOutput(groups=[broadcast] + [_group_info(group) for group in groups.all()]).model_dump_json()
+    except Exception as e:
+        traceback.print_exc()
+        return (
+            f"❌ List groups error, error log as below:\n"
+            f"```\n{e}\n```\n\n"
+            )
+
+
+@tool(name="delete_group", description="Delete a light group.")
+async def delete_group(name: str) -> str:
+    """
+    Delete a group created by `create_group`. The lights themselves are not changed.
+
+    Args:
+        name: The name of the group.
+    """
+    try:
+        if name.strip() == BROADCAST_GROUP:
+            return f"The group '{BROADCAST_GROUP}' is built in and can not be deleted."
+        if groups.delete(name.strip()) is None:
+            return f"Group '{name}' does not exist."
+        return f"Group '{name}' is deleted."
+    except Exception as e:
+        traceback.print_exc()
+        return (
+            f"❌ Delete group '{name}' error, error log as below:\n"
+            f"```\n{e}\n```\n\n"
+            )
+
+
+@tool(name="set_group_brightness", description="Set every light in a group to the same brightness with one call, use the group `all` for every light.")
+async def set_group_brightness(group: str, brightness: int) -> str:
+    """
+    Set all lights of a group to the same brightness. The Arduino receives one command per board no matter how many lights the group has,
+    and all of them change at the same time. Running effects (e.g. blinking) on these lights are stopped.
+
+    Args:
+        group: The name of the group, `all` means every light.
+        brightness: The brightness percentage between [0-100].
+    """
+    try:
+        if not (0 <= brightness <= 100):
+            return f"The brightness value must be a integer between [0-100], got {brightness}"
+        return await _set_group(group.strip(), brightness)
+    except Exception as e:
+        traceback.print_exc()
+        return (
+            f"❌ Set the brightness of group '{group}' error, error log as below:\n"
+            f"```\n{e}\n```\n\n"
+            )
+
+
+@tool(name="turn_off_all", description="Turn every light off with one call.")
+async def turn_off_all() -> str:
+    """
+    Turn off every light (set brightness to 0%). Prefer this tool over calling `turn_off_light` for each light.
+    """
+    try:
+        return await _set_group(BROADCAST_GROUP, 0)
+    except Exception as e:
+        traceback.print_exc()
+        return (
+            f"❌ Turn off all lights error, error log as below:\n"
+            f"```\n{e}\n```\n\n"
+            )
+
+
+# ==================== Pattern（由 Arduino 播放的動畫） ====================
+
+def _pattern_lights(device, mask: int) -> List[int]:
+    return [device.offset + i for i in range(mask.bit_length()) if mask >> i & 1]
+
+
+async def _upload_pattern(program: PatternProgram, start: bool) -> str:
+    """驗證並上傳 pattern，需要時立即開始播放。"""
+    led_count = await shadow.get_led_count()
+    try:
+        validate_program(program, led_count)
+        previous = devices.pattern
+        targets = await shadow.upload_pattern(program)
+    except (ValueError, UnsupportedCommand) as e:
+        return str(e)
+    # 上傳新的程式時，Arduino 會先停止原本的 pattern
+    if previous is not None:
+        coalescer.pattern_stopped(previous.light_ids)
+        shadow.pattern_stopped(previous.light_ids)
+    size = sum(len(compile_program(device.pattern)) for device in targets)
+    message = (
+        f"Pattern '{program.name}' ({len(program.steps)} steps, {program.period_ms} ms per loop, "
+        f"{'looping forever' if program.loops == 0 else f'{program.loops} loops'}) is uploaded to {len(targets)} boards ({size} bytes)"
+    )
+    if not start:
+        return message + ", call `start_pattern` to play it"
+    await _start_pattern()
+    return message + " and playing on the Arduino"
+
+
+async def _start_pattern():
+    # 主機端的效果會和 pattern 搶同一顆燈，先停止
+    for light_id in devices.pattern.light_ids:
+        effects.preempt(light_id)
+    await shadow.run_pattern(True)
+    # 寫入合併層與影子快取都不能再相信 pattern 控制的燈的已知亮度
+    coalescer.pattern_started(devices.pattern.light_ids)
+    shadow.pattern_started(devices.pattern.light_ids)
+
+
+@tool(name="upload_pattern", description="Upload an animation program (keyframes) which the Arduino plays by itself, without any further serial traffic.")
+async def upload_pattern(steps: List[PatternStepInput], loops: int = 0, start: bool = True) -> str:
+    """
+    Upload a pattern program to the Arduino. The Arduino plays the steps in order with its own clock and repeats them, so long-running
+    ambient effects need no server CPU and no serial traffic. Uploading replaces the previous pattern.
+    Writing to a light (e.g. `set_light_brightness`) takes that light out of the running pattern.
+
+    Args:
+        steps: Up to 16 steps. In each step, the listed lights reach their brightness at the end of `duration_ms`,
+            fading linearly when `ramp` is true or switching at the start of the step when `ramp` is false. Unlisted lights keep their brightness.
+        loops: How many times the steps are played, 0 means forever. Defaults to 0.
+        start: Start playing right after uploading. Defaults to True.
+    """
+    try:
+        for index, step in enumerate(steps):
+            for light in step.lights:
+                if not (0 <= light.brightness <= 100):
+                    return f"The brightness of light-{light.light_id} in step {index} must be a integer between [0-100], got {light.brightness}"
+        program = PatternProgram(
+            steps=[
+                PatternStep(
+                    duration_ms=step.duration_ms,
+                    values={light.light_id: int(round((light.brightness / 100.0) * 255)) for light in step.lights},
+                    ramp=step.ramp,
+                )
+                for step in steps
+            ],
+            loops=loops,
+        )
+        return await _upload_pattern(program, start)
+    except Exception as e:
+        traceback.print_exc()
+        return (
+            f"❌ Upload pattern error, error log as below:\n"
+            f"```\n{e}\n```\n\n"
+            )
+
+
+@tool(name="upload_preset_pattern", description="Upload a built-in animation (chase, pulse or breathe) which the Arduino plays by itself.")
+async def upload_preset_pattern(
+    preset: str, light_ids: Optional[List[int]] = None, brightness: int = 100, period_ms: int = 2000, loops: int = 0, start: bool = True,
+) -> str:
+    """
+    Upload a built-in pattern to the Arduino, which then plays it by itself until stopped.
+
+    * `chase`: light one light at a time, in the order of `light_ids`.
+    * `pulse`: all lights flash up quickly and fade out slowly.
+    * `breathe`: all lights fade up and down smoothly.
+
+    Args:
+        preset: `chase`, `pulse` or `breathe`.
+        light_ids: Optional. The lights to animate (at most 16 for `chase`), defaults to every light.
+        brightness: The peak brightness percentage between [0-100]. Defaults to 100.
+        period_ms: The duration of one loop in milliseconds. Defaults to 2000.
+        loops: How many times the animation is played, 0 means forever. Defaults to 0.
+        start: Start playing right after uploading. Defaults to True.
+    """
+    try:
+        if not (0 <= brightness <= 100):
+            return f"The brightness value must be a integer between [0-100], got {brightness}"
+        if period_ms <= 0:
+            return f"The period_ms must be a positive integer, got {period_ms}"
+        led_count = await shadow.get_led_count()
+        brightness_255 = int(round((brightness / 100.0) * 255))
+        try:
+            program = build_preset(preset.strip(), light_ids if light_ids else list(range(led_count)), brightness_255, period_ms, loops)
+        except ValueError as e:
+            return str(e)
+        return await _upload_pattern(program, start)
+    except Exception as e:
+        traceback.print_exc()
+        return (
+            f"❌ Upload preset pattern '{preset}' error, error log as below:\n"
+            f"```\n{e}\n```\n\n"
+            )
+
+
+@tool(name="start_pattern", description="Start playing the uploaded pattern from its first step.")
+async def start_pattern() -> str:
+    """
+    Start playing the pattern uploaded by `upload_pattern` or `upload_preset_pattern` from its first step, on every board at the same time.
+    """
+    try:
+        if devices.pattern is None:
+            return "No pattern has been uploaded, call `upload_pattern` or `upload_preset_pattern` first."
+        await _start_pattern()
+        return f"Pattern '{devices.pattern.name}' is playing on the Arduino"
+    except Exception as e:
+        traceback.print_exc()
+        return (
+            f"❌ Start pattern error, error log as below:\n"
+            f"```\n{e}\n```\n\n"
+            )
+
+
+@tool(name="stop_pattern", description="Stop the playing pattern, the lights keep their current brightness.")
+async def stop_pattern() -> str:
+    """
+    Stop the pattern on every board. The lights stay at the brightness they had when stopped, and the pattern can be started again with `start_pattern`.
+    """
+    try:
+        if devices.pattern is None:
+            return "No pattern has been uploaded."
+        await shadow.run_pattern(False)
+        coalescer.pattern_stopped(devices.pattern.light_ids)
+        shadow.pattern_stopped(devices.pattern.light_ids)
+        # 讀回停止當下的亮度，快取與訂閱者因此看到實際的值
+        await shadow.refresh()
+        return f"Pattern '{devices.pattern.name}' is stopped"
+    except Exception as e:
+        traceback.print_exc()
+        return (
+            f"❌ Stop pattern error, error log as below:\n"
+            f"```\n{e}\n```\n\n"
+            )
+
+
+@tool(name="get_pattern_status", description="Get the uploaded pattern and whether the Arduino is playing it.")
+async def get_pattern_status() -> str:
+    """
+    Get the uploaded pattern and its playback state on each board: whether it is running, the current step, the finished loops,
+    and the lights it still drives (lights written by other tools leave the pattern).
+    """
+    try:
+        program = devices.pattern
+        if program is None:
+            return "No pattern has been uploaded."
+        statuses = []
+        for device, (running, step_count, step, loop, _loops, mask) in await shadow.read_pattern():
+            if not running:
+                # 播放完或被停止的 pattern 不再改變亮度，恢復一般的 reconcile
+                light_ids = [device.offset + light_id for light_id in device.pattern.light_ids]
+                coalescer.pattern_stopped(light_ids)
+                shadow.pattern_stopped(light_ids)
+            statuses.append(
+                PatternDeviceStatus(
+                    name=device.name,
+                    running=bool(running),
+                    step=step,
+                    step_count=step_count,
+                    loop=loop,
+                    light_ids=_pattern_lights(device, mask),
+                )
+            )
+        output = PatternStatusOutput(
+            name=program.name,
+            loops=program.loops,
+            period_ms=program.period_ms,
+            light_ids=program.light_ids,
+            devices=statuses,
+        )
+        return output.model_dump_json()
+    except Exception as e:
+        traceback.print_exc()
+        return (
+            f"❌ Get pattern status error, error log as below:\n"
+            f"```\n{e}\n```\n\n"
+            )
+
+def _http_app(transports: List[str]) -> Starlette:
+    """
+    建立 HTTP transport 的 ASGI app。同時開啟 streamable HTTP 與 SSE 時放在同一個 app 中（`/mcp` 與 `/sse`、`/messages/`），
+    共用同一個 port 與 `/metrics`。
+    """
+    if "streamable-http" not in transports:
+        return mcp.sse_app()
+    app = mcp.streamable_http_app()
+    if "sse" in transports:
+        paths = {route.path for route in app.routes}
+        app.router.routes.extend(route for route in mcp.sse_app().routes if route.path not in paths)
+    return app
+
+
+async def _serve(transports: List[str], host: str, port: int):
+    """
+    在同一個 event loop 上執行所有 transport。
+
+    所有 transport 的工具呼叫都經過同一組 `DeviceRegistry` 與每塊板子唯一的 `SerialEngine` owner task，
+    不會有兩個行程或兩個 event loop 同時開啟同一個序列埠；任何一個 transport 結束（例如 stdio 的 client 關閉 stdin）時整個伺服器隨之結束。
+    """
+    tasks = []
+    server = None
+    if "streamable-http" in transports or "sse" in transports:
+        log_config = uvicorn.config.LOGGING_CONFIG
+        if "stdio" in transports:
+            # uvicorn 預設把 access log 輸出到 stdout，會混進 stdio 的 MCP 訊息
+            log_config = copy.deepcopy(log_config)
+            log_config["handlers"]["access"]["stream"] = "ext://sys.stderr"
+        server = uvicorn.Server(uvicorn.Config(_http_app(transports), host=host, port=port, log_config=log_config))
+        tasks.append(asyncio.create_task(server.serve(), name="http"))
+    if "stdio" in transports:
+        # stdout 是 MCP 訊息的通道，日誌（logging 與 traceback）都輸出到 stderr
+        tasks.append(asyncio.create_task(mcp.run_stdio_async(), name="stdio"))
+    done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    logger.info(f"Transport {', '.join(task.get_name() for task in done)} stopped, shutting down the server")
+    if server is not None:
+        server.should_exit = True
+    for task in pending:
+        if task.get_name() == "stdio":
+            task.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
+    for task in done:
+        task.result()
+
+
 if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description="Run MCP Streamable HTTP based server")
+    parser = argparse.ArgumentParser(description="Run MCP server over Streamable HTTP, SSE and/or stdio")
     parser.add_argument("--host", type=str, default="127.0.0.1", help="Host IP to listen on")
     parser.add_argument("--port", type=int, default=2828, help="Port to listen on")
+    parser.add_argument(
+        "--transport", nargs="+", choices=TRANSPORTS, default=DEFAULT_TRANSPORTS,
+        help="Transports to serve, several transports run in the same process and share the Arduino connections (e.g. --transport stdio streamable-http)",
+    )
+    parser.add_argument(
+        "--stateless", action="store_true", default=STATELESS_HTTP,
+        help="Serve each request on its own without MCP sessions and reply with plain JSON instead of SSE (resource subscriptions are not available)",
+    )
     args = parser.parse_args()
+    transports = list(dict.fromkeys(args.transport))
+    unknown = [transport for transport in transports if transport not in TRANSPORTS]
+    if unknown:
+        parser.error(f"Unknown transport {', '.join(unknown)}, expected {', '.join(TRANSPORTS)}")
+
+    if args.stateless:
+        # 每個請求獨立處理：不需要 initialize 建立的 session，也不經過 SSE 包裝，適合每次對話都開新 session 的 gateway
+        mcp.settings.stateless_http = True
+        mcp.settings.json_response = True
+        logger.info("Serving MCP in stateless JSON response mode")
 
-    # Start the server with Streamable HTTP transport
-    uvicorn.run(mcp.streamable_http_app, host=args.host, port=args.port)
\ No newline at end of file
+    logger.info(f"Serving MCP over {', '.join(transports)}")
+    asyncio.run(_serve(transports, args.host, args.port))
\ No newline at end of file
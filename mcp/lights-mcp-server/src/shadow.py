@@ -0,0 +1,276 @@
+import asyncio, contextvars, logging, math, time
+from typing import Callable, Dict, List, Optional, Set
+
+import numpy as np
+
+from .framebuffer import FrameBuffer
+from .history import BrightnessHistory
+
+logger = logging.getLogger(__name__)
+
+
+class ShadowState:
+    """
+    燈光狀態的 in-process 影子快取（write-through）。
+
+    所有亮度寫入都經過這裡：先寫到 Arduino，成功後同步更新記憶體中的亮度（0-255，保存在 `FrameBuffer`），
+    狀態與燈數查詢因此可以直接從記憶體回答，不需要每次都佔用序列埠。
+    背景的 reconcile task 會定期向 Arduino 讀回實際狀態，修正可能的偏差（例如 Arduino 被重置）。
+
+    Args:
+        engine: `SerialEngine`，實際與 Arduino 溝通的物件。
+        led_count (int, optional): 尚未向 Arduino 查詢前預設的燈數，預設為 3。
+        reconcile_interval (float, optional): 背景 reconcile 的間隔秒數，`0` 表示停用，預設為 30 秒。
+        history (Optional[BrightnessHistory], optional): 記錄快取中亮度變化的歷史（寫入、reconcile 讀回與 Arduino 主動回報），
+            漸變記錄為開始時就到達目標值；None 表示不記錄，預設為 None。
+    """
+
+    def __init__(self, engine, led_count: int = 3, reconcile_interval: float = 30.0, history: Optional[BrightnessHistory] = None):
+        self.engine = engine
+        self.led_count = led_count
+        self.reconcile_interval = reconcile_interval
+        self.frame = FrameBuffer(led_count)
+        self.history = history
+        # 最後一次與 Arduino 同步的時間，None 表示還沒讀過實際狀態
+        self.synced_at: Optional[float] = None
+        self.count_synced_at: Optional[float] = None
+
+        self._written_during_refresh: Optional[Set[int]] = None
+        # 正在由 Arduino 漸變的燈與預計結束時間，快取中保存的是漸變的目標值
+        self._fading_until: Dict[int, float] = {}
+        # 快取中的亮度改變時呼叫：listener(改變的燈號列表)，用於推送通知
+        self.listeners: List[Callable[[List[int]], None]] = []
+        self._refresh_lock: Optional[asyncio.Lock] = None
+        self._reconcile_task: Optional[asyncio.Task] = None
+
+    # ---------- write-through ----------
+
+    def _notify(self, light_ids: List[int]):
+        if not light_ids:
+            return
+        if self.history is not None:
+            self.history.record(light_ids, self.frame.pixels[light_ids])
+        for listener in self.listeners:
+            try:
+                listener(light_ids)
+            except Exception as e:
+                logger.warning(f"Notify light state change error: {e}")
+
+    def _record(self, light_id: int, value_255: int):
+        if light_id >= len(self.frame):
+            self.frame.resize(light_id + 1)
+        if self.frame.pixels[light_id] != value_255:
+            self.frame.pixels[light_id] = value_255
+            self._notify([light_id])
+        self._fading_until.pop(light_id, None)
+        if self._written_during_refresh is not None:
+            self._written_during_refresh.add(light_id)
+
+    def overridden(self, start: int = 0, stop: Optional[int] = None) -> List[int]:
+        """
+        目前由 Arduino 自行改變亮度（漸變中或由 pattern 控制）的燈，快取中的值不代表燈的實際亮度。
+
+        只寫入與快取不同的燈時，必須一併寫入這些燈，否則與快取相同的值會被略過，燈仍停留在漸變或 pattern 中。
+
+        Args:
+            start (int, optional): 第一顆燈的 ID，預設為 0。
+            stop (Optional[int], optional): 最後一顆燈的 ID + 1，預設為不限。
+        """
+        now = time.monotonic()
+        return sorted(
+            light_id for light_id, until in self._fading_until.items()
+            if until > now and light_id >= start and (stop is None or light_id < stop)
+        )
+
+    async def set_brightness(self, light_id: int, value_255: int):
+        """寫入單顆燈的 PWM 值並更新快取。"""
+        await self.engine.set_brightness(light_id, value_255)
+        self._record(light_id, value_255)
+
+    async def set_brightness_batch(self, values: Dict[int, int]):
+        """以單一 frame 寫入多顆燈的 PWM 值並更新快取。"""
+        await self.engine.set_brightness_batch(values)
+        for light_id, value_255 in values.items():
+            self._record(light_id, value_255)
+
+    async def set_brightness_confirm(self, values: Dict[int, int]) -> Dict[int, int]:
+        """
+        寫入多顆燈的 PWM 值，並以 Arduino 回報的實際亮度更新快取。
+
+        Returns:
+            Dict[int, int]: 燈號對應 Arduino 上實際的 PWM 值（0-255）。
+        """
+        confirmed = await self.engine.set_brightness_confirm(values)
+        for light_id, value_255 in confirmed.items():
+            self._record(light_id, value_255)
+        return confirmed
+
+    async def set_frame(self, start: int, values: np.ndarray) -> int:
+        """
+        寫入從 `start` 開始的一段 PWM 值，只把與快取不同的燈送到 Arduino。
+
+        漸變中或由 pattern 控制的燈即使快取中的值相同也會送出，確保明確寫入的值取代 Arduino 自行產生的變化。
+
+        Args:
+            start (int): 第一顆燈的 ID。
+            values (np.ndarray): uint8 PWM 值。
+
+        Returns:
+            int: 實際送出的燈數。
+        """
+        stop = start + len(values)
+        if stop > len(self.frame):
+            self.frame.resize(stop)
+        changed = self.frame.diff(start, values)
+        overridden = self.overridden(start, stop)
+        if overridden:
+            changed = np.union1d(changed, overridden).astype(np.intp)
+        if not len(changed):
+            return 0
+        pixels = self.frame.get()
+        pixels[start:stop] = values
+        await self.engine.set_frame(pixels, changed)
+        if len(self.frame) < stop:
+            self.frame.resize(stop)
+        self.frame.pixels[changed] = pixels[changed]
+        light_ids = changed.tolist()
+        for light_id in light_ids:
+            self._fading_until.pop(light_id, None)
+        if self._written_during_refresh is not None:
+            self._written_during_refresh.update(light_ids)
+        self._notify(light_ids)
+        return len(light_ids)
+
+    async def fade(self, light_id: int, value_255: int, duration_ms: int):
+        """讓 Arduino 自行漸變到指定的 PWM 值；快取直接記錄目標值，漸變結束前的 reconcile 不會把中間值當成偏差。"""
+        await self.engine.fade(light_id, value_255, duration_ms)
+        self._record(light_id, value_255)
+        self._fading_until[light_id] = time.monotonic() + duration_ms / 1000
+
+    async def upload_pattern(self, program):
+        """上傳 pattern 程式（經過寫入合併層與指令日誌），回傳收到程式的板子；快取的標記由呼叫端在開始或停止播放時設定。"""
+        return await self.engine.upload_pattern(program)
+
+    async def run_pattern(self, start: bool):
+        """開始或停止播放已上傳的 pattern。"""
+        return await self.engine.run_pattern(start)
+
+    async def read_pattern(self):
+        """查詢各板子的 pattern 播放狀態。"""
+        return await self.engine.read_pattern()
+
+    def pattern_started(self, light_ids: List[int]):
+        """Arduino 開始播放 pattern：這些燈由 Arduino 自行改變亮度，直到 pattern 停止或燈被重新寫入前，reconcile 都不把讀到的值當成偏差。"""
+        for light_id in light_ids:
+            self._fading_until[light_id] = math.inf
+
+    def pattern_stopped(self, light_ids: List[int]):
+        """pattern 已停止，這些燈恢復一般的 reconcile；停止時的亮度由 Arduino 的主動回報或下一次 `refresh()` 更新。"""
+        for light_id in light_ids:
+            if self._fading_until.get(light_id) == math.inf:
+                del self._fading_until[light_id]
+
+    def apply_device_change(self, light_id: int, value_255: int):
+        """Arduino 主動回報的亮度變化（例如漸變結束），直接更新快取。"""
+        self._record(light_id, value_255)
+
+    # ---------- 讀取 ----------
+
+    async def get_brightness(self, force_refresh: bool = False) -> List[int]:
+        """
+        取得所有燈的 PWM 值（0-255）。
+
+        Args:
+            force_refresh (bool, optional): 為 True 時一定向 Arduino 讀取；否則只有在從未同步過時才讀取。
+        """
+        return (await self.get_frame(0, self.led_count, force_refresh)).tolist()
+
+    async def get_frame(self, start: int = 0, stop: Optional[int] = None, force_refresh: bool = False) -> np.ndarray:
+        """
+        取得一段燈的 PWM 值（0-255），直接回傳 uint8 陣列，適合燈數很多時只讀取需要的範圍。
+
+        Args:
+            start (int, optional): 第一顆燈的 ID，預設為 0。
+            stop (Optional[int], optional): 最後一顆燈的 ID + 1，預設為目前的燈數。
+            force_refresh (bool, optional): 為 True 時一定向 Arduino 讀取；否則只有在從未同步過時才讀取。
+        """
+        self.ensure_reconciling()
+        stop = self.led_count if stop is None else min(stop, self.led_count)
+        if force_refresh or self.synced_at is None:
+            return np.asarray(await self.refresh(), dtype=np.uint8)[start:stop]
+        return self.frame.get(start, stop)
+
+    async def get_led_count(self, force_refresh: bool = False) -> int:
+        self.ensure_reconciling()
+        if force_refresh or self.count_synced_at is None:
+            await self.refresh_count()
+        return self.led_count
+
+    async def refresh(self) -> List[int]:
+        """向 Arduino 讀回實際亮度並覆寫快取；讀取期間被寫入的燈以新寫入的值為準，漸變中的燈快取保留目標值。"""
+        if self._refresh_lock is None:
+            self._refresh_lock = asyncio.Lock()
+        async with self._refresh_lock:
+            self._written_during_refresh = set()
+            try:
+                status = await self.engine.read_status()
+            finally:
+                written, self._written_during_refresh = self._written_during_refresh, None
+
+            # 仍在漸變中的燈，快取保留目標值，但回傳讀到的當下亮度
+            now = time.monotonic()
+            fading = {i for i, until in self._fading_until.items() if until > now}
+            status = np.asarray(status, dtype=np.uint8)
+            cached = self.frame.pixels
+            common = min(len(status), len(cached))
+            kept = np.array(sorted(i for i in written | fading if i < common), dtype=np.intp)
+            if self.synced_at is not None:
+                mismatch = cached[:common] != status[:common]
+                mismatch[kept] = False
+                drifted = np.flatnonzero(mismatch).tolist()
+                if drifted:
+                    logger.warning(f"Shadow state drifted on lights {drifted}, corrected from Arduino")
+
+            merged = status.copy()
+            merged[kept] = cached[kept]
+            live = merged.copy()
+            still_fading = np.array(sorted(i for i in fading - written if i < common), dtype=np.intp)
+            live[still_fading] = status[still_fading]
+            changed = self.frame.load(merged)
+            if self.history is not None:
+                # 第一次讀回時記錄所有燈的值（歷史會略過沒有變化的燈），之後的統計才知道一開始就熄滅的燈
+                self.history.record(np.arange(len(merged)), merged)
+            self._notify(changed.tolist())
+            self.synced_at = time.time()
+            return live.tolist()
+
+    async def refresh_count(self) -> int:
+        count = await self.engine.read_info()
+        if count != self.led_count:
+            logger.info(f"Light count changed from {self.led_count} to {count}")
+        self.led_count = count
+        if len(self.frame) < count:
+            self.frame.resize(count)
+        self.count_synced_at = time.time()
+        return count
+
+    # ---------- 背景 reconcile ----------
+
+    def ensure_reconciling(self):
+        """在目前的 event loop 上啟動背景 reconcile task（僅啟動一次）。"""
+        if self.reconcile_interval <= 0:
+            return
+        if self._reconcile_task is None or self._reconcile_task.done():
+            # 以空的 context 執行，背景讀取不會沿用第一次觸發它的工具呼叫的 contextvars（例如指令日誌中的工具名稱）
+            self._reconcile_task = asyncio.get_running_loop().create_task(self._reconcile_loop(), name="shadow-reconcile", context=contextvars.Context())
+
+    async def _reconcile_loop(self):
+        while True:
+            await asyncio.sleep(self.reconcile_interval)
+            try:
+                await self.refresh_count()
+                await self.refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Reconcile shadow state with Arduino failed: {e}")
@@ -0,0 +1,695 @@
+import argparse, asyncio, errno, logging, os, random, re, termios, time, tty
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from .protocol import (
+    FRAME_START, MAX_PAYLOAD, PROTOCOL_VERSION, ErrorCode, Opcode, crc8, encode_frame,
+)
+from .patterns import MAX_PATTERN_LIGHTS, MAX_PATTERN_STEPS, STEP_RAMP
+
+logger = logging.getLogger(__name__)
+
+READY_BANNER = b"Arduino Ready.\r\n"
+# 與韌體相同：ASCII 指令緩衝區 96 bytes（含結尾的 '\0'），frame 中途停頓 50ms 就丟棄
+LINE_BUFFER_SIZE = 96
+FRAME_TIMEOUT = 0.05
+
+
+def _to_int(text: str) -> int:
+    """模擬 Arduino `String.toInt()`：解析開頭的整數，無法解析時為 0。"""
+    match = re.match(r"\s*[-+]?\d+", text)
+    return int(match.group()) if match else 0
+
+
+class VirtualArduino:
+    """
+    `led_serial_port_control.ino` 的 Python 模擬，逐位元組處理輸入，行為與韌體一致：
+
+    * ASCII 指令：`<id,val>`、`<id,val;id,val>`（全部合法才一次套用）、`<id,val,ms>`（漸變）、`r1`/`r0`、`s`、`i`、`v`。
+    * 二進位 frame（`binary=True` 時）：SET、BATCH、FADE、MASK、REPORT、STATUS、INFO，錯誤時回傳錯誤 frame。
+    * 序號 frame（SEQ）：只處理序號等於預期值的 frame 並回覆 ACK，較舊的重複 frame 只重新確認、較新的（前面有遺失）直接丟棄；SYNC 設定預期序號。
+    * Pattern：上傳的步驟依時間自行播放，播放中的燈不回報漸變結束；Host 寫入某顆燈時，該燈離開 pattern。
+    * 大量燈：RUNS（連續區段）與 SPARSE（點陣圖）以 16 位元燈號寫入，STATUS_RANGE 分段讀取；燈數超過 255 時 INFO 以 uint16 回報。
+    * 寫入並確認（SET_CONFIRM）：全部合法才一次套用，再以 CONFIRM_REPLY 回覆每顆燈套用後的亮度。
+    * 開啟主動回報後，漸變結束時以開啟時使用的協定送出 `C,id,val` 或 CHANGE frame。
+
+    不處理時間與傳輸，`receive()` 回傳 Arduino 這時會送出的位元組，由 `SimulatedLink` 決定何時送出。
+
+    Args:
+        led_count (int, optional): 燈數，預設為 3。
+        binary (bool, optional): 是否支援二進位協定，`False` 時模擬不回應 `v` 的舊韌體，預設為 True。
+    """
+
+    def __init__(self, led_count: int = 3, binary: bool = True):
+        self.led_count = led_count
+        self.binary = binary
+        self.brightness: List[int] = [0] * led_count
+        # 已處理的指令數（ASCII 行與二進位 frame），用於統計
+        self.commands = 0
+        self.reset()
+
+    def reset(self):
+        """模擬 Arduino 重置：所有燈熄滅，清空解析狀態。"""
+        self.brightness = [0] * self.led_count
+        # 漸變中的燈：(起始值, 目標值, 開始時間, 秒數)，讀取狀態時依時間內插，與韌體用 millis() 計算相同
+        self._fades: Dict[int, Tuple[int, int, float, float]] = {}
+        # 主動回報模式：None（關閉）、"ascii" 或 "binary"，以及尚未送出的回報
+        self._report_mode: Optional[str] = None
+        self._outbox = bytearray()
+        self._line = bytearray()
+        self._frame: Optional[bytearray] = None
+        self._frame_started_at = 0.0
+        self._now = time.monotonic()
+        # 下一個要處理的序號
+        self._expected_seq = 0
+        # pattern：每個步驟為 (旗標, 毫秒, 燈的遮罩, 燈號對應 PWM 值)
+        self._pattern_steps: List[Tuple[int, int, int, Dict[int, int]]] = []
+        self._pattern_loops = 0
+        self._pattern_running = False
+        self._pattern_step = 0
+        self._pattern_loop = 0
+        self._pattern_step_started_at = 0.0
+        # 目前由 pattern 控制的燈
+        self._pattern_lights = 0
+
+    # ---------- 輸入 ----------
+
+    def receive(self, data: bytes, now: Optional[float] = None) -> bytes:
+        now = time.monotonic() if now is None else now
+        self._now = now
+        out = bytearray(self.poll(now))
+        for byte in data:
+            if self._frame is not None:
+                out += self._feed_frame(byte)
+            elif byte == FRAME_START and self.binary:
+                self._frame = bytearray()
+                self._frame_started_at = now
+            elif byte == ord("\n"):
+                line, self._line = self._line.decode("latin-1").strip(), bytearray()
+                out += self._process_command(line)
+            elif len(self._line) < LINE_BUFFER_SIZE - 1:
+                self._line.append(byte)
+        out += self._outbox
+        self._outbox = bytearray()
+        return bytes(out)
+
+    def poll(self, now: Optional[float] = None) -> bytes:
+        """推進漸變並送出主動回報；不完整的 frame 逾時後丟棄並回報長度錯誤，與韌體 `loop()` 結尾的檢查相同。"""
+        now = time.monotonic() if now is None else now
+        self._now = now
+        self._update_pattern(now)
+        self._update_fades(now)
+        out, self._outbox = bytes(self._outbox), bytearray()
+        if self._frame is not None and now - self._frame_started_at > FRAME_TIMEOUT:
+            opcode = self._frame[0] if self._frame else 0
+            self._frame = None
+            return out + self._error(ErrorCode.LENGTH, opcode)
+        return out
+
+    # ---------- 亮度與漸變 ----------
+
+    def _set(self, light_id: int, value: int):
+        # Host 寫入的燈離開 pattern，以下同
+        self._release_pattern_light(light_id)
+        self._write(light_id, value)
+
+    def _write(self, light_id: int, value: int):
+        self._fades.pop(light_id, None)
+        self.brightness[light_id] = value
+
+    def _start_fade(self, light_id: int, target: int, duration_ms: int):
+        self._release_pattern_light(light_id)
+        self._begin_fade(light_id, target, duration_ms / 1000, self._now)
+
+    def _begin_fade(self, light_id: int, target: int, duration: float, started_at: float):
+        if duration <= 0:
+            self._write(light_id, target)
+            return
+        self._update_fades(self._now)
+        self._fades[light_id] = (self.brightness[light_id], target, started_at, duration)
+
+    def _update_fades(self, now: float):
+        for light_id, (start, target, started_at, duration) in list(self._fades.items()):
+            elapsed = now - started_at
+            if elapsed >= duration:
+                self.brightness[light_id] = target
+                del self._fades[light_id]
+                # pattern 中的漸變結束不回報，播放期間不產生任何序列埠流量
+                if not self._pattern_lights >> light_id & 1:
+                    self._report(light_id, target)
+            else:
+                self.brightness[light_id] = start + int((target - start) * elapsed / duration)
+
+    def _report(self, light_id: int, value: int):
+        if self._report_mode == "ascii":
+            self._outbox += f"C,{light_id},{value}\r\n".encode("utf-8")
+        elif self._report_mode == "binary":
+            self._outbox += encode_frame(Opcode.CHANGE, bytes([light_id, value]))
+
+    # ---------- pattern ----------
+
+    def _update_pattern(self, now: float):
+        # 與韌體相同，下一個步驟從上一個步驟預定的結束時間起算，不會累積延遲
+        while self._pattern_running:
+            _, duration_ms, _, _ = self._pattern_steps[self._pattern_step]
+            if now - self._pattern_step_started_at < duration_ms / 1000:
+                return
+            self._pattern_step_started_at += duration_ms / 1000
+            self._pattern_step += 1
+            if self._pattern_step >= len(self._pattern_steps):
+                self._pattern_step = 0
+                self._pattern_loop += 1
+                if self._pattern_loops and self._pattern_loop >= self._pattern_loops:
+                    self._stop_pattern()
+                    return
+            self._enter_pattern_step()
+
+    def _enter_pattern_step(self):
+        flags, duration_ms, mask, values = self._pattern_steps[self._pattern_step]
+        for light_id, value in values.items():
+            if not self._pattern_lights >> light_id & 1:
+                continue
+            if flags & STEP_RAMP:
+                self._begin_fade(light_id, value, duration_ms / 1000, self._pattern_step_started_at)
+            else:
+                self._write(light_id, value)
+
+    def _start_pattern(self):
+        self._pattern_lights = 0
+        for _, _, mask, _ in self._pattern_steps:
+            self._pattern_lights |= mask
+        self._pattern_running = True
+        self._pattern_step = 0
+        self._pattern_loop = 0
+        self._pattern_step_started_at = self._now
+        self._enter_pattern_step()
+
+    def _stop_pattern(self):
+        """停止播放：燈停在當下的亮度，並回報每顆 pattern 中的燈的最後亮度。"""
+        self._update_fades(self._now)
+        self._pattern_running = False
+        lights, self._pattern_lights = self._pattern_lights, 0
+        for light_id in range(self.led_count):
+            if lights >> light_id & 1:
+                self._fades.pop(light_id, None)
+                self._report(light_id, self.brightness[light_id])
+
+    def _release_pattern_light(self, light_id: int):
+        self._pattern_lights &= ~(1 << light_id)
+        if self._pattern_running and not self._pattern_lights:
+            self._pattern_running = False
+
+    def _process_pattern_frame(self, opcode: int, length: int, payload: bytes) -> bytes:
+        if opcode == Opcode.PATTERN_BEGIN:
+            if length != 3:
+                return self._error(ErrorCode.LENGTH, opcode)
+            if payload[0] > MAX_PATTERN_STEPS:
+                return self._error(ErrorCode.RANGE, opcode)
+            if self._pattern_running:
+                self._stop_pattern()
+            self._pattern_steps = [(0, 0, 0, {}) for _ in range(payload[0])]
+            self._pattern_loops = int.from_bytes(payload[1:3], "little")
+            return b""
+        if opcode == Opcode.PATTERN_STEP:
+            if length < 6:
+                return self._error(ErrorCode.LENGTH, opcode)
+            index, flags = payload[0], payload[1]
+            duration_ms = int.from_bytes(payload[2:4], "little")
+            mask = int.from_bytes(payload[4:6], "little")
+            light_ids = [light_id for light_id in range(MAX_PATTERN_LIGHTS) if mask >> light_id & 1]
+            if length != 6 + len(light_ids):
+                return self._error(ErrorCode.LENGTH, opcode)
+            if index >= len(self._pattern_steps) or (light_ids and light_ids[-1] >= self.led_count):
+                return self._error(ErrorCode.RANGE, opcode)
+            self._pattern_steps[index] = (flags, duration_ms, mask, dict(zip(light_ids, payload[6:])))
+            return b""
+        if opcode == Opcode.PATTERN_RUN:
+            if length != 1:
+                return self._error(ErrorCode.LENGTH, opcode)
+            if payload[0]:
+                if not self._pattern_steps:
+                    return self._error(ErrorCode.RANGE, opcode)
+                self._start_pattern()
+            elif self._pattern_running:
+                self._stop_pattern()
+            return b""
+        # PATTERN_QUERY
+        self._update_pattern(self._now)
+        return encode_frame(
+            Opcode.PATTERN_REPLY,
+            bytes([int(self._pattern_running), len(self._pattern_steps), self._pattern_step])
+            + self._pattern_loop.to_bytes(2, "little")
+            + self._pattern_loops.to_bytes(2, "little")
+            + self._pattern_lights.to_bytes(2, "little"),
+        )
+
+    # ---------- ASCII 指令 ----------
+
+    def _process_command(self, command: str) -> bytes:
+        if command.startswith("<") and command.endswith(">") and len(command) >= 2:
+            self.commands += 1
+            body = command[1:-1]
+            if ";" in body:
+                self._apply_batch(body)
+                return b""
+            comma = body.find(",")
+            if comma > 0:
+                light_id, value = _to_int(body[:comma]), _to_int(body[comma + 1:])
+                second_comma = body.find(",", comma + 1)
+                if 0 <= light_id < self.led_count:
+                    if second_comma > 0:
+                        value = _to_int(body[comma + 1:second_comma])
+                        duration_ms = max(0, min(65535, _to_int(body[second_comma + 1:])))
+                        self._start_fade(light_id, max(0, min(255, value)), duration_ms)
+                    else:
+                        self._set(light_id, max(0, min(255, value)))
+            return b""
+        if command == "s":
+            self.commands += 1
+            self._update_fades(self._now)
+            return ("S," + ",".join(str(value) for value in self.brightness) + "\r\n").encode("utf-8")
+        if command == "i":
+            self.commands += 1
+            return f"I,{self.led_count}\r\n".encode("utf-8")
+        if command.startswith("m") and self.binary:
+            # m<遮罩(16 進位)>,<val>
+            self.commands += 1
+            comma = command.find(",")
+            if comma > 1:
+                try:
+                    mask = int(command[1:comma], 16)
+                except ValueError:
+                    mask = 0
+                self._apply_mask(mask, max(0, min(255, _to_int(command[comma + 1:]))))
+            return b""
+        if command in ("r1", "r0"):
+            self.commands += 1
+            self._report_mode = "ascii" if command == "r1" else None
+            return b""
+        if command == "v" and self.binary:
+            self.commands += 1
+            return f"V,{PROTOCOL_VERSION}\r\n".encode("utf-8")
+        return b""
+
+    def _apply_batch(self, body: str):
+        pending = {}
+        pairs = body.split(";")
+        # 與韌體相同，結尾的 ';' 不會產生空的一組
+        if pairs[-1] == "":
+            pairs.pop()
+        for pair in pairs:
+            comma = pair.find(",")
+            if comma <= 0:
+                return
+            light_id = _to_int(pair[:comma])
+            if not 0 <= light_id < self.led_count:
+                return
+            pending[light_id] = max(0, min(255, _to_int(pair[comma + 1:])))
+        for light_id, value in pending.items():
+            self._set(light_id, value)
+
+    def _apply_mask(self, mask: int, value: int):
+        # 與韌體相同，超出燈數的位元直接忽略，全部位元設為 1 即為廣播
+        for light_id in range(self.led_count):
+            if mask >> light_id & 1:
+                self._set(light_id, value)
+
+    # ---------- 二進位 frame ----------
+
+    def _feed_frame(self, byte: int) -> bytes:
+        frame = self._frame
+        frame.append(byte)
+        if len(frame) == 2 and frame[1] > MAX_PAYLOAD:
+            self._frame = None
+            return self._error(ErrorCode.LENGTH, frame[0])
+        if len(frame) < 2 or len(frame) < 2 + frame[1] + 1:
+            return b""
+        self._frame = None
+        opcode, length, payload, crc = frame[0], frame[1], bytes(frame[2:-1]), frame[-1]
+        if crc8(bytes(frame[:-1])) != crc:
+            return self._error(ErrorCode.CRC, opcode)
+        self.commands += 1
+        return self._process_frame(opcode, length, payload)
+
+    def _process_frame(self, opcode: int, length: int, payload: bytes) -> bytes:
+        if opcode == Opcode.SEQ:
+            return self._process_seq_frame(length, payload)
+        if opcode == Opcode.SYNC:
+            if length != 1:
+                return self._error(ErrorCode.LENGTH, opcode)
+            self._expected_seq = payload[0]
+            return encode_frame(Opcode.SYNC_REPLY, bytes([self._expected_seq]))
+        if opcode in (Opcode.PATTERN_BEGIN, Opcode.PATTERN_STEP, Opcode.PATTERN_RUN, Opcode.PATTERN_QUERY):
+            return self._process_pattern_frame(opcode, length, payload)
+        if opcode == Opcode.SET:
+            if length != 2:
+                return self._error(ErrorCode.LENGTH, opcode)
+            if payload[0] >= self.led_count:
+                return self._error(ErrorCode.RANGE, opcode)
+            self._set(payload[0], payload[1])
+            return b""
+        if opcode == Opcode.BATCH:
+            if length == 0 or length % 2:
+                return self._error(ErrorCode.LENGTH, opcode)
+            if any(light_id >= self.led_count for light_id in payload[::2]):
+                return self._error(ErrorCode.RANGE, opcode)
+            for light_id, value in zip(payload[::2], payload[1::2]):
+                self._set(light_id, value)
+            return b""
+        if opcode == Opcode.FADE:
+            if length != 4:
+                return self._error(ErrorCode.LENGTH, opcode)
+            if payload[0] >= self.led_count:
+                return self._error(ErrorCode.RANGE, opcode)
+            self._start_fade(payload[0], payload[1], int.from_bytes(payload[2:4], "little"))
+            return b""
+        if opcode == Opcode.MASK:
+            if length < 2:
+                return self._error(ErrorCode.LENGTH, opcode)
+            self._apply_mask(int.from_bytes(payload[1:], "little"), payload[0])
+            return b""
+        if opcode == Opcode.REPORT:
+            if length != 1:
+                return self._error(ErrorCode.LENGTH, opcode)
+            self._report_mode = "binary" if payload[0] else None
+            return b""
+        if opcode in (Opcode.RUNS, Opcode.SPARSE, Opcode.STATUS_RANGE):
+            return self._process_strip_frame(opcode, length, payload)
+        if opcode == Opcode.SET_CONFIRM:
+            if length == 0 or length % 3:
+                return self._error(ErrorCode.LENGTH, opcode)
+            light_ids = [int.from_bytes(payload[offset:offset + 2], "little") for offset in range(0, length, 3)]
+            if any(light_id >= self.led_count for light_id in light_ids):
+                return self._error(ErrorCode.RANGE, opcode)
+            for light_id, value in zip(light_ids, payload[2::3]):
+                self._set(light_id, value)
+            return encode_frame(Opcode.CONFIRM_REPLY, b"".join(
+                light_id.to_bytes(2, "little") + bytes([self.brightness[light_id]]) for light_id in light_ids
+            ))
+        if opcode == Opcode.STATUS:
+            if self.led_count > MAX_PAYLOAD:
+                # 一個回應放不下所有燈，Host 應該改用 STATUS_RANGE
+                return self._error(ErrorCode.LENGTH, opcode)
+            self._update_fades(self._now)
+            return encode_frame(Opcode.STATUS_REPLY, bytes(self.brightness))
+        if opcode == Opcode.INFO:
+            return encode_frame(Opcode.INFO_REPLY, self.led_count.to_bytes(2 if self.led_count > 0xFF else 1, "little"))
+        return self._error(ErrorCode.OPCODE, opcode)
+
+    def _process_strip_frame(self, opcode: int, length: int, payload: bytes) -> bytes:
+        if opcode == Opcode.RUNS:
+            # 先檢查所有區段，全部合法才一次套用
+            runs = []
+            offset = 0
+            while offset < length:
+                if offset + 3 > length:
+                    return self._error(ErrorCode.LENGTH, opcode)
+                start, count = int.from_bytes(payload[offset:offset + 2], "little"), payload[offset + 2]
+                if count == 0 or offset + 3 + count > length:
+                    return self._error(ErrorCode.LENGTH, opcode)
+                if start + count > self.led_count:
+                    return self._error(ErrorCode.RANGE, opcode)
+                runs.append((start, payload[offset + 3:offset + 3 + count]))
+                offset += 3 + count
+            if not runs:
+                return self._error(ErrorCode.LENGTH, opcode)
+            for start, values in runs:
+                for index, value in enumerate(values):
+                    self._set(start + index, value)
+            return b""
+        if opcode == Opcode.SPARSE:
+            if length < 3 or length < 3 + payload[2]:
+                return self._error(ErrorCode.LENGTH, opcode)
+            base, bitmap = int.from_bytes(payload[0:2], "little"), payload[3:3 + payload[2]]
+            light_ids = [base + bit for bit in range(len(bitmap) * 8) if bitmap[bit >> 3] & (1 << (bit & 7))]
+            values = payload[3 + len(bitmap):]
+            if not light_ids or len(values) != len(light_ids):
+                return self._error(ErrorCode.LENGTH, opcode)
+            if light_ids[-1] >= self.led_count:
+                return self._error(ErrorCode.RANGE, opcode)
+            for light_id, value in zip(light_ids, values):
+                self._set(light_id, value)
+            return b""
+        # STATUS_RANGE
+        if length != 3:
+            return self._error(ErrorCode.LENGTH, opcode)
+        start, count = int.from_bytes(payload[0:2], "little"), payload[2]
+        if count == 0 or count > MAX_PAYLOAD - 2 or start + count > self.led_count:
+            return self._error(ErrorCode.RANGE, opcode)
+        self._update_fades(self._now)
+        return encode_frame(Opcode.STATUS_RANGE_REPLY, start.to_bytes(2, "little") + bytes(self.brightness[start:start + count]))
+
+    def _process_seq_frame(self, length: int, payload: bytes) -> bytes:
+        if length < 2:
+            return self._error(ErrorCode.LENGTH, Opcode.SEQ)
+        seq, opcode = payload[0], payload[1]
+        ahead = (seq - self._expected_seq) & 0xFF
+        if ahead >= 0x80:
+            # 確認遺失而重送的舊 frame：已經處理過，只重新確認
+            return encode_frame(Opcode.ACK, bytes([seq, 0]))
+        if ahead:
+            # 前面的 frame 遺失，等 Host 從遺失的那個開始重送
+            return b""
+        self._expected_seq = (seq + 1) & 0xFF
+        reply = self._process_frame(opcode, length - 2, payload[2:])
+        # 錯誤以 ACK 的結果欄位回報，查詢的回應照常送出
+        if reply[1:2] == bytes([Opcode.ERROR]):
+            return encode_frame(Opcode.ACK, bytes([seq, reply[3]]))
+        return reply + encode_frame(Opcode.ACK, bytes([seq, 0]))
+
+    def _error(self, code: int, opcode: int) -> bytes:
+        return encode_frame(Opcode.ERROR, bytes([code, opcode]))
+
+
+@dataclass
+class LinkConfig:
+    # 鮑率，用來模擬每個位元組的傳輸時間（8N1，每 byte 10 bits），0 表示不限速
+    baudrate: int = 9600
+    # 每個回應額外的處理延遲與隨機抖動（秒）
+    latency: float = 0.0
+    jitter: float = 0.0
+    # 每個輸入位元組遺失的機率，以及每個位元組（雙向）被翻轉一個 bit 的機率
+    drop_rate: float = 0.0
+    corrupt_rate: float = 0.0
+    # 連線後多久送出開機訊息（真實 UNO 重置約 1.6 秒）；太短時開機訊息可能被 pyserial 開啟時清空的緩衝區吃掉
+    boot_delay: float = 0.2
+    # 連線多久後主動斷線（秒），用於測試重新連線，0 表示不斷線
+    disconnect_after: float = 0.0
+    # 連線時不重置燈光狀態（模擬停用 DTR 自動重置）
+    keep_state: bool = False
+    seed: Optional[int] = None
+
+
+class SimulatedLink:
+    """
+    把 `VirtualArduino` 接到一條位元組流（TCP 連線或 pty），套用鮑率、延遲與錯誤注入。
+
+    每次連線都視為 DTR 觸發的重置：燈光熄滅，經過 `boot_delay` 後送出 `Arduino Ready.`。
+
+    Args:
+        device (VirtualArduino): 模擬的 Arduino。
+        config (LinkConfig): 傳輸特性與錯誤注入設定。
+    """
+
+    def __init__(self, device: VirtualArduino, config: LinkConfig):
+        self.device = device
+        self.config = config
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.sessions = 0
+        self._random = random.Random(config.seed)
+        self._byte_time = 10 / config.baudrate if config.baudrate > 0 else 0.0
+
+    def _noise(self, data: bytes, drop: bool) -> bytes:
+        if not (self.config.corrupt_rate or (drop and self.config.drop_rate)):
+            return data
+        out = bytearray()
+        for byte in data:
+            if drop and self._random.random() < self.config.drop_rate:
+                continue
+            if self._random.random() < self.config.corrupt_rate:
+                byte ^= 1 << self._random.randrange(8)
+            out.append(byte)
+        return bytes(out)
+
+    async def _send(self, write: Callable[[bytes], Awaitable[None]], data: bytes, delay: float = 0.0):
+        delay += len(data) * self._byte_time
+        if delay > 0:
+            await asyncio.sleep(delay)
+        await write(self._noise(data, drop=False))
+        self.bytes_out += len(data)
+
+    async def serve(self, read: Callable[[], Awaitable[bytes]], write: Callable[[bytes], Awaitable[None]], reset: bool = True):
+        """
+        處理一次連線直到對方斷線（`read()` 回傳 `b""`）或到達 `disconnect_after`。
+
+        `reset=False` 表示這次連線 DTR 沒有變化，板子不會重置：燈光保持原狀，也不送出開機訊息。
+        """
+        self.sessions += 1
+        started = time.monotonic()
+        if reset:
+            if not self.config.keep_state:
+                self.device.reset()
+            await self._send(write, READY_BANNER, self.config.boot_delay)
+        while True:
+            if self.config.disconnect_after and time.monotonic() - started >= self.config.disconnect_after:
+                logger.info(f"Simulated disconnect after {self.config.disconnect_after}s")
+                return
+            try:
+                data = await asyncio.wait_for(read(), FRAME_TIMEOUT)
+            except asyncio.TimeoutError:
+                timeout_error = self.device.poll()
+                if timeout_error:
+                    await self._send(write, timeout_error)
+                continue
+            if not data:
+                return
+            self.bytes_in += len(data)
+            # 依鮑率模擬資料傳到 Arduino 所需的時間
+            if self._byte_time:
+                await asyncio.sleep(len(data) * self._byte_time)
+            out = self.device.receive(self._noise(data, drop=True))
+            if out:
+                delay = self.config.latency + (self._random.uniform(0, self.config.jitter) if self.config.jitter else 0)
+                await self._send(write, out, delay)
+
+
+async def serve_tcp(link: SimulatedLink, host: str, port: int) -> asyncio.AbstractServer:
+    """以 TCP 提供模擬的 Arduino，MCP 伺服器可用 `SERIAL_USE_TCP` 或 `socket://` URL 連線。"""
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        peer = writer.get_extra_info("peername")
+        logger.info(f"Client {peer} connected to simulated Arduino on port {port}")
+
+        async def write(data: bytes):
+            writer.write(data)
+            await writer.drain()
+
+        try:
+            await link.serve(lambda: reader.read(1024), write)
+        except (ConnectionError, OSError) as e:
+            logger.info(f"Client {peer} disconnected: {e}")
+        finally:
+            writer.close()
+            logger.info(f"Session with {peer} closed ({link.bytes_in} bytes in, {link.bytes_out} bytes out so far)")
+
+    return await asyncio.start_server(handle, host, port)
+
+
+async def serve_pty(link: SimulatedLink, symlink: Optional[str] = None):
+    """
+    以 pty 提供模擬的 Arduino（僅限 Linux / macOS），MCP 伺服器可用 `SERIAL_PORT=<pty 路徑>` 連線。
+
+    開啟 pty 的程式關閉後會回到等待狀態。與真實的 USB 序列埠相同，以 HUPCL 模擬 DTR：預設關閉時放掉 DTR，
+    下一次開啟時模擬重置；開啟的程式清除 HUPCL 後（例如 `SERIAL_NO_RESET`），之後的開啟不會重置。
+    """
+    master, slave = os.openpty()
+    tty.setraw(slave)
+    attrs = termios.tcgetattr(slave)
+    attrs[2] |= termios.HUPCL
+    termios.tcsetattr(slave, termios.TCSANOW, attrs)
+    path = os.ttyname(slave)
+    if symlink:
+        if os.path.lexists(symlink):
+            os.remove(symlink)
+        os.symlink(path, symlink)
+        path = f"{symlink} -> {path}"
+    # 關閉自己持有的 slave 端，之後才能從 master 端（EIO）得知對方何時開啟、關閉 pty
+    os.close(slave)
+    os.set_blocking(master, False)
+    print(f"Simulated Arduino is available on {path}", flush=True)
+    loop = asyncio.get_running_loop()
+
+    async def read() -> bytes:
+        while True:
+            try:
+                return os.read(master, 1024)
+            except BlockingIOError:
+                pass
+            except OSError as e:
+                if e.errno == errno.EIO:
+                    return b""
+                raise
+            readable = loop.create_future()
+            loop.add_reader(master, lambda: readable.done() or readable.set_result(None))
+            try:
+                await readable
+            finally:
+                loop.remove_reader(master)
+
+    async def write(data: bytes):
+        try:
+            os.write(master, data)
+        except BlockingIOError:
+            pass
+
+    # 板子上電後第一次開啟時 DTR 由低轉高，一定會重置
+    dtr_dropped = True
+    while True:
+        # 沒有程式開啟 slave 端時 master 讀取會回傳 EIO
+        try:
+            os.read(master, 1024)
+        except BlockingIOError:
+            logger.info("pty opened, simulating reset" if dtr_dropped else "pty opened, DTR was kept high (HUPCL cleared), no reset")
+            await link.serve(read, write, reset=dtr_dropped)
+            # 關閉時 HUPCL 仍設定，序列埠會放掉 DTR，下一次開啟時板子重置
+            dtr_dropped = bool(termios.tcgetattr(master)[2] & termios.HUPCL)
+            logger.info(f"pty closed ({link.bytes_in} bytes in, {link.bytes_out} bytes out so far)")
+            continue
+        except OSError as e:
+            if e.errno != errno.EIO:
+                raise
+        await asyncio.sleep(0.05)
+
+
+async def _main(args):
+    config = LinkConfig(
+        baudrate=args.baud,
+        latency=args.latency_ms / 1000,
+        jitter=args.jitter_ms / 1000,
+        drop_rate=args.drop_rate,
+        corrupt_rate=args.corrupt_rate,
+        boot_delay=args.boot_delay,
+        disconnect_after=args.disconnect_after,
+        keep_state=args.keep_state,
+        seed=args.seed,
+    )
+    links = [SimulatedLink(VirtualArduino(args.leds, binary=not args.ascii_only), config) for _ in range(args.boards)]
+    if args.pty:
+        await asyncio.gather(*[
+            serve_pty(link, f"{args.pty_link}{i}" if args.pty_link else None) for i, link in enumerate(links)
+        ])
+        return
+
+    servers = [await serve_tcp(link, args.host, args.port + i) for i, link in enumerate(links)]
+    urls = ",".join(f"socket://{args.host}:{args.port + i}" for i in range(args.boards))
+    print(f"Simulated Arduino is listening on {urls}", flush=True)
+    print(f"Run the MCP server with: SERIAL_PORTS={urls} python -m src.server", flush=True)
+    await asyncio.gather(*[server.serve_forever() for server in servers])
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Run a simulated Arduino of led_serial_port_control.ino")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Host IP to listen on (TCP mode)")
+    parser.add_argument("--port", type=int, default=5555, help="TCP port of the first board, following boards use port+1, port+2, ...")
+    parser.add_argument("--pty", action="store_true", help="Expose each board as a pty instead of TCP")
+    parser.add_argument("--pty-link", type=str, default=None, help="Create a symlink <pty-link><index> to each pty, e.g. /tmp/ttyVIRT")
+    parser.add_argument("--boards", type=int, default=1, help="Number of simulated boards")
+    parser.add_argument("--leds", type=int, default=3, help="Number of LEDs on each board")
+    parser.add_argument("--baud", type=int, default=9600, help="Baud rate used for pacing, 0 to disable pacing")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Extra delay before each reply")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="Random extra delay (0 ~ jitter) before each reply")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="Probability of dropping each received byte")
+    parser.add_argument("--corrupt-rate", type=float, default=0.0, help="Probability of flipping a bit in each byte (both directions)")
+    parser.add_argument("--boot-delay", type=float, default=0.2, help="Seconds between a connection and the 'Arduino Ready.' banner")
+    parser.add_argument("--disconnect-after", type=float, default=0.0, help="Drop each connection after N seconds, 0 to disable")
+    parser.add_argument("--keep-state", action="store_true", help="Do not reset LEDs on connect (like a board without DTR auto-reset)")
+    parser.add_argument("--ascii-only", action="store_true", help="Simulate old firmware without the binary protocol")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed for fault injection")
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(_main(args))
+    except KeyboardInterrupt:
+        pass
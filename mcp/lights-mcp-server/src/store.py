@@ -0,0 +1,80 @@
+import json, logging, os
+from typing import Dict, Generic, List, Optional, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class JsonStore(Generic[T]):
+    """
+    以名稱為鍵、保存在本機 JSON 檔中的儲存區，啟動時載入；場景與群組的儲存區都以此為基礎。
+
+    檔案格式為 `{"version": N, "<key>": {"<name>": {...}}}`，每次新增或刪除都會整個檔案重寫
+    （先寫暫存檔再 `os.replace()`），避免寫到一半時檔案損毀。子類別以 `_decode()` / `_encode()` 轉換每一項。
+
+    Args:
+        path (str): 檔案路徑，檔案不存在時視為沒有任何項目。
+        key (str): 檔案中存放各項目的欄位名稱（例如 `scenes`），也用於記錄訊息。
+        version (int): 寫入檔案的格式版本。
+    """
+
+    def __init__(self, path: str, key: str, version: int):
+        self.path = path
+        self.key = key
+        self.version = version
+        self._items: Dict[str, T] = {}
+        self.load()
+
+    def _decode(self, name: str, data: dict) -> Optional[T]:
+        """由檔案中的一項還原物件，回傳 None 表示略過這一項。"""
+        raise NotImplementedError
+
+    def _encode(self, item: T) -> dict:
+        raise NotImplementedError
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            items = {}
+            for name, value in data.get(self.key, {}).items():
+                item = self._decode(name, value)
+                if item is not None:
+                    items[name] = item
+            self._items = items
+            logger.info(f"Loaded {len(self._items)} {self.key} from {self.path}")
+        except Exception as e:
+            logger.error(f"Load {self.key} from {self.path} error, start with no {self.key}: {e}")
+
+    def _persist(self):
+        data = {
+            "version": self.version,
+            self.key: {name: self._encode(item) for name, item in self._items.items()},
+        }
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def _put(self, name: str, item: T) -> T:
+        """新增或覆寫一項並寫入檔案。"""
+        self._items[name] = item
+        self._persist()
+        return item
+
+    def delete(self, name: str) -> Optional[T]:
+        item = self._items.pop(name, None)
+        if item is not None:
+            self._persist()
+        return item
+
+    def get(self, name: str) -> Optional[T]:
+        return self._items.get(name)
+
+    def all(self) -> List[T]:
+        return [self._items[name] for name in sorted(self._items)]